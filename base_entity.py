@@ -14,6 +14,10 @@ class IEntity:
     def get_from_store(self):
         return self.store.getValues(self.code, self.register, self.value_length)
 
+    def subscribe(self, callback=None):
+        """Refresh the value (or call callback) when a master writes the registers."""
+        self.store.subscribe(self.code, self.register, self.value_length, callback or self.get_value)
+
     def set_value(self, new_value):
         pass
 
@@ -21,17 +25,26 @@ class IEntity:
         pass
 
 class SyncEntity(IEntity):
-    def __init__(self, code, register, value, store, value_length):
-        super().__init__(code, register, value, store, value_length)
-        self.sync =  _thread.allocate_lock()
+    """Entity with its own lock around store access.
+
+    ArrayDataBlock is already safe for the two cores (seqlock), the lock is
+    for dict based DataBlock, where it serialises access through this entity.
+    """
+    def __init__(self, code, register, store, value_length):
+        super().__init__(code, register, store, value_length)
+        self.sync = _thread.allocate_lock()
 
     def set_to_store(self, new_value):
         self.sync.acquire()
-        self.store.setValues(self.code, self.register, new_value)
-        self.sync.release()
+        try:
+            self.store.setValues(self.code, self.register, new_value)
+        finally:
+            self.sync.release()
 
     def get_from_store(self):
         self.sync.acquire()
-        value = self.getValues(self.code, self.register, self.value_length)
-        self.sync.release()
-        return value
\ No newline at end of file
+        try:
+            value = self.store.getValues(self.code, self.register, self.value_length)
+        finally:
+            self.sync.release()
+        return value
@@ -1,3 +1,4 @@
+import time
 from micropython import const
 from ustruct import unpack as unp
 
@@ -35,6 +36,9 @@ BMP280_STANDBY_1000 = const(5)
 BMP280_STANDBY_2000 = const(6)
 BMP280_STANDBY_4000 = const(7)
 
+# Standby time in ms rounded up, by BMP280_STANDBY_*
+_BMP280_STANDBY_MS = (1, 63, 125, 250, 500, 1000, 2000, 4000)
+
 # IIR Filter setting
 BMP280_IIR_FILTER_OFF = const(0)
 BMP280_IIR_FILTER_2 = const(1)
@@ -76,6 +80,17 @@ _BMP280_CASE_MATRIX = [
     [BMP280_POWER_NORMAL, BMP280_OS_ULTRAHIGH, BMP280_IIR_FILTER_16, BMP280_STANDBY_0_5]
 ]
 
+# Pressure compensation: datasheet 64 bit integer (reference), 32 bit integer
+# (no big ints on MicroPython) or floating point formula
+BMP280_COMP_INT64 = const(0)
+BMP280_COMP_INT32 = const(1)
+BMP280_COMP_FLOAT = const(2)
+
+_BMP280_REGISTER_CALIB = const(0x88)
+# T1..T3, P1..P9: 12 little-endian words at 0x88..0x9F, T1 and P1 unsigned
+_BMP280_CALIB_FORMAT = '<HhhHhhhhhhhh'
+_BMP280_CALIB_SIZE = const(24)
+
 _BMP280_REGISTER_ID = const(0xD0)
 _BMP280_REGISTER_RESET = const(0xE0)
 _BMP280_REGISTER_STATUS = const(0xF3)
@@ -86,28 +101,17 @@ _BMP280_REGISTER_DATA = const(0xF7)
 
 
 class BMP280:
-    def __init__(self, i2c_bus, addr=0x76, use_case=BMP280_CASE_HANDHELD_DYN):
+    def __init__(self, i2c_bus, addr=0x76, use_case=BMP280_CASE_HANDHELD_DYN, compensation=BMP280_COMP_INT64,
+                 t_fine_threshold=0, t_fine_interval_ms=1000):
         self._bmp_i2c = i2c_bus
         self._i2c_addr = addr
         self._use_case = use_case
-
-    def initialize(self):
-        # read calibration data
-        # < little-endian
-        # H unsigned short
-        # h signed short
-        self._T1 = unp('<H', self._read(0x88, 2))[0]
-        self._T2 = unp('<h', self._read(0x8A, 2))[0]
-        self._T3 = unp('<h', self._read(0x8C, 2))[0]
-        self._P1 = unp('<H', self._read(0x8E, 2))[0]
-        self._P2 = unp('<h', self._read(0x90, 2))[0]
-        self._P3 = unp('<h', self._read(0x92, 2))[0]
-        self._P4 = unp('<h', self._read(0x94, 2))[0]
-        self._P5 = unp('<h', self._read(0x96, 2))[0]
-        self._P6 = unp('<h', self._read(0x98, 2))[0]
-        self._P7 = unp('<h', self._read(0x9A, 2))[0]
-        self._P8 = unp('<h', self._read(0x9C, 2))[0]
-        self._P9 = unp('<h', self._read(0x9E, 2))[0]
+        # calibration and compensation mode per mux channel, the sensors are behind one address
+        self._calibrations = {}
+        self._compensations = {}
+        self._default_compensation = compensation
+        self.compensation = compensation
+        self._channel = None
 
         # output raw
         self._t_raw = 0
@@ -117,13 +121,74 @@ class BMP280:
         self._p_raw = 0
         self._p = 0
 
-        self.read_wait_ms = 0  # interval between forced measure and readout
-        self._new_read_ms = 200  # interval between
-        self._last_read_ts = 0
-
+        # t_fine is kept while the raw temperature stays within t_fine_threshold
+        # of the value it was computed from, at most t_fine_interval_ms
+        self.t_fine_threshold = t_fine_threshold
+        self.t_fine_interval_ms = t_fine_interval_ms
+        self._t_fine_raw = 0
+        self._t_fine_ts = 0
+        # compensation cache statistics
+        self.p_hits = 0
+        self.p_misses = 0
+        self.t_fine_hits = 0
+        self.t_fine_misses = 0
+
+        # ctrl_meas oversampling bits of the use case, see trigger()
+        p_os, t_os, self.read_wait_ms = _BMP280_OS_MATRIX[BMP280_OS_ULTRALOW]  # interval between forced measure and readout
+        self._ctrl_meas = (p_os << 2) + (t_os << 5)
+        self._new_read_ms = 200  # interval between new conversions in normal mode, see use_case
+        self._last_read_ts = None  # ticks_ms of the last data read, None - read on the next call
+        # forced mode: data is new only after trigger()
+        self._forced = False
+        self._triggered = False
+        # read state of every channel, swapped by select()
+        self._states = {}
+        self.fresh = False  # the last read got new data from the sensor
+        self.reads = 0
+        self.skipped_reads = 0
+
+    def initialize(self, channel=0):
+        """Read calibration of the sensor on the active mux channel and configure it."""
+        # one burst instead of a transaction per word
+        self._calibrations[channel] = unp(_BMP280_CALIB_FORMAT, self._read(_BMP280_REGISTER_CALIB, _BMP280_CALIB_SIZE))
+        self._states[channel] = [None, False, 0, 0, 0, 0, 0, False, 0, 0]
+        if channel == self._channel:
+            # drop the state of the channel, it is read again
+            self._channel = None
+        self.select(channel)
+        self.configure()
+
+    def configure(self):
         if self._use_case is not None:
             self.use_case(self._use_case)
 
+    def select(self, channel):
+        """Use the cached calibration of the channel, no I2C. False if it was not initialized."""
+        if channel == self._channel:
+            return True
+        calibration = self._calibrations.get(channel)
+        if calibration is None:
+            return False
+        state = self._states.get(self._channel)
+        if state is not None:
+            state[0] = self._last_read_ts
+            state[1] = self._triggered
+            state[2] = self._p_raw
+            state[3] = self._t_raw
+            state[4] = self._t_fine
+            state[5] = self._t
+            state[6] = self._p
+            state[7] = self.fresh
+            state[8] = self._t_fine_raw
+            state[9] = self._t_fine_ts
+        (self._T1, self._T2, self._T3, self._P1, self._P2, self._P3,
+         self._P4, self._P5, self._P6, self._P7, self._P8, self._P9) = calibration
+        (self._last_read_ts, self._triggered, self._p_raw, self._t_raw,
+         self._t_fine, self._t, self._p, self.fresh, self._t_fine_raw, self._t_fine_ts) = self._states[channel]
+        self.compensation = self._compensations.get(channel, self._default_compensation)
+        self._channel = channel
+        return True
+
     def _read(self, addr, size=1):
         return self._bmp_i2c.readfrom_mem(self._i2c_addr, addr, size)
 
@@ -132,20 +197,82 @@ class BMP280:
             b_arr = bytearray([b_arr])
         return self._bmp_i2c.writeto_mem(self._i2c_addr, addr, b_arr)
 
+    def has_new_data(self):
+        """True if the selected channel may have a conversion that was not read yet, no I2C."""
+        if self._forced:
+            return self._triggered
+        if self._last_read_ts is None:
+            return True
+        return time.ticks_diff(time.ticks_ms(), self._last_read_ts) >= self._new_read_ms
+
     def _gauge(self):
-        # TODO limit new reads
+        # no new conversion since the last read: keep the cached values, no I2C
+        if not self.has_new_data():
+            self.fresh = False
+            self.skipped_reads += 1
+            return
         # read all data at once (as by spec)
         d = self._read(_BMP280_REGISTER_DATA, 6)
-        # Oversampling = 0. Happens after reset
+        # Oversampling = 0. Happens after reset, calibration is kept in NVM
         if d[:3] == bytes((0x80, 0x00, 0x00)):
-            self.initialize()
+            self.configure()
             d = self._read(_BMP280_REGISTER_DATA, 6)
-        self._p_raw = (d[0] << 12) + (d[1] << 4) + (d[2] >> 4)
-        self._t_raw = (d[3] << 12) + (d[4] << 4) + (d[5] >> 4)
+        p_raw = (d[0] << 12) + (d[1] << 4) + (d[2] >> 4)
+        t_raw = (d[3] << 12) + (d[4] << 4) + (d[5] >> 4)
+        now = time.ticks_ms()
+        self._last_read_ts = now
+        self._triggered = False
+        self.fresh = True
+        self.reads += 1
+
+        # the compensated values are kept while the raw words they were computed from are the same
+        if t_raw != self._t_raw:
+            self._t_raw = t_raw
+            self._t = 0
+        if self._t_fine != 0 and t_raw != self._t_fine_raw and (
+                abs(t_raw - self._t_fine_raw) > self.t_fine_threshold
+                or time.ticks_diff(now, self._t_fine_ts) >= self.t_fine_interval_ms):
+            self._t_fine = 0
+            self._t = 0
+            self._p = 0
+        if p_raw != self._p_raw:
+            self._p_raw = p_raw
+            self._p = 0
+
+    def trigger(self):
+        """Start one forced mode conversion (one write), read it after read_wait_ms."""
+        self._write(_BMP280_REGISTER_CONTROL, self._ctrl_meas + BMP280_POWER_FORCED)
+        # the sensor goes to sleep after the conversion
+        self._forced = True
+        self._triggered = True
+
+    def read_raw(self):
+        """Read the raw values of the last conversion, see compensate()."""
+        self._gauge()
 
-        self._t_fine = 0
-        self._t = 0
-        self._p = 0
+    def compensate(self):
+        """Pressure in hPa of the raw values read last, no I2C."""
+        # same raw words as the last compensation: nothing to compute
+        if self._p != 0:
+            self.p_hits += 1
+            return self._p / 100
+        self.p_misses += 1
+        if self._t_fine == 0:
+            self._update_t_fine()
+        else:
+            self.t_fine_hits += 1
+        if self.compensation == BMP280_COMP_INT32:
+            self._p = self._compensate_p_int32()
+        elif self.compensation == BMP280_COMP_FLOAT:
+            self._p = self._compensate_p_float()
+        else:
+            self._p = self._compensate_p_int64()
+        return self._p / 100 # давление в мбар
+
+    @property
+    def data_ready(self):
+        """False if the last read returned the reset value of the pressure registers."""
+        return self._p_raw != 0x80000
 
     def reset(self):
         self._write(_BMP280_REGISTER_RESET, 0xB6)
@@ -183,15 +310,24 @@ class BMP280:
         print("P9: {} {}".format(self._P9, type(self._P9)))
 
     def _calc_t_fine(self):
-        # From datasheet page 22
         self._gauge()
         if self._t_fine == 0:
-            var1 = (((self._t_raw >> 3) - (self._T1 << 1)) * self._T2) >> 11
-            var2 = (((((self._t_raw >> 4) - self._T1)
-                      * ((self._t_raw >> 4)
-                         - self._T1)) >> 12)
-                    * self._T3) >> 14
-            self._t_fine = var1 + var2
+            self._update_t_fine()
+
+    def _update_t_fine(self):
+        self._t_fine = self._compensate_t_fine()
+        self._t_fine_raw = self._t_raw
+        self._t_fine_ts = time.ticks_ms()
+        self.t_fine_misses += 1
+
+    def _compensate_t_fine(self):
+        # From datasheet page 22, fits 32 bits
+        var1 = (((self._t_raw >> 3) - (self._T1 << 1)) * self._T2) >> 11
+        var2 = (((((self._t_raw >> 4) - self._T1)
+                  * ((self._t_raw >> 4)
+                     - self._T1)) >> 12)
+                * self._T3) >> 14
+        return var1 + var2
 
     @property
     def temperature(self):
@@ -202,27 +338,83 @@ class BMP280:
 
     @property
     def pressure(self):
-        # From datasheet page 22
-        self._calc_t_fine()
-        if self._p == 0:
-            var1 = self._t_fine - 128000
-            var2 = var1 * var1 * self._P6
-            var2 = var2 + ((var1 * self._P5) << 17)
-            var2 = var2 + (self._P4 << 35)
-            var1 = ((var1 * var1 * self._P3) >> 8) + ((var1 * self._P2) << 12)
-            var1 = (((1 << 47) + var1) * self._P1) >> 33
-
-            if var1 == 0:
-                return 0
-
-            p = 1048576 - self._p_raw
-            p = int((((p << 31) - var2) * 3125) / var1)
-            var1 = (self._P9 * (p >> 13) * (p >> 13)) >> 25
-            var2 = (self._P8 * p) >> 19
-
-            p = ((p + var1 + var2) >> 8) + (self._P7 << 4)
-            self._p = p / 256.0
-        return self._p / 100 # давление в мбар
+        self._gauge()
+        return self.compensate()
+
+    def set_compensation(self, mode, channel=None):
+        """Select the pressure compensation of a channel (BMP280_COMP_*), None - the default."""
+        assert mode in (BMP280_COMP_INT64, BMP280_COMP_INT32, BMP280_COMP_FLOAT)
+        if channel is None:
+            self._default_compensation = mode
+        else:
+            self._compensations[channel] = mode
+        if channel is None or channel == self._channel:
+            self.compensation = self._compensations.get(self._channel, self._default_compensation)
+        # cached pressures were computed with the previous formula
+        self._p = 0
+        for state in self._states.values():
+            state[6] = 0
+
+    def _compensate_p_int64(self):
+        # From datasheet page 22, pressure in Pa
+        var1 = self._t_fine - 128000
+        var2 = var1 * var1 * self._P6
+        var2 = var2 + ((var1 * self._P5) << 17)
+        var2 = var2 + (self._P4 << 35)
+        var1 = ((var1 * var1 * self._P3) >> 8) + ((var1 * self._P2) << 12)
+        var1 = (((1 << 47) + var1) * self._P1) >> 33
+
+        if var1 == 0:
+            return 0
+
+        p = 1048576 - self._p_raw
+        p = int((((p << 31) - var2) * 3125) / var1)
+        var1 = (self._P9 * (p >> 13) * (p >> 13)) >> 25
+        var2 = (self._P8 * p) >> 19
+
+        p = ((p + var1 + var2) >> 8) + (self._P7 << 4)
+        return p / 256.0
+
+    def _compensate_p_int32(self):
+        # bmp280_compensate_P_int32 from the datasheet (section 8.2), pressure in Pa.
+        # Terms that would exceed 30 bits are split so all values stay small ints
+        var1 = (self._t_fine >> 1) - 64000
+        var2 = (((var1 >> 2) * (var1 >> 2)) >> 11) * self._P6
+        var2 = var2 + ((var1 * self._P5) << 1)
+        var2 = (var2 >> 2) + (self._P4 << 16)
+        var1 = (((self._P3 * (((var1 >> 2) * (var1 >> 2)) >> 13)) >> 3) + ((self._P2 * var1) >> 1)) >> 18
+        # ((32768 + var1) * P1) >> 15
+        var1 = self._P1 + ((var1 * self._P1) >> 15)
+        if var1 <= 0:
+            return 0
+        p = (1048576 - self._p_raw) - (var2 >> 12)
+        # p * 3125 doesn't fit: divide the quotient and the remainder separately
+        quotient, remainder = divmod(p, var1)
+        if p < 687195:
+            # (p * 3125 << 1) / var1
+            p = quotient * 6250 + (remainder * 6250) // var1
+        else:
+            # (p * 3125 / var1) * 2
+            p = (quotient * 3125 + (remainder * 3125) // var1) * 2
+        var1 = (self._P9 * (((p >> 3) * (p >> 3)) >> 13)) >> 12
+        var2 = ((p >> 2) * self._P8) >> 13
+        return p + ((var1 + var2 + self._P7) >> 4)
+
+    def _compensate_p_float(self):
+        # bmp280_compensate_P_double from the datasheet (section 8.1), pressure in Pa
+        var1 = self._t_fine / 2.0 - 64000.0
+        var2 = var1 * var1 * self._P6 / 32768.0
+        var2 = var2 + var1 * self._P5 * 2.0
+        var2 = var2 / 4.0 + self._P4 * 65536.0
+        var1 = (self._P3 * var1 * var1 / 524288.0 + self._P2 * var1) / 524288.0
+        var1 = (1.0 + var1 / 32768.0) * self._P1
+        if var1 == 0.0:
+            return 0
+        p = 1048576.0 - self._p_raw
+        p = (p - var2 / 4096.0) * 6250.0 / var1
+        var1 = self._P9 * p * p / 2147483648.0
+        var2 = p * self._P8 / 32768.0
+        return p + (var1 + var2 + self._P7) / 16.0
 
     def _write_bits(self, address, value, length, shift=0):
         d = self._read(address)[0]
@@ -318,8 +510,15 @@ class BMP280:
         assert 0 <= uc <= 5
         pm, oss, iir, sb = _BMP280_CASE_MATRIX[uc]
         p_os, t_os, self.read_wait_ms = _BMP280_OS_MATRIX[oss]
+        self._ctrl_meas = (p_os << 2) + (t_os << 5)
+        # output data period in normal mode: measurement and standby
+        self._new_read_ms = self.read_wait_ms + _BMP280_STANDBY_MS[sb]
+        self._forced = pm == BMP280_POWER_FORCED
+        # writing forced mode starts a conversion
+        self._triggered = self._forced
+        self._last_read_ts = None
         self._write(_BMP280_REGISTER_CONFIG, (iir << 2) + (sb << 5))
-        self._write(_BMP280_REGISTER_CONTROL, pm + (p_os << 2) + (t_os << 5))
+        self._write(_BMP280_REGISTER_CONTROL, pm + self._ctrl_meas)
 
     def oversample(self, oss):
         assert 0 <= oss <= 4
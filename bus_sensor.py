@@ -1,6 +1,6 @@
 import time
-from entity import IntEntity, FloatEntity
-from parameters import VacuumErrors, VP, I2C_RETRIES, BMP280_NO_DATA_AVAILABLE
+from parameters import VacuumErrors, VP, I2C_RETRIES, FILTER_MAX_WINDOW
+from pressure_filter import PressureFilter
 from machine import I2C, Pin
 
 
@@ -17,25 +17,36 @@ class Bus:
         value = 1 << bus
         for retry_num in range(I2C_RETRIES):
             write_result = self.__i2c_bus.writeto(self.__address, value.to_bytes(1,'big'))
-            if not write_result:
-                print(f'Not switched on try {retry_num}')
-                if retry_num == I2C_RETRIES - 1:
-                    print('Switch bus error')
-                    return False
+            if write_result:
+                break
+            print(f'Not switched on try {retry_num}')
+            if retry_num == I2C_RETRIES - 1:
+                print('Switch bus error')
+                return False
         self.__active_sensor = bus
         return True
 
 
 class BusSensor:
     """Класс для считывания показаний с датчика давления."""
-    def __init__(self, bus, bus_number, sensor, store, samples=64, error_store_num=0, pressure_store_num=0):
+    def __init__(self, bus, bus_number, sensor, error, pressure, samples=VP.samples,
+                 compensation=None, filter_type=None, filter_window=None):
         self.__bus = bus
         self.__bus_number = bus_number
         self.__samples = samples
         self.__sensor = sensor
-        self.error = IntEntity(error_store_num, 0, store)
-        self.pressure = FloatEntity(pressure_store_num, float(0), store)
+        # тип и окно фильтра - сущности регистров или постоянные VP.filter_type / samples
+        self.filter_type = filter_type
+        self.filter_window = filter_window
+        self.filter = PressureFilter(self.__filter_kind(), self.__filter_size())
+        self.raw_value = 0
+        if compensation is not None:
+            # расчёт давления для этого канала, по умолчанию - как у датчика
+            sensor.set_compensation(compensation, bus_number)
+        self.error = error
+        self.pressure = pressure
         self.last_update_time = 0
+        self.triggered = False
         self.initialize()
 
     def initialize(self):
@@ -44,7 +55,7 @@ class BusSensor:
             return
         for retry_num in range(I2C_RETRIES):
             try:
-                self.__sensor.initialize()
+                self.__sensor.initialize(self.__bus_number)
                 break
             except:
                 print(f'Sensor init error on try {retry_num}')
@@ -55,10 +66,13 @@ class BusSensor:
         self.error.set_value(VacuumErrors.NoError)
 
     def update_pressure(self):
-        if not self.__bus.switch_to_sensor(self.__bus_number):
-            self.error.set_value(VacuumErrors.SwitchBusError)
+        """Считать давление сразу (датчик в normal режиме), без BusAcquisition."""
+        if self.__sensor.select(self.__bus_number) and not self.__sensor.has_new_data():
+            # новое измерение ещё не готово - ни переключения шины, ни чтения
+            self.check_time_error()
+            return
+        if not self.__switch():
             return
-        old_val = self.pressure.value
         for retry_num in range(I2C_RETRIES):
             try:
                 new_val = self.__sensor.pressure
@@ -68,15 +82,89 @@ class BusSensor:
                 if retry_num == I2C_RETRIES - 1:
                     self.error.set_value(VacuumErrors.InitSensorError)
                     return
-        # Проверка на подвисание показаний давления
-        if old_val != new_val and new_val != BMP280_NO_DATA_AVAILABLE:
-            self.pressure.set_value(new_val)
+        if not self.__sensor.fresh:
+            # у датчика нет нового измерения, I2C не было
+            self.check_time_error()
+            return
+        self.publish(new_val)
+
+    def trigger(self):
+        """Запустить измерение в forced режиме, результат забирает collect()."""
+        self.triggered = False
+        if not self.__switch():
+            return False
+        for retry_num in range(I2C_RETRIES):
+            try:
+                self.__sensor.trigger()
+                break
+            except Exception as e:
+                print(f'Trigger error on try {retry_num}: {str(e)}')
+                if retry_num == I2C_RETRIES - 1:
+                    self.error.set_value(VacuumErrors.InitSensorError)
+                    return False
+        self.triggered = True
+        return True
+
+    def collect(self):
+        """Забрать результат измерения, запущенного trigger()."""
+        if not self.triggered:
+            return
+        self.triggered = False
+        if not self.__switch():
+            return
+        for retry_num in range(I2C_RETRIES):
+            try:
+                self.__sensor.read_raw()
+                break
+            except Exception as e:
+                print(f'Read pressure error on try {retry_num}: {str(e)}')
+                if retry_num == I2C_RETRIES - 1:
+                    self.error.set_value(VacuumErrors.InitSensorError)
+                    return
+        if not self.__sensor.fresh:
+            self.check_time_error()
+            return
+        self.publish(self.__sensor.compensate())
+
+    def publish(self, new_val):
+        """Пропустить новое значение через фильтр и опубликовать."""
+        # Проверка на подвисание показаний давления (по необработанным значениям)
+        if self.raw_value != new_val and self.__sensor.data_ready:
+            self.raw_value = new_val
+            kind = self.__filter_kind()
+            size = self.__filter_size()
+            if kind != self.filter.kind or size != self.filter.window:
+                self.filter.configure(kind, size)
+            filtered = self.filter.add(int(new_val * 100 + 0.5))
+            self.pressure.set_value(filtered / 100)
             self.last_update_time = time.ticks_ms()
         else:
             self.check_time_error()
             return
         self.error.set_value(VacuumErrors.NoError)
 
+    def __filter_kind(self):
+        if self.filter_type is None:
+            return VP.filter_type
+        return self.filter_type.value
+
+    def __filter_size(self):
+        if self.filter_window is None:
+            size = self.__samples
+        else:
+            size = self.filter_window.value
+        return max(1, min(size, FILTER_MAX_WINDOW))
+
+    def __switch(self):
+        if not self.__bus.switch_to_sensor(self.__bus_number):
+            self.error.set_value(VacuumErrors.SwitchBusError)
+            return False
+        # датчик общий для всех каналов: берём калибровку этого канала
+        if not self.__sensor.select(self.__bus_number):
+            self.initialize()
+            return False
+        return True
+
     def check_time_error(self):
         interval = time.ticks_diff(time.ticks_ms(), self.last_update_time)
         #если время нормального обновления больше заданного интервала - ошибка
@@ -84,3 +172,37 @@ class BusSensor:
             self.error.set_value(VacuumErrors.UpdateTimeError)
         else:
             self.error.set_value(VacuumErrors.NoError)
+
+
+class BusAcquisition:
+    """Конвейерный опрос датчиков за мультиплексором в forced режиме.
+
+    Сначала запускаются измерения всех датчиков, затем результаты забираются
+    вторым проходом: время преобразования (read_wait_ms) идёт у всех датчиков
+    одновременно, а не складывается. poll() не блокирует - вызывается каждый
+    такт и забирает только готовые результаты.
+    """
+    def __init__(self, sensors, sensor):
+        self.sensors = sensors
+        self.sensor = sensor
+        self.trigger_times = [0] * len(sensors)
+        self.collecting = False
+        self.next = 0
+        self.cycles = 0
+
+    def poll(self):
+        if self.collecting:
+            # +1: ticks_ms округляет вниз
+            wait_ms = self.sensor.read_wait_ms + 1
+            while self.next < len(self.sensors):
+                if time.ticks_diff(time.ticks_ms(), self.trigger_times[self.next]) < wait_ms:
+                    return
+                self.sensors[self.next].collect()
+                self.next += 1
+            self.collecting = False
+            self.cycles += 1
+        for idx, bus_sensor in enumerate(self.sensors):
+            bus_sensor.trigger()
+            self.trigger_times[idx] = time.ticks_ms()
+        self.collecting = True
+        self.next = 0
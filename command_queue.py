@@ -0,0 +1,56 @@
+import time
+from array import array
+
+
+class CommandQueue:
+    """Очередь команд фиксированного размера: один писатель (ядро Modbus), один читатель (ядро управления).
+
+    Команда - номер записи карты регистров, значение и время постановки (ticks_us).
+    Память выделяется один раз. Писатель меняет только tail, читатель только head,
+    поэтому блокировки не нужны. При переполнении команда отбрасывается,
+    считается overflows и выставляется resync - читатель перечитывает все
+    управляющие регистры из хранилища, так что запись мастера не теряется.
+    """
+    def __init__(self, size=16):
+        if size & (size - 1):
+            raise ValueError("size must be a power of two")
+        self.size = size
+        self.codes = array("H", bytes(2 * size))
+        self.values = array("H", bytes(2 * size))
+        self.times = array("L", [0] * size)
+        # счётчики по модулю 2 * size, чтобы отличать полную очередь от пустой
+        self.head = 0
+        self.tail = 0
+        self.overflows = 0
+        self.resync = False
+
+    def __len__(self):
+        return (self.tail - self.head) & (2 * self.size - 1)
+
+    def push(self, code, value):
+        tail = self.tail
+        if ((tail - self.head) & (2 * self.size - 1)) == self.size:
+            self.overflows += 1
+            self.resync = True
+            return False
+        idx = tail & (self.size - 1)
+        self.codes[idx] = code
+        self.values[idx] = value
+        self.times[idx] = time.ticks_us()
+        # индекс сдвигается после записи команды
+        self.tail = (tail + 1) & (2 * self.size - 1)
+        return True
+
+    def drain(self, handler):
+        """Передать все команды в handler(code, value, latency_us), вернуть их число."""
+        head = self.head
+        tail = self.tail
+        count = 0
+        now = time.ticks_us()
+        while head != tail:
+            idx = head & (self.size - 1)
+            handler(self.codes[idx], self.values[idx], time.ticks_diff(now, self.times[idx]))
+            head = (head + 1) & (2 * self.size - 1)
+            self.head = head
+            count += 1
+        return count
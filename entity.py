@@ -24,16 +24,17 @@ class ArrayEntity(IEntity):
         return False
 
     def get_value(self):
-        self.value = self.get_from_store()
+        self.value = list(self.get_from_store())
         return self.value.copy()
 
 class IntEntity(IEntity):
-    def __init__(self, register, value, store, code=3):
-        if not store.validate(code, register, 1):
+    def __init__(self, register, value, store, code=3, validate=True):
+        if validate and not store.validate(code, register, 1):
             raise RegisterAddressException(f"[ code : {code} | register : {register} | value : {value} | type : {str(type(value))} ]")
         if not isinstance(value, int):
             raise ValueTypeException(f"Expected type int [ code : {code} | register : {register} | value : {value} | type : {str(type(value))} ]")
         super().__init__(code, register, store, 1)
+        self.view = store.get_view(code, register, "H")
         self.set_value(value)
 
     def set_value(self, new_value):
@@ -41,13 +42,19 @@ class IntEntity(IEntity):
             return False
         if self.value != new_value:
             self.value = new_value
-            self.set_to_store(new_value)
+            if self.view is not None:
+                self.view.set(new_value)
+            else:
+                self.set_to_store(new_value)
             return True
         return False
 
     def get_value(self):
         """ Считать данные из регистра и вернуть."""
-        new_value = self.get_from_store()[0]
+        if self.view is not None:
+            new_value = self.view.get()
+        else:
+            new_value = self.get_from_store()[0]
         if self.value != new_value:
             self.value = new_value
             #print(f"New int value: {str(self.value)}")
@@ -57,12 +64,18 @@ class IntEntity(IEntity):
         self.set_value(self.value + 1)
 
 class FloatEntity(IEntity):
-    def __init__(self, register, value, store, code=3):
-        if not store.validate(code, register, 2):
+    """float32 в двух регистрах.
+
+    По умолчанию порядок как у encode_float на RP2040: младшее слово первым,
+    младший байт слова первым.
+    """
+    def __init__(self, register, value, store, code=3, validate=True, word_order="little", byte_order="little"):
+        if validate and not store.validate(code, register, 2):
             raise RegisterAddressException(f"[ code : {code} | register : {register} | value : {value} | type : {str(type(value))} ]")
         if not isinstance(value, float):
             raise ValueTypeException(f"Expected type float [ code : {code} | register : {register} | value : {value} | type : {str(type(value))} ]")
         super().__init__(code, register, store, 2)
+        self.view = store.get_view(code, register, "f", word_order, byte_order)
         self.set_value(value)
 
     def set_value(self, new_value):
@@ -70,16 +83,22 @@ class FloatEntity(IEntity):
             return False
         if self.value != new_value:
             self.value = new_value
-            ar = encode_float(new_value)
-            val_to_write = get_values_from_bytes(ar)
-            self.set_to_store(val_to_write)
+            if self.view is not None:
+                self.view.set(new_value)
+            else:
+                ar = encode_float(new_value)
+                val_to_write = get_values_from_bytes(ar)
+                self.set_to_store(val_to_write)
             return True
         return False
 
     def get_value(self, num_of_dec=4):
-        values = self.get_from_store()
-        array_value = get_bytes_from_values(values)
-        result = decode_to_float(array_value)
+        if self.view is not None:
+            result = self.view.get()
+        else:
+            values = self.get_from_store()
+            array_value = get_bytes_from_values(values)
+            result = decode_to_float(array_value)
         if num_of_dec > 0:
             self.value = round(result, num_of_dec)
         else:
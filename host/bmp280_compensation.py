@@ -0,0 +1,139 @@
+"""Accuracy and cost of the BMP280 pressure compensation modes.
+
+Compares the 32 bit integer and float formulas with the 64 bit reference on
+the datasheet test calibration (load_test_calibration / load_test_data) and on
+a sweep of raw pressure and temperature values, then times one compensation.
+On the board the allocated bytes are taken from gc.mem_alloc(); on CPython the
+script counts the integer results that do not fit a MicroPython small int
+(31 bit signed), every one of them is a heap allocated big int on the board.
+Floats are heap objects on the rp2 port as well. Runs on CPython and on the board, e.g.
+
+    python host/bmp280_compensation.py
+"""
+import gc
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bmp280
+
+MODES = (
+    ("int64", bmp280.BMP280_COMP_INT64),
+    ("int32", bmp280.BMP280_COMP_INT32),
+    ("float", bmp280.BMP280_COMP_FLOAT),
+)
+# raw values of 300..1100 hPa and -20..60 C with the test calibration
+P_RAW = range(250000, 600001, 500)
+T_RAW = range(420000, 620001, 20000)
+
+
+def compensate(sensor, mode, t_raw, p_raw):
+    sensor.compensation = mode
+    sensor._t_raw = t_raw
+    sensor._p_raw = p_raw
+    sensor._t_fine = sensor._compensate_t_fine()
+    if mode == bmp280.BMP280_COMP_INT32:
+        return sensor._compensate_p_int32()
+    if mode == bmp280.BMP280_COMP_FLOAT:
+        return sensor._compensate_p_float()
+    return sensor._compensate_p_int64()
+
+
+def accuracy(sensor):
+    result = {}
+    sensor.load_test_data()
+    reference = compensate(sensor, bmp280.BMP280_COMP_INT64, sensor._t_raw, sensor._p_raw)
+    for name, mode in MODES[1:]:
+        test_value = compensate(sensor, mode, 519888, 415148)
+        max_error = 0.0
+        for t_raw in T_RAW:
+            for p_raw in P_RAW:
+                expected = compensate(sensor, bmp280.BMP280_COMP_INT64, t_raw, p_raw)
+                error = abs(compensate(sensor, mode, t_raw, p_raw) - expected)
+                if error > max_error:
+                    max_error = error
+        result[name] = {"test_data_pa": test_value, "reference_pa": reference,
+                        "max_error_pa": round(max_error, 3)}
+    return result
+
+
+class SmallIntCheck(int):
+    """int that counts arithmetic results outside the MicroPython small int range."""
+    big = 0
+
+    @classmethod
+    def wrap(cls, value):
+        if value is NotImplemented or isinstance(value, float):
+            return value
+        if not -0x40000000 <= value <= 0x3FFFFFFF:
+            cls.big += 1
+        return cls(value)
+
+
+def _checked(name):
+    method = getattr(int, name)
+    return lambda self, *args: SmallIntCheck.wrap(method(self, *args))
+
+
+for _name in ("__add__", "__radd__", "__sub__", "__rsub__", "__mul__", "__rmul__", "__floordiv__",
+              "__rfloordiv__", "__truediv__", "__rtruediv__", "__lshift__", "__rshift__", "__neg__"):
+    setattr(SmallIntCheck, _name, _checked(_name))
+SmallIntCheck.__divmod__ = lambda self, other: tuple(SmallIntCheck.wrap(v) for v in int.__divmod__(self, other))
+
+
+CALIBRATION = ("_T1", "_T2", "_T3", "_P1", "_P2", "_P3", "_P4", "_P5", "_P6", "_P7", "_P8", "_P9")
+
+
+def heap_values(sensor, mode):
+    """Number of big ints created by one compensation (CPython)."""
+    calibration = [getattr(sensor, name) for name in CALIBRATION]
+    for name, value in zip(CALIBRATION, calibration):
+        setattr(sensor, name, SmallIntCheck(value))
+    SmallIntCheck.big = 0
+    compensate(sensor, mode, SmallIntCheck(519888), SmallIntCheck(415148))
+    for name, value in zip(CALIBRATION, calibration):
+        setattr(sensor, name, value)
+    return SmallIntCheck.big
+
+
+def ticks_us():
+    if hasattr(time, "ticks_us"):
+        return time.ticks_us()
+    return time.perf_counter() * 1000000
+
+
+def cost(sensor, count=2000):
+    result = {}
+    for name, mode in MODES:
+        compensate(sensor, mode, 519888, 415148)
+        gc.collect()
+        start = ticks_us()
+        for _ in range(count):
+            compensate(sensor, mode, 519888, 415148)
+        stop = ticks_us()
+        result[name] = {"us_per_call": round((stop - start) / count, 3)}
+        if hasattr(gc, "mem_alloc"):
+            gc.collect()
+            gc.disable()
+            before = gc.mem_alloc()
+            for _ in range(count):
+                compensate(sensor, mode, 519888, 415148)
+            result[name]["bytes_per_call"] = round((gc.mem_alloc() - before) / count, 1)
+            gc.enable()
+        else:
+            result[name]["big_ints_per_call"] = heap_values(sensor, mode)
+    return result
+
+
+def main():
+    sensor = bmp280.BMP280(None)
+    sensor.load_test_calibration()
+    print("accuracy against int64:", accuracy(sensor))
+    print("cost:", cost(sensor))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""Replay of raw BMP280 words through the compensation cache.
+
+A trace is a text file, one read per line: ms, mux channel, raw temperature,
+raw pressure. "# calib <channel> T1 .. P9" lines hold the calibration of each
+channel. The replay feeds the trace to bmp280.BMP280 through a stand-in I2C
+and compares the cached compensation (t_fine kept within a threshold of the
+raw temperature, pressure kept while the raw words repeat) with a full
+compensation of every read: hit rates, time per read and the largest
+difference in Pa. Record on the board (sensors behind the TCA mux, forced
+mode, as the firmware polls them) and replay on CPython, e.g.
+
+    import bmp280_trace; bmp280_trace.record("trace.txt", 60)    # on the board
+    python host/bmp280_trace.py trace.txt
+    python host/bmp280_trace.py --synthetic trace.txt              # generate a pump-down trace
+"""
+import json
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import machine
+import bmp280
+from parameters import (BMP280_COMPENSATION, BMP280_T_FINE_THRESHOLD, BMP280_T_FINE_INTERVAL_MS,
+                        I2C_NUM, I2C_SDA, I2C_SCL, I2C_FREQ, VP)
+
+CHANNELS = 4
+
+
+def record(path, seconds=60, channels=CHANNELS):
+    """Record forced mode reads of all channels for seconds (on the board)."""
+    from bus_sensor import Bus
+    i2c = machine.I2C(I2C_NUM, sda=machine.Pin(I2C_SDA), scl=machine.Pin(I2C_SCL), freq=I2C_FREQ)
+    bus = Bus(i2c)
+    sensor = bmp280.BMP280(i2c, VP.sensor_address, bmp280.BMP280_CASE_HANDHELD_DYN)
+    with open(path, "w") as trace:
+        for channel in range(channels):
+            bus.switch_to_sensor(channel)
+            sensor.initialize(channel)
+            trace.write("# calib %d %s\n" % (channel, " ".join(str(v) for v in sensor._calibrations[channel])))
+        start = time.ticks_ms()
+        while time.ticks_diff(time.ticks_ms(), start) < seconds * 1000:
+            for channel in range(channels):
+                bus.switch_to_sensor(channel)
+                sensor.select(channel)
+                sensor.trigger()
+            time.sleep_ms(sensor.read_wait_ms + 1)
+            for channel in range(channels):
+                bus.switch_to_sensor(channel)
+                sensor.select(channel)
+                sensor.read_raw()
+                trace.write("%d %d %d %d\n" % (time.ticks_diff(sensor._last_read_ts, start),
+                                               channel, sensor._t_raw, sensor._p_raw))
+
+
+def load(path):
+    calibrations = {}
+    rows = []
+    with open(path) as trace:
+        for line in trace:
+            fields = line.split()
+            if not fields:
+                continue
+            if fields[0] == "#":
+                if fields[1] == "calib":
+                    calibrations[int(fields[2])] = tuple(int(v) for v in fields[3:])
+                continue
+            rows.append(tuple(int(v) for v in fields))
+    return calibrations, rows
+
+
+class TraceI2C:
+    """I2C stand-in: calibration and data registers of the current trace row."""
+    def __init__(self, calibrations):
+        self.calibrations = calibrations
+        self.channel = 0
+        self.data = bytes(6)
+
+    def set_row(self, channel, t_raw, p_raw):
+        self.channel = channel
+        self.data = bytes((p_raw >> 12, (p_raw >> 4) & 0xFF, (p_raw & 0xF) << 4,
+                           t_raw >> 12, (t_raw >> 4) & 0xFF, (t_raw & 0xF) << 4))
+
+    def readfrom_mem(self, addr, register, size):
+        if register == 0x88:
+            return struct.pack("<HhhHhhhhhhhh", *self.calibrations[self.channel])
+        return self.data[:size]
+
+    def writeto_mem(self, addr, register, data):
+        pass
+
+
+def replay(calibrations, rows, compensation=BMP280_COMPENSATION, threshold=BMP280_T_FINE_THRESHOLD,
+           interval_ms=BMP280_T_FINE_INTERVAL_MS, cached=True):
+    """Pressures (Pa) of every row, statistics and the time per read."""
+    i2c = TraceI2C(calibrations)
+    sensor = bmp280.BMP280(i2c, use_case=bmp280.BMP280_CASE_WEATHER, compensation=compensation,
+                           t_fine_threshold=threshold, t_fine_interval_ms=interval_ms)
+    for channel in sorted(calibrations):
+        i2c.channel = channel
+        sensor.initialize(channel)
+    now = [0]
+    ticks_ms = time.ticks_ms
+    # trace time instead of the clock
+    time.ticks_ms = lambda: now[0]
+    pressures = []
+    elapsed = 0.0
+    try:
+        for ms, channel, t_raw, p_raw in rows:
+            now[0] = ms
+            i2c.set_row(channel, t_raw, p_raw)
+            start = time.perf_counter()
+            sensor.select(channel)
+            sensor._triggered = True
+            sensor.read_raw()
+            if not cached:
+                sensor._t_fine = 0
+                sensor._p = 0
+            value = sensor.compensate()
+            elapsed += time.perf_counter() - start
+            pressures.append(value * 100)
+    finally:
+        time.ticks_ms = ticks_ms
+    stats = {
+        "reads": len(rows),
+        "us_per_read": round(elapsed * 1000000 / len(rows), 3),
+        "p_hit_rate": round(sensor.p_hits / len(rows), 4),
+        "t_fine_hit_rate": round(sensor.t_fine_hits / max(1, sensor.p_misses), 4),
+        "t_fine_updates": sensor.t_fine_misses,
+    }
+    return pressures, stats
+
+
+def synthetic(path, seconds=60, period_ms=16, seed=1):
+    """Write a pump-down trace: receiver and three tables, noise of the ULTRALOW oversampling."""
+    import random
+    from i2c_devices import TEST_CALIBRATION, raw_pressure, raw_temperature
+    rng = random.Random(seed)
+    with open(path, "w") as trace:
+        for channel in range(CHANNELS):
+            trace.write("# calib %d %s\n" % (channel, " ".join(str(v) for v in TEST_CALIBRATION)))
+        for cycle in range(seconds * 1000 // period_ms):
+            ms = cycle * period_ms
+            t = ms / 1000
+            # receiver pumped down to 200 hPa, tables follow it one after another
+            receiver = 20000 + 81325 * 2.718281828 ** (-t / 4)
+            for channel in range(CHANNELS):
+                start = 10 * channel
+                if channel == 0:
+                    pa = receiver
+                elif t < start:
+                    pa = 101325
+                else:
+                    pa = receiver + (101325 - receiver) * 2.718281828 ** (-(t - start) / 2)
+                celsius = 25.0 + 0.5 * t / seconds + 0.1 * channel + rng.gauss(0, 0.005)
+                t_raw = raw_temperature(celsius) & ~0xF
+                p_raw = int(raw_pressure(pa + rng.gauss(0, 2.62), t_raw) + 0.5) & ~0xF
+                trace.write("%d %d %d %d\n" % (ms + channel, channel, t_raw, p_raw))
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("trace")
+    parser.add_argument("--synthetic", action="store_true", help="generate the trace first")
+    parser.add_argument("--seconds", type=int, default=60)
+    parser.add_argument("--compensation", type=int, default=BMP280_COMPENSATION)
+    parser.add_argument("--threshold", type=int, default=BMP280_T_FINE_THRESHOLD)
+    parser.add_argument("--interval-ms", type=int, default=BMP280_T_FINE_INTERVAL_MS)
+    parser.add_argument("--repeat", type=int, default=5, help="best time of repeated replays")
+    args = parser.parse_args()
+    if args.synthetic:
+        synthetic(args.trace, args.seconds)
+    calibrations, rows = load(args.trace)
+
+    def best(*replay_args, **kwargs):
+        runs = [replay(calibrations, rows, *replay_args, **kwargs) for _ in range(args.repeat)]
+        return min(runs, key=lambda run: run[1]["us_per_read"])
+
+    exact, full = best(args.compensation, cached=False)
+    memo, cached = best(args.compensation, 0, args.interval_ms)
+    values, decimated = best(args.compensation, args.threshold, args.interval_ms)
+    memo_error = max(abs(a - b) for a, b in zip(exact, memo))
+    error = max(abs(a - b) for a, b in zip(exact, values))
+    result = {
+        "full": full,
+        "raw_memo": dict(cached, max_error_pa=round(memo_error, 3)),
+        "t_fine_threshold": dict(decimated, threshold=args.threshold, max_error_pa=round(error, 3)),
+        "us_saved_per_read": round(full["us_per_read"] - decimated["us_per_read"], 3),
+        "us_saved_per_cycle": round((full["us_per_read"] - decimated["us_per_read"]) * CHANNELS, 3),
+    }
+    print(json.dumps(result, indent=1))
+
+
+if __name__ == "__main__":
+    main()
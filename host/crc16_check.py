@@ -0,0 +1,139 @@
+"""Equivalence and timing of the table driven CRC16 against the old bitwise one (CPython).
+
+bitwise_crc16 is the crc16 the firmware used before the table: 8 shifts per
+byte, whole buffer only. The check compares it with crc16 (whole buffers,
+start/end ranges, a continued calculation) and with Crc16 fed in random
+chunks, on random data of every buffer type the firmware passes and on edge
+cases (empty, single bytes, all zeros / ones, the standard check string).
+Mismatches are listed and the exit code is 1. Prints JSON, e.g.
+
+    python host/crc16_check.py --cases 20000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modbus_static_functions import Crc16, crc16
+
+# CRC-16/MODBUS of b"123456789"
+CHECK_STRING = b"123456789"
+CHECK_VALUE = 0x4B37
+# longest RTU frame
+MAX_LENGTH = 256
+
+
+def bitwise_crc16(data):
+    """The previous crc16 of modbus_static_functions, kept as the reference."""
+    offset = 0
+    length = len(data)
+    if data is None or offset < 0 or offset > len(data) - 1 and offset+length > len(data):
+        return 0
+    crc = 0xFFFF
+    for i in range(0, length):
+        crc ^= data[offset + i]
+        for j in range(0, 8):
+            if (crc & 1) > 0:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc = crc >> 1
+    return crc
+
+
+def as_types(data):
+    """The buffer types crc16 gets on the RTU and TCP paths."""
+    return (bytes(data), bytearray(data), memoryview(bytearray(data)), list(data))
+
+
+def edge_cases():
+    cases = [b"", CHECK_STRING, bytes(MAX_LENGTH), b"\xff" * MAX_LENGTH]
+    cases += [bytes((value,)) for value in range(256)]
+    # requests the firmware answers most often
+    cases += [bytes((1, 3, 0, 0, 0, 10)), bytes((1, 6, 0, 4, 1, 0xF4)), bytes((1, 16, 0, 0, 0, 1, 2, 0, 1))]
+    return cases
+
+
+def check(cases=10000, seed=1):
+    rng = random.Random(seed)
+    failures = []
+    checked = 0
+
+    def compare(name, data, got, expected):
+        if got != expected:
+            failures.append({"check": name, "data": bytes(data).hex(), "got": got, "expected": expected})
+
+    samples = edge_cases() + [bytes(rng.randrange(256) for _ in range(rng.randrange(MAX_LENGTH + 44)))
+                              for _ in range(cases)]
+    for data in samples:
+        expected = bitwise_crc16(data)
+        for buffer in as_types(data):
+            compare("crc16 " + type(buffer).__name__, data, crc16(buffer), expected)
+        # a range of a larger buffer, as the RTU receive buffer is checked
+        start = rng.randrange(len(data) + 1)
+        end = rng.randrange(start, len(data) + 1)
+        compare("crc16 range", data, crc16(memoryview(data), start, end), bitwise_crc16(data[start:end]))
+        # continued calculation
+        compare("crc16 continued", data, crc16(data, start, len(data), crc16(data, 0, start)), expected)
+        # incremental, in the chunks the UART delivers
+        incremental = Crc16()
+        pos = 0
+        while pos < len(data):
+            step = rng.randint(1, 32)
+            incremental.update(data, pos, min(pos + step, len(data)))
+            pos += step
+        compare("Crc16", data, incremental.crc, expected)
+        # a frame followed by its own CRC is valid, a corrupted one is not
+        frame = bytearray(data) + bytes((expected & 0xFF, expected >> 8))
+        incremental.reset()
+        incremental.update(frame)
+        compare("Crc16 valid", data, incremental.valid, len(frame) > 2)
+        if len(data) > 0:
+            frame[rng.randrange(len(frame))] ^= 1 << rng.randrange(8)
+            incremental.reset()
+            incremental.update(frame)
+            compare("Crc16 corrupted", data, incremental.valid, False)
+        checked += 1
+    compare("check string", CHECK_STRING, crc16(CHECK_STRING), CHECK_VALUE)
+    return checked, failures
+
+
+def timing(sizes=(8, 64, 256), number=2000, seed=1):
+    """us per call of the bitwise and the table crc16 by buffer size."""
+    rng = random.Random(seed)
+    result = {}
+    for size in sizes:
+        data = bytearray(rng.randrange(256) for _ in range(size))
+        bitwise = min(timeit.repeat(lambda: bitwise_crc16(data), number=number, repeat=5)) / number * 1000000
+        table = min(timeit.repeat(lambda: crc16(data), number=number, repeat=5)) / number * 1000000
+        result[str(size)] = {"bitwise_us": round(bitwise, 3), "table_us": round(table, 3),
+                             "speedup": round(bitwise / table, 1)}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cases", type=int, default=10000, help="random buffers besides the edge cases")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--number", type=int, default=2000, help="calls per timing run")
+    parser.add_argument("--no-timing", action="store_true")
+    args = parser.parse_args()
+    checked, failures = check(args.cases, args.seed)
+    result = {
+        "python": sys.version.split()[0],
+        "checked": checked,
+        "failures": len(failures),
+        "first_failures": failures[:10],
+    }
+    if not args.no_timing:
+        result["timing"] = timing(number=args.number, seed=args.seed)
+    print(json.dumps(result, indent=2))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Per-update cost of IntEntity / FloatEntity: RegisterView against the old list path (CPython).
+
+One update is set_value() with a new value and get_value(), as the control
+core refreshes a register every tact. "view" is the entity as created, on a
+RegisterView of the ArrayDataBlock. "list" is the same entity with the view
+removed, so it takes the path every entity took before the views:
+setValues / getValues of the context, encode_float + get_values_from_bytes
+for floats. Both paths must leave the same registers in the block, the
+check covers every word / byte order of FloatEntity. Prints JSON, e.g.
+
+    python host/entity_benchmark.py --updates 100000
+"""
+import argparse
+import json
+import os
+import random
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from entity import FloatEntity, IntEntity
+from modbus_context import ModbusSlaveContext
+from modbus_data_block import ArrayDataBlock
+
+REGISTERS = 8
+# word / byte orders of FloatEntity, the list path has the default one only
+ORDERS = [(word, byte) for word in ("big", "little") for byte in ("big", "little")]
+
+
+def create_context():
+    return ModbusSlaveContext(hr=ArrayDataBlock({0: [0] * REGISTERS}))
+
+
+def create(kind, view=True):
+    context = create_context()
+    if kind == "int":
+        entity = IntEntity(0, 0, context)
+    else:
+        entity = FloatEntity(0, 0.0, context)
+    if not view:
+        entity.view = None
+    return context, entity
+
+
+def samples(kind, count, seed):
+    rng = random.Random(seed)
+    if kind == "int":
+        return [rng.randrange(0x10000) for _ in range(count)]
+    return [round(rng.uniform(0.0, 1200.0), 2) for _ in range(count)]
+
+
+def us_per_update(kind, view, values, repeat):
+    """Best time of repeat passes over values, us per set_value + get_value."""
+    _, entity = create(kind, view)
+    set_value = entity.set_value
+    get_value = entity.get_value
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for value in values:
+            set_value(value)
+            get_value()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1000000 / len(values)
+
+
+def registers(context, count):
+    return list(context.getValues(3, 0, count))
+
+
+def check(values):
+    """Mismatches between the view and the list path, registers and values read back."""
+    failures = []
+    for kind in ("int", "float"):
+        view_context, view_entity = create(kind)
+        list_context, list_entity = create(kind, view=False)
+        length = view_entity.value_length
+        for value in values[kind]:
+            view_entity.set_value(value)
+            list_entity.set_value(value)
+            if registers(view_context, length) != registers(list_context, length) \
+                    or view_entity.get_value() != list_entity.get_value():
+                failures.append({"type": kind, "value": value,
+                                 "view": registers(view_context, length), "list": registers(list_context, length)})
+    # every order reads back what it wrote, rounded to float32 and to get_value's 4 decimals
+    for word_order, byte_order in ORDERS:
+        context = create_context()
+        entity = FloatEntity(0, 0.0, context, word_order=word_order, byte_order=byte_order)
+        for value in values["float"]:
+            entity.set_value(value)
+            if entity.get_value() != round(struct.unpack("<f", struct.pack("<f", value))[0], 4):
+                failures.append({"type": "float", "order": [word_order, byte_order], "value": value,
+                                 "read": entity.value})
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=50000, help="updates per timing pass")
+    parser.add_argument("--repeat", type=int, default=5, help="best of repeated passes")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="JSON file for the results")
+    args = parser.parse_args()
+    values = {kind: samples(kind, args.updates, args.seed) for kind in ("int", "float")}
+    failures = check({kind: values[kind][:2000] for kind in values})
+    result = {"config": {"updates": args.updates, "repeat": args.repeat, "seed": args.seed},
+              "python": sys.version.split()[0],
+              "failures": len(failures),
+              "first_failures": failures[:10]}
+    for kind, name in (("float", "FloatEntity"), ("int", "IntEntity")):
+        list_us = us_per_update(kind, False, values[kind], args.repeat)
+        view_us = us_per_update(kind, True, values[kind], args.repeat)
+        result[name] = {"list_us": round(list_us, 3), "view_us": round(view_us, 3),
+                        "speedup": round(list_us / view_us, 2)}
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    print(text)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""Register models of the I2C devices on the board, for machine.I2C (CPython).
+
+TCA9548A - the 8 channel multiplexer in front of the sensors, BMP280 - the
+pressure sensor with its calibration, oversampling, conversion time, IIR
+filter, forced / normal mode and noise. A sensor measures source(), a
+callable returning (pressure Pa, temperature C), e.g. a channel of
+plant.VacuumPlant. Times come from the machine clock, so the models run
+on the virtual clock as well.
+"""
+import math
+import random
+import struct
+
+import machine
+
+# BMP280 datasheet test calibration T1..T3, P1..P9
+TEST_CALIBRATION = (27504, 26435, -1000, 36477, -10685, 3024, 2855, 140, -7, 15500, -14600, 6000)
+
+# pressure noise (Pa RMS) by the pressure oversampling setting, datasheet table 3
+_PRESSURE_NOISE = (0.0, 2.62, 1.65, 1.17, 0.94, 0.66)
+_TEMPERATURE_NOISE = 0.005
+_RESET_DATA = bytes((0x80, 0x00, 0x00, 0x80, 0x00, 0x00))
+# standby time in us by t_sb
+_STANDBY_US = (500, 62500, 125000, 250000, 500000, 1000000, 2000000, 4000000)
+
+
+class TCA9548A:
+    """I2C multiplexer: one control byte enables channels, devices are attached per channel."""
+
+    def __init__(self, channels=8):
+        self.channels = [{} for _ in range(channels)]
+        self.mask = 0
+        self.writes = 0
+
+    def attach(self, channel, address, device):
+        self.channels[channel][address] = device
+        return device
+
+    def route(self, address):
+        found = None
+        for channel, devices in enumerate(self.channels):
+            if self.mask & (1 << channel) and address in devices:
+                if found is not None:
+                    # two devices answer at once
+                    raise OSError(5)
+                found = devices[address]
+        return found
+
+    def addresses(self):
+        return [address for channel, devices in enumerate(self.channels)
+                if self.mask & (1 << channel) for address in devices]
+
+    def write(self, data):
+        self.mask = data[-1]
+        self.writes += 1
+
+    def read(self, nbytes):
+        return bytes((self.mask,)) * nbytes
+
+
+def raw_temperature(celsius, calibration=TEST_CALIBRATION):
+    """Raw 20 bit temperature measured at celsius (inverse of the float compensation)."""
+    t1, t2, t3 = calibration[0:3]
+    # t_fine = T2 * x + T3 * x^2 / 64, x = t_raw / 16384 - T1 / 1024
+    t_fine = celsius * 5120.0
+    a = t3 / 64.0
+    if a:
+        x = (-t2 + math.sqrt(t2 * t2 + 4 * a * t_fine)) / (2 * a)
+    else:
+        x = t_fine / t2
+    return min(max(int((x + t1 / 1024.0) * 16384.0 + 0.5), 0), 0xFFFFF)
+
+
+def t_fine(t_raw, calibration=TEST_CALIBRATION):
+    t1, t2, t3 = calibration[0:3]
+    var1 = (t_raw / 16384.0 - t1 / 1024.0) * t2
+    var2 = (t_raw / 131072.0 - t1 / 8192.0) ** 2 * t3
+    return var1 + var2
+
+
+def raw_pressure(pa, t_raw, calibration=TEST_CALIBRATION):
+    """Raw 20 bit pressure measured at pa and t_raw (inverse of the float compensation), float."""
+    p1, p2, p3, p4, p5, p6, p7, p8, p9 = calibration[3:12]
+    var1 = t_fine(t_raw, calibration) / 2.0 - 64000.0
+    var2 = var1 * var1 * p6 / 32768.0
+    var2 = var2 + var1 * p5 * 2.0
+    var2 = var2 / 4.0 + p4 * 65536.0
+    var1 = (p3 * var1 * var1 / 524288.0 + p2 * var1) / 524288.0
+    var1 = (1.0 + var1 / 32768.0) * p1
+    # pa = p + (P9 * p^2 / 2^31 + P8 * p / 2^15 + P7) / 16
+    a = p9 / 34359738368.0
+    b = 1.0 + p8 / 524288.0
+    c = p7 / 16.0 - pa
+    if a:
+        p = (-b + math.sqrt(b * b - 4 * a * c)) / (2 * a)
+    else:
+        p = -c / b
+    return 1048576.0 - var2 / 4096.0 - p * var1 / 6250.0
+
+
+class BMP280:
+    """BMP280 register map: id, reset, status, ctrl_meas, config, calibration and data."""
+
+    def __init__(self, source, calibration=TEST_CALIBRATION, seed=0):
+        self.source = source
+        self.calibration = calibration
+        self.random = random.Random(seed)
+        self.conversions = 0
+        self.reset()
+
+    def reset(self):
+        self.ctrl_meas = 0
+        self.config = 0
+        self.data = _RESET_DATA
+        # IIR filter state, raw pressure
+        self.filtered = None
+        # end of the running conversion (us) or None
+        self.ready_at = None
+
+    @property
+    def mode(self):
+        return self.ctrl_meas & 3
+
+    def oversampling(self):
+        return (self.ctrl_meas >> 5) & 7, (self.ctrl_meas >> 2) & 7
+
+    def measurement_us(self):
+        """Maximum measurement time of the oversampling setting, datasheet 9.1."""
+        t_os, p_os = self.oversampling()
+        us = 1250
+        if t_os:
+            us += 2300 * (1 << (min(t_os, 5) - 1))
+        if p_os:
+            us += 2300 * (1 << (min(p_os, 5) - 1)) + 575
+        return us
+
+    def update(self):
+        """Finish the conversions that ended by now."""
+        now = machine.ticks_us()
+        if self.ready_at is None or now < self.ready_at:
+            return
+        self.convert()
+        if self.mode == 3:
+            period = self.measurement_us() + _STANDBY_US[self.config >> 5]
+            # only the last of the conversions missed since then is kept
+            self.ready_at += (now - self.ready_at) // period * period + period
+        else:
+            # forced mode returns to sleep
+            self.ctrl_meas &= ~3
+            self.ready_at = None
+
+    def convert(self):
+        self.conversions += 1
+        pa, celsius = self.source()
+        t_os, p_os = self.oversampling()
+        celsius += self.random.gauss(0, _TEMPERATURE_NOISE)
+        t_raw = raw_temperature(celsius, self.calibration)
+        if t_os:
+            # 16 bit at 1x, one more bit per oversampling step
+            t_raw &= ~((1 << (5 - min(t_os, 5))) - 1)
+        else:
+            t_raw = 0x80000
+        if p_os:
+            pa += self.random.gauss(0, _PRESSURE_NOISE[min(p_os, 5)])
+            p_raw = raw_pressure(pa, t_raw, self.calibration)
+            coefficient = (0, 2, 4, 8, 16)[min((self.config >> 2) & 7, 4)]
+            if coefficient and self.filtered is not None:
+                p_raw = (self.filtered * (coefficient - 1) + p_raw) / coefficient
+                self.filtered = p_raw
+                # the filter output has 20 bit resolution
+                p_raw = int(p_raw + 0.5)
+            else:
+                self.filtered = p_raw
+                p_raw = int(p_raw + 0.5) & ~((1 << (5 - min(p_os, 5))) - 1)
+            p_raw = min(max(p_raw, 0), 0xFFFFF)
+        else:
+            p_raw = 0x80000
+        self.data = bytes((p_raw >> 12, (p_raw >> 4) & 0xFF, (p_raw & 0xF) << 4,
+                           t_raw >> 12, (t_raw >> 4) & 0xFF, (t_raw & 0xF) << 4))
+
+    def register(self, address):
+        if address == 0xD0:
+            return 0x58
+        if address == 0xF3:
+            # measuring bit while a conversion runs
+            if self.ready_at is not None and machine.ticks_us() >= self.ready_at - self.measurement_us():
+                return 8
+            return 0
+        if address == 0xF4:
+            return self.ctrl_meas
+        if address == 0xF5:
+            return self.config
+        if 0x88 <= address < 0xA0:
+            return struct.pack("<HhhHhhhhhhhh", *self.calibration)[address - 0x88]
+        if 0xF7 <= address <= 0xFC:
+            return self.data[address - 0xF7]
+        return 0
+
+    def read_mem(self, address, nbytes):
+        self.update()
+        return bytes(self.register(address + idx) for idx in range(nbytes))
+
+    def write_mem(self, address, data):
+        self.update()
+        for value in data:
+            if address == 0xE0 and value == 0xB6:
+                self.reset()
+            elif address == 0xF5:
+                self.config = value
+            elif address == 0xF4:
+                self.ctrl_meas = value
+                now = machine.ticks_us()
+                if self.mode in (1, 2):
+                    self.ready_at = now + self.measurement_us()
+                elif self.mode == 3:
+                    if self.ready_at is None:
+                        self.ready_at = now + self.measurement_us()
+                else:
+                    self.ready_at = None
+            address += 1
+
+    def write(self, data):
+        # register address, then register / value pairs
+        if len(data) > 1:
+            self.write_mem(data[0], data[1:2])
+
+    def read(self, nbytes):
+        return bytes(nbytes)
@@ -0,0 +1,304 @@
+"""Host stand-in for the MicroPython `machine` module (CPython only).
+
+Put the `host` directory first on sys.path to run firmware modules off target.
+Importing this module also adds the MicroPython `time.ticks_*` / `sleep_*`
+functions to CPython's `time` module. use_clock(VirtualClock()) switches
+all of them, the UART line timing and the I2C transfers to simulated time,
+which advances only by sleeps, bus transfers and VirtualClock.advance().
+"""
+import errno
+import time
+
+_perf_counter = time.perf_counter
+_sleep = time.sleep
+# VirtualClock or None - the host clock
+_clock = None
+
+
+class VirtualClock:
+    """Simulated time in microseconds."""
+
+    def __init__(self, start_us=0):
+        self.us = start_us
+
+    def time(self):
+        return self.us / 1000000
+
+    def sleep(self, seconds):
+        self.advance_us(int(seconds * 1000000 + 0.5))
+
+    def advance_us(self, us):
+        if us > 0:
+            self.us += us
+
+
+def use_clock(clock=None):
+    """Run on the simulated clock, None - back to the host clock."""
+    global _clock, _perf_counter, _sleep
+    _clock = clock
+    if clock is None:
+        _perf_counter = time.perf_counter
+        _sleep = time.sleep
+    else:
+        _perf_counter = clock.time
+        _sleep = clock.sleep
+
+
+def ticks_us():
+    if _clock is not None:
+        return _clock.us
+    return int(_perf_counter() * 1000000)
+
+
+def ticks_ms():
+    if _clock is not None:
+        return _clock.us // 1000
+    return int(_perf_counter() * 1000)
+
+
+def ticks_diff(ticks1, ticks2):
+    return ticks1 - ticks2
+
+
+def ticks_add(ticks, delta):
+    return ticks + delta
+
+
+def sleep_us(us):
+    if _clock is not None:
+        _clock.advance_us(us)
+        return
+    # time.sleep is too coarse for the line timings, spin for short waits
+    end = _perf_counter() + us / 1000000
+    if us > 2000:
+        _sleep(us / 1000000 - 0.001)
+    while _perf_counter() < end:
+        pass
+
+
+def sleep_ms(ms):
+    sleep_us(ms * 1000)
+
+
+for _name, _func in (("ticks_us", ticks_us), ("ticks_ms", ticks_ms), ("ticks_cpu", ticks_us),
+                     ("ticks_diff", ticks_diff), ("ticks_add", ticks_add),
+                     ("sleep_us", sleep_us), ("sleep_ms", sleep_ms)):
+    if not hasattr(time, _name):
+        setattr(time, _name, _func)
+
+
+def idle():
+    pass
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    # pin number -> Pin, lets a simulation find the pins created by the firmware
+    pins = {}
+
+    def __init__(self, pin_id, mode=-1, pull=-1, value=None):
+        self.id = pin_id
+        self.mode = mode
+        self._value = 0 if value is None else value
+        # called with the pin on every level change
+        self.on_change = None
+        Pin.pins[pin_id] = self
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        value = 1 if value else 0
+        if value != self._value:
+            self._value = value
+            if self.on_change is not None:
+                self.on_change(self)
+
+    def high(self):
+        self.value(1)
+
+    def low(self):
+        self.value(0)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+
+class UART:
+    """UART with the line timing of the configured baudrate.
+
+    The other side of the line (a simulated master) calls `inject()` to send
+    bytes to the firmware, they become readable one character time apart.
+    Bytes written by the firmware are kept with their on-wire end time in `sent`.
+    If `dir_pin` is set (RS-485 driver enable), bytes written or still shifting
+    out while it is low are lost and counted in `collisions`.
+    """
+
+    def __init__(self, uart_id=0, baudrate=9600, bits=8, parity=None, stop=1, **kwargs):
+        self.id = uart_id
+        self.dir_pin = None
+        self._rx = []
+        self._line_free = 0
+        self._tx_end = 0
+        self.sent = []
+        self.collisions = 0
+        self.init(baudrate=baudrate, bits=bits, parity=parity, stop=stop)
+
+    def init(self, baudrate=9600, bits=8, parity=None, stop=1, **kwargs):
+        self.baudrate = baudrate
+        self.bits = bits
+        self.parity = parity
+        self.stop = stop
+        self.char_time = (1 + bits + (0 if parity is None else 1) + stop) / baudrate
+
+    def deinit(self):
+        pass
+
+    # simulated peer side
+
+    def inject(self, data):
+        """Send bytes to the firmware, return the time (s) the last one arrives."""
+        now = _perf_counter()
+        arrival = max(now, self._line_free)
+        for byte in data:
+            arrival += self.char_time
+            self._rx.append((arrival, byte))
+        self._line_free = arrival
+        return arrival
+
+    def next_arrival(self):
+        """Time (s) the next byte sent to the firmware becomes readable, None if none is on the way."""
+        return self._rx[0][0] if self._rx else None
+
+    def line_free(self):
+        """Time (s) the last byte sent in either direction leaves the line."""
+        return max(self._line_free, self._tx_end)
+
+    def take_sent(self):
+        """Return [(end_time, bytes)] written by the firmware and clear the log."""
+        sent, self.sent = self.sent, []
+        return sent
+
+    # firmware side
+
+    def any(self):
+        now = _perf_counter()
+        count = 0
+        for arrival, _ in self._rx:
+            if arrival > now:
+                break
+            count += 1
+        return count
+
+    def readinto(self, buf, nbytes=None):
+        count = min(self.any(), len(buf) if nbytes is None else nbytes)
+        for idx in range(count):
+            buf[idx] = self._rx[idx][1]
+        del self._rx[:count]
+        return count
+
+    def read(self, nbytes=None):
+        count = self.any() if nbytes is None else min(self.any(), nbytes)
+        data = bytes(byte for _, byte in self._rx[:count])
+        del self._rx[:count]
+        return data if data else None
+
+    def write(self, buf):
+        data = bytes(buf)
+        now = _perf_counter()
+        if self.dir_pin is not None and not self.dir_pin.value():
+            self.collisions += 1
+            return len(data)
+        start = max(now, self._tx_end)
+        self._tx_end = start + len(data) * self.char_time
+        self.sent.append((self._tx_end, data))
+        return len(data)
+
+    def txdone(self):
+        return _perf_counter() >= self._tx_end
+
+    def flush(self):
+        remaining = self._tx_end - _perf_counter()
+        if remaining > 0:
+            sleep_us(int(remaining * 1000000) + 1)
+
+    def driver_released(self):
+        """Check a falling RS-485 driver enable, drops a frame cut short."""
+        if self.sent and self.sent[-1][0] > _perf_counter():
+            self.sent.pop()
+            self.collisions += 1
+
+
+class I2C:
+    """I2C controller with simulated devices, see i2c_devices.py.
+
+    Devices are attached by address, devices behind a multiplexer are reached
+    through its route(). Every transfer takes its time on the line at freq
+    (9 bits per byte, start and stop), on the virtual clock it advances time.
+    A missing device raises OSError(ENODEV) like the rp2 port.
+    """
+
+    def __init__(self, i2c_id=0, scl=None, sda=None, freq=400000, timeout=50000):
+        self.id = i2c_id
+        self.freq = freq
+        self.devices = {}
+        self.transactions = 0
+
+    def attach(self, address, device):
+        self.devices[address] = device
+        return device
+
+    def _device(self, address, nbytes):
+        self.transactions += 1
+        # address, data and the start / stop conditions
+        sleep_us(((1 + nbytes) * 9 + 2) * 1000000 // self.freq)
+        device = self.devices.get(address)
+        if device is None:
+            for mux in self.devices.values():
+                route = getattr(mux, "route", None)
+                if route is not None:
+                    device = route(address)
+                    if device is not None:
+                        break
+        if device is None:
+            raise OSError(errno.ENODEV)
+        return device
+
+    def scan(self):
+        found = set(self.devices)
+        for mux in self.devices.values():
+            if hasattr(mux, "addresses"):
+                found.update(mux.addresses())
+        return sorted(found)
+
+    def writeto(self, address, buf, stop=True):
+        self._device(address, len(buf)).write(bytes(buf))
+        # number of ACKs
+        return len(buf) + 1
+
+    def readfrom(self, address, nbytes, stop=True):
+        return self._device(address, nbytes).read(nbytes)
+
+    def readfrom_into(self, address, buf, stop=True):
+        buf[:] = self.readfrom(address, len(buf))
+
+    def readfrom_mem(self, address, memaddr, nbytes, addrsize=8):
+        # register write, repeated start and address
+        return self._device(address, nbytes + 2).read_mem(memaddr, nbytes)
+
+    def readfrom_mem_into(self, address, memaddr, buf, addrsize=8):
+        buf[:] = self.readfrom_mem(address, memaddr, len(buf))
+
+    def writeto_mem(self, address, memaddr, buf, addrsize=8):
+        self._device(address, len(buf) + 1).write_mem(memaddr, bytes(buf))
@@ -0,0 +1,166 @@
+"""Modbus master load generator and latency benchmark for ModbusRtuSlaveRS485 (CPython).
+
+Runs the real slave and ModbusSlaveContext against the simulated UART of
+host/machine.py, which models the byte timing of the baudrate and the RS-485
+direction pin. A scripted master sends mixed FC3/FC6/FC16 requests and the
+results are written as JSON, e.g.
+
+    python host/modbus_benchmark.py --requests 2000 --output bench.json
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from machine import Pin, UART
+from modbus_data_block import ArrayDataBlock
+from modbus_rtu_slave_rs485 import ModbusRtuSlaveRS485
+from modbus_static_functions import crc16
+
+DIR_PIN = 4
+REGISTERS = 33
+
+
+def with_crc(data):
+    crc = crc16(data)
+    return bytes(data) + bytes([crc & 0xFF, crc >> 8])
+
+
+def make_request(func_code, rnd, device_addr=1):
+    if func_code == 3:
+        start = rnd.randrange(REGISTERS)
+        count = rnd.randint(1, REGISTERS - start)
+        return with_crc([device_addr, 3, 0, start, 0, count])
+    if func_code == 6:
+        # registers 0..29 only, 31/32 would change the line settings
+        return with_crc([device_addr, 6, 0, rnd.randrange(30), 0, rnd.randrange(256)])
+    start = rnd.randrange(29)
+    count = rnd.randint(1, 30 - start)
+    data = [device_addr, 16, 0, start, 0, count, 2 * count]
+    for _ in range(count):
+        data += [0, rnd.randrange(256)]
+    return with_crc(data)
+
+
+def expected_length(request):
+    if request[1] == 3:
+        return 5 + 2 * request[5]
+    return 8
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    return values[min(len(values) - 1, len(values) * percent // 100)]
+
+
+class GcTimer:
+    """Sums the time spent in the garbage collector through gc.callbacks."""
+
+    def __init__(self):
+        self.total = 0.0
+        self.collections = 0
+        self._start = 0.0
+
+    def __call__(self, phase, info):
+        if phase == "start":
+            self._start = time.perf_counter()
+        else:
+            self.total += time.perf_counter() - self._start
+            self.collections += 1
+
+
+def run(requests=1000, baudrate=115200, rate=0.0, mix=(70, 20, 10), timeout_ms=100, seed=1):
+    """Send `requests` requests, `rate` per second (0 - back to back), mix is FC3/FC6/FC16 %."""
+    uart = UART(0, baudrate=baudrate)
+    slave = ModbusRtuSlaveRS485(uart, 1, False, dir_pin=DIR_PIN, baudrate=baudrate,
+                                hr=ArrayDataBlock({0: [0] * REGISTERS}))
+    uart.dir_pin = Pin.pins[DIR_PIN]
+    uart.dir_pin.on_change = lambda pin: None if pin.value() else uart.driver_released()
+    rnd = random.Random(seed)
+    codes = [3] * mix[0] + [6] * mix[1] + [16] * mix[2]
+    latencies = {3: [], 6: [], 16: []}
+    dropped = 0
+    gc_timer = GcTimer()
+    gc.callbacks.append(gc_timer)
+    started = time.perf_counter()
+    next_send = started
+    try:
+        for _ in range(requests):
+            request = make_request(rnd.choice(codes), rnd)
+            # the master keeps t3.5 of silence after the previous frame
+            line_free = uart.line_free() + slave.inter_frame_timeout / 1000000
+            send_at = max(line_free, next_send) if rate else line_free
+            while time.perf_counter() < send_at:
+                slave.receive()
+            next_send = max(time.perf_counter(), next_send) + (1 / rate if rate else 0)
+            request_end = uart.inject(request)
+            deadline = request_end + timeout_ms / 1000
+            response = None
+            while time.perf_counter() < deadline:
+                slave.receive()
+                sent = uart.sent
+                if sent and sent[-1][0] <= time.perf_counter():
+                    response = uart.take_sent()[-1]
+                    break
+            if response is None or len(response[1]) != expected_length(request):
+                dropped += 1
+                continue
+            latencies[request[1]].append(response[0] - request_end)
+    finally:
+        gc.callbacks.remove(gc_timer)
+    elapsed = time.perf_counter() - started
+    all_latencies = sorted(latencies[3] + latencies[6] + latencies[16])
+
+    def summary(values):
+        values = sorted(values)
+        return {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 50) * 1000, 3) if values else None,
+            "p95_ms": round(percentile(values, 95) * 1000, 3) if values else None,
+            "p99_ms": round(percentile(values, 99) * 1000, 3) if values else None,
+        }
+
+    return {
+        "config": {"requests": requests, "baudrate": baudrate, "rate": rate, "mix": list(mix),
+                   "timeout_ms": timeout_ms, "seed": seed},
+        "python": sys.version.split()[0],
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(all_latencies) / elapsed, 1),
+        "latency": summary(all_latencies),
+        "latency_by_function": {str(code): summary(values) for code, values in latencies.items()},
+        "dropped": dropped,
+        "bus_collisions": uart.collisions,
+        "crc_errors": slave.crc_errors,
+        "discarded_bytes": slave.discarded_bytes,
+        "gc_collections": gc_timer.collections,
+        "gc_time_ms": round(gc_timer.total * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--baudrate", type=int, default=115200)
+    parser.add_argument("--rate", type=float, default=0.0, help="requests per second, 0 - back to back")
+    parser.add_argument("--mix", type=int, nargs=3, default=(70, 20, 10), metavar=("FC3", "FC6", "FC16"))
+    parser.add_argument("--timeout-ms", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="JSON file for the results")
+    args = parser.parse_args()
+    result = run(args.requests, args.baudrate, args.rate, tuple(args.mix), args.timeout_ms, args.seed)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""Idle CPU and request latency of the Modbus core: serve() against the old poll loop (CPython).
+
+"serve" is the main loop of main.py: ModbusRtuSlaveRS485.serve() awaiting
+a stream of the simulated UART of host/machine.py, which wakes the reader
+at the arrival of every byte, as the RX interrupt wakes
+asyncio.StreamReader(uart) on the board.
+"poll" is the loop it replaced: receive() and a 100 us sleep, back to back.
+A scripted master sends FC3 requests at --rate per second for --seconds,
+after --idle-seconds with the bus silent. CPU use is the process CPU time
+over the wall time of each phase, latency is the end of the answer on the
+line minus the end of the request. Prints JSON, e.g.
+
+    python host/modbus_idle.py --rate 50 --seconds 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from machine import Pin, UART
+from modbus_data_block import ArrayDataBlock
+from modbus_rtu_slave_rs485 import ModbusRtuSlaveRS485
+from modbus_static_functions import crc16
+
+DIR_PIN = 4
+REGISTERS = 45
+# the old main loop slept this long between receive() calls
+POLL_SLEEP_S = 0.0001
+
+
+class UartStream:
+    """Stream of the simulated UART: readinto() waits for the next byte instead of polling.
+
+    A line thread stands for the RX interrupt: it sleeps until each injected
+    byte arrives and wakes the reader through the event loop, so the reader
+    sees every byte at its arrival time. asyncio timers (epoll) round waits
+    up to whole ms and would delay every byte by up to 1 ms.
+    """
+
+    def __init__(self, uart):
+        self.uart = uart
+        self.loop = asyncio.get_running_loop()
+        self.wake = asyncio.Event()
+        self.closed = False
+        # arrival times (s) of the bytes on the way
+        self.arrivals = []
+        self.line = threading.Condition()
+        self.thread = threading.Thread(target=self.__interrupts, daemon=True)
+        self.thread.start()
+
+    def notify(self, count, last_arrival):
+        """Called by the master after UART.inject() of count bytes."""
+        char_time = self.uart.char_time
+        with self.line:
+            self.arrivals.extend(last_arrival - (count - 1 - idx) * char_time for idx in range(count))
+            self.line.notify()
+
+    def close(self):
+        """readinto() returns 0 from now on, serve() sees stop()."""
+        self.closed = True
+        with self.line:
+            self.line.notify()
+        self.thread.join()
+        self.wake.set()
+
+    def __interrupts(self):
+        while True:
+            with self.line:
+                while not self.arrivals and not self.closed:
+                    self.line.wait()
+                if self.closed:
+                    return
+                arrival = self.arrivals.pop(0)
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.loop.call_soon_threadsafe(self.wake.set)
+
+    async def readinto(self, buf):
+        while True:
+            self.wake.clear()
+            count = self.uart.readinto(buf)
+            if count or self.closed:
+                return count
+            await self.wake.wait()
+
+
+def request(device_addr=1):
+    data = bytes([device_addr, 3, 0, 0, 0, 10])
+    crc = crc16(data)
+    return data + bytes([crc & 0xFF, crc >> 8])
+
+
+def create_slave(baudrate):
+    uart = UART(0, baudrate=baudrate)
+    slave = ModbusRtuSlaveRS485(uart, 1, False, dir_pin=DIR_PIN, baudrate=baudrate,
+                                hr=ArrayDataBlock({0: [0] * REGISTERS}))
+    uart.dir_pin = Pin.pins[DIR_PIN]
+    return uart, slave
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    return values[min(len(values) - 1, len(values) * percent // 100)]
+
+
+class Phase:
+    """CPU time over wall time between start() and stop()."""
+
+    def start(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+
+    def stop(self):
+        wall = time.perf_counter() - self.wall
+        return {"wall_s": round(wall, 3), "cpu_percent": round((time.process_time() - self.cpu) * 100 / wall, 1)}
+
+
+class Master:
+    """Sends one request every period, collects the answers from the UART log."""
+
+    def __init__(self, uart, rate, seconds):
+        self.uart = uart
+        self.period = 1 / rate
+        self.count = int(rate * seconds)
+        self.sent = 0
+        self.next_send = 0.0
+        self.request_end = None
+        self.request_length = 0
+        self.latencies = []
+        self.lost = 0
+
+    def collect(self):
+        if self.request_end is None:
+            return
+        answers = self.uart.take_sent()
+        if answers:
+            self.latencies.append(answers[-1][0] - self.request_end)
+        else:
+            self.lost += 1
+        self.request_end = None
+
+    def send(self):
+        """Send the next request, return False when all are sent."""
+        self.collect()
+        if self.sent == self.count:
+            return False
+        data = request()
+        self.request_end = self.uart.inject(data)
+        self.request_length = len(data)
+        self.sent += 1
+        self.next_send = max(self.next_send + self.period, time.perf_counter())
+        return True
+
+    def summary(self):
+        values = sorted(self.latencies)
+        return {
+            "requests": self.sent,
+            "lost": self.lost,
+            "p50_ms": round(percentile(values, 50) * 1000, 3) if values else None,
+            "p99_ms": round(percentile(values, 99) * 1000, 3) if values else None,
+            "max_ms": round(values[-1] * 1000, 3) if values else None,
+        }
+
+
+def run_poll(baudrate, rate, seconds, idle_seconds):
+    uart, slave = create_slave(baudrate)
+    phase = Phase()
+    phase.start()
+    end = time.perf_counter() + idle_seconds
+    while time.perf_counter() < end:
+        slave.receive()
+        time.sleep(POLL_SLEEP_S)
+    idle = phase.stop()
+    master = Master(uart, rate, seconds)
+    master.next_send = time.perf_counter()
+    phase.start()
+    while True:
+        if time.perf_counter() >= master.next_send and not master.send():
+            break
+        slave.receive()
+        time.sleep(POLL_SLEEP_S)
+    return idle, phase.stop(), master.summary()
+
+
+def run_serve(baudrate, rate, seconds, idle_seconds):
+    uart, slave = create_slave(baudrate)
+    master = Master(uart, rate, seconds)
+    phase = Phase()
+    result = []
+
+    async def drive(stream):
+        phase.start()
+        await asyncio.sleep(idle_seconds)
+        result.append(phase.stop())
+        master.next_send = time.perf_counter()
+        phase.start()
+        while master.send():
+            stream.notify(master.request_length, master.request_end)
+            await asyncio.sleep(max(0.0, master.next_send - time.perf_counter()))
+        result.append(phase.stop())
+        slave.stop()
+        stream.close()
+
+    async def main():
+        stream = UartStream(uart)
+        await asyncio.gather(slave.serve(stream), drive(stream))
+
+    asyncio.run(main())
+    return result[0], result[1], master.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--baudrate", type=int, default=115200)
+    parser.add_argument("--rate", type=float, default=50.0, help="requests per second")
+    parser.add_argument("--seconds", type=float, default=5.0, help="length of the loaded phase")
+    parser.add_argument("--idle-seconds", type=float, default=2.0, help="length of the silent phase")
+    parser.add_argument("--output", help="JSON file for the results")
+    args = parser.parse_args()
+    result = {"config": {"baudrate": args.baudrate, "rate": args.rate, "seconds": args.seconds,
+                         "idle_seconds": args.idle_seconds},
+              "python": sys.version.split()[0]}
+    for name, run in (("poll", run_poll), ("serve", run_serve)):
+        idle, loaded, latency = run(args.baudrate, args.rate, args.seconds, args.idle_seconds)
+        result[name] = {"idle": idle, "loaded": loaded, "latency": latency}
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
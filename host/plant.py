@@ -0,0 +1,74 @@
+"""Pneumatic model of the vacuum system (CPython), driven by the firmware's valve pins.
+
+Receiver with the pump, three tables with their valve to the receiver and
+their vent (outer) valve to the atmosphere, leaks of the receiver and of
+every table (the film on the table). Pressures are absolute, hPa, volumes
+in litres. A flow through a valve or a leak is conductance (l/s) times the
+pressure difference, the pump removes speed (l/s) times the pressure above
+its ultimate pressure. The receiver valve pin is the pump: the firmware
+counts its open time as the motor work. Integrated on the machine clock in
+steps of at most step_us, lazily when a sensor samples or update() is called.
+"""
+import machine
+from parameters import VP
+
+RECEIVER = 0
+
+
+class VacuumPlant:
+    def __init__(self, receiver_volume=40.0, table_volume=10.0, pump_speed=8.0, ultimate=20.0,
+                 valve_conductance=2.0, vent_conductance=5.0, receiver_leak=0.002, table_leak=0.01,
+                 atmosphere=1013.25, celsius=25.0, step_us=1000):
+        self.volumes = [receiver_volume] + [table_volume] * 3
+        self.pressures = [atmosphere] * 4
+        self.pump_speed = pump_speed
+        self.ultimate = ultimate
+        self.valve_conductance = valve_conductance
+        self.vent_conductance = vent_conductance
+        # leak of the receiver and of every table, l/s
+        self.leaks = [receiver_leak] + [table_leak] * 3
+        self.atmosphere = atmosphere
+        self.celsius = celsius
+        self.step_us = step_us
+        self.last_us = machine.ticks_us()
+        self.pump_pin = VP.receiver_valve_pin
+        self.table_pins = (VP.table1_valve_pin, VP.table2_valve_pin, VP.table3_valve_pin)
+        self.outer_pins = (VP.outer1_valve_pin, VP.outer2_valve_pin, VP.outer3_valve_pin)
+
+    def _pin(self, pin_id):
+        # the firmware creates the pins, low until then
+        pin = machine.Pin.pins.get(pin_id)
+        return pin is not None and pin.value()
+
+    def update(self):
+        """Integrate up to the current time with the current valve states."""
+        now = machine.ticks_us()
+        pump = self._pin(self.pump_pin)
+        tables = [self._pin(pin) for pin in self.table_pins]
+        outers = [self._pin(pin) for pin in self.outer_pins]
+        pressures = self.pressures
+        volumes = self.volumes
+        while self.last_us < now:
+            dt = min(self.step_us, now - self.last_us) / 1000000
+            self.last_us += min(self.step_us, now - self.last_us)
+            # hPa * l / s into each volume
+            flows = [leak * (self.atmosphere - p) for leak, p in zip(self.leaks, pressures)]
+            if pump and pressures[RECEIVER] > self.ultimate:
+                flows[RECEIVER] -= self.pump_speed * (pressures[RECEIVER] - self.ultimate)
+            for idx in range(3):
+                table = idx + 1
+                if tables[idx]:
+                    flow = self.valve_conductance * (pressures[RECEIVER] - pressures[table])
+                    flows[table] += flow
+                    flows[RECEIVER] -= flow
+                if outers[idx]:
+                    flows[table] += self.vent_conductance * (self.atmosphere - pressures[table])
+            for idx in range(4):
+                pressures[idx] += flows[idx] * dt / volumes[idx]
+
+    def source(self, channel):
+        """Sensor source of a channel (0 - receiver, 1..3 - tables): (Pa, C)."""
+        def measure():
+            self.update()
+            return self.pressures[channel] * 100, self.celsius
+        return measure
@@ -0,0 +1,98 @@
+"""Master access to the firmware register map: R registers readable, not writable (CPython).
+
+Builds the holding registers as the firmware does (RegisterMap.create_entities
+protects the R entries) and sends requests through ModbusRtuMessageHandler:
+FC3 of every entry, of every R entry with its neighbours and of the whole
+map must answer normally, FC6/FC16 into an R entry must answer exception 2
+and leave the registers unchanged, writes to RW entries and FC23 reading R
+while writing RW must succeed. Prints the failures as JSON, exit code 1 if
+there are any, e.g.
+
+    python host/register_access_check.py
+"""
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modbus_constants import ModbusErrorCodes
+from modbus_data_block import ArrayDataBlock
+from modbus_rtu_slave import ModbusRtuMessageHandler
+from modbus_static_functions import crc16
+from register_map import R, RegisterMap, _TYPES
+
+DEVICE_ADDR = 1
+
+
+def with_crc(data):
+    crc = crc16(bytes(data))
+    return bytes(data) + bytes([crc & 0xFF, crc >> 8])
+
+
+def create():
+    registers = RegisterMap()
+    handler = ModbusRtuMessageHandler(device_addr=DEVICE_ADDR, debug=False,
+                                      hr=ArrayDataBlock({0: [0] * registers.count}))
+    registers.create_entities(handler.context)
+    return registers, handler
+
+
+def ask(handler, data):
+    return bytes(handler.handle_message(memoryview(with_crc(data))))
+
+
+def read(handler, address, count):
+    return ask(handler, [DEVICE_ADDR, 3, address >> 8, address & 0xFF, 0, count])
+
+
+def check():
+    registers, handler = create()
+    failures = []
+
+    def expect(name, response, ok, error_code=ModbusErrorCodes.AddressIsNotAvailabe):
+        if ok and response[1] & 0x80 or not ok and (not response[1] & 0x80 or response[2] != error_code):
+            failures.append({"check": name, "response": response.hex(), "expected": "answer" if ok else "exception"})
+
+    # reads: every entry, R entries with a register around them, the whole map
+    for name, address, value_type, access, default, minimum, maximum in registers.table:
+        length = _TYPES[value_type][1]
+        expect(f"FC3 {name}", read(handler, address, length), True)
+        if access == R:
+            start = max(0, address - 1)
+            end = min(registers.count, address + length + 1)
+            expect(f"FC3 around {name}", read(handler, start, end - start), True)
+    expect("FC3 whole map", read(handler, 0, registers.count), True)
+    # writes
+    for name, address, value_type, access, default, minimum, maximum in registers.table:
+        length = _TYPES[value_type][1]
+        before = read(handler, address, length)
+        value = default if isinstance(default, int) else 0
+        response = ask(handler, [DEVICE_ADDR, 6, 0, address, value >> 8, value & 0xFF])
+        expect(f"FC6 {name}", response, access != R)
+        data = [DEVICE_ADDR, 16, 0, address, 0, length, 2 * length] + [0, 1] * length
+        response = ask(handler, data)
+        expect(f"FC16 {name}", response, access != R)
+        if access == R and read(handler, address, length) != before:
+            failures.append({"check": f"unchanged {name}", "before": before.hex(),
+                             "after": read(handler, address, length).hex()})
+        handler.context.apply_changes()
+    # FC23: read R registers, write an RW one
+    receiver = registers.address("receiver_pressure")
+    normal = registers.address("normal_press")
+    response = ask(handler, [DEVICE_ADDR, 23, 0, receiver, 0, 8, 0, normal, 0, 1, 2, 0, 100])
+    expect("FC23 read R, write RW", response, True)
+    response = ask(handler, [DEVICE_ADDR, 23, 0, normal, 0, 1, 0, receiver, 0, 1, 2, 0, 100])
+    expect("FC23 write R", response, False)
+    return failures
+
+
+def main():
+    failures = check()
+    print(json.dumps({"failures": len(failures), "first_failures": failures[:10]}, indent=2))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""Run the unmodified Vacuumator3000 against the simulated board and plant (CPython).
+
+The control core runs its scheduler (Vacuumator3000.run) on the virtual
+clock of host/machine.py: every task run takes --task-us of CPU time plus
+the I2C transfers it makes (400 kHz line timing), idle time is slept, so
+the simulation runs faster than real time and is deterministic for a seed.
+--tight-loop calls tact() back to back instead, --tact-us each. The
+sensors are register models of the BMP280 behind a TCA9548A
+(host/i2c_devices.py) measuring host/plant.py. The master switches the
+receiver on at start (as the firmware does) and the tables on at
+--tables-at through the same register writes and command queue as FC6.
+Prints time-to-vacuum, valve activity and the simulation speed as JSON, e.g.
+
+    python host/simulate.py --seconds 60
+    python host/simulate.py --profile            # cProfile of the control loop
+    python host/simulate.py --tight-loop         # tact() without the scheduler
+"""
+import argparse
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import machine
+from i2c_devices import BMP280, TCA9548A
+from plant import VacuumPlant
+from modbus_context import ModbusSlaveContext
+from modbus_data_block import ArrayDataBlock
+from parameters import I2C_NUM, I2C_SDA, I2C_SCL, I2C_FREQ, VP
+from register_map import RegisterMap
+from vacuumator import Vacuumator3000
+
+MUX_ADDRESS = 0x70
+VALVE_PINS = {
+    "pump": VP.receiver_valve_pin,
+    "table1": VP.table1_valve_pin, "table2": VP.table2_valve_pin, "table3": VP.table3_valve_pin,
+    "outer1": VP.outer1_valve_pin, "outer2": VP.outer2_valve_pin, "outer3": VP.outer3_valve_pin,
+}
+
+
+class Simulation:
+    """The board: clock, I2C with the mux and four sensors, plant, register store and firmware."""
+
+    def __init__(self, virtual=True, tact_us=1000, seed=1, plant=None, task_us=250):
+        self.clock = machine.VirtualClock() if virtual else None
+        machine.use_clock(self.clock)
+        self.tact_us = tact_us
+        self.task_us = task_us
+        self.plant = plant or VacuumPlant()
+        self.i2c = machine.I2C(I2C_NUM, sda=machine.Pin(I2C_SDA), scl=machine.Pin(I2C_SCL), freq=I2C_FREQ)
+        self.mux = self.i2c.attach(MUX_ADDRESS, TCA9548A())
+        self.sensors = [self.mux.attach(channel, VP.sensor_address, BMP280(self.plant.source(channel), seed=seed + channel))
+                        for channel in range(4)]
+        self.registers = RegisterMap()
+        self.context = ModbusSlaveContext(hr=ArrayDataBlock({0: [0] * self.registers.count}))
+        self.vacuumator = Vacuumator3000(self.i2c, self.context, self.registers)
+        self.switches = dict.fromkeys(VALVE_PINS, 0)
+        # open times of the table valves, ms
+        self.impulses = []
+        for name, pin_id in VALVE_PINS.items():
+            machine.Pin.pins[pin_id].on_change = self.__counter(name)
+        self.tacts = 0
+
+    def __counter(self, name):
+        opened = [0]
+
+        def count(pin):
+            self.switches[name] += 1
+            if name.startswith("table"):
+                if pin.value():
+                    opened[0] = machine.ticks_us()
+                else:
+                    self.impulses.append((machine.ticks_us() - opened[0]) / 1000)
+        return count
+
+    def write(self, name, value):
+        """Master write of one register (FC6) and the Modbus core's apply_changes()."""
+        block = self.context.get_block(3)
+        address = self.registers.address(name)
+        block.setValues(address, [value])
+        self.context.mark_changed(block, address)
+        self.context.apply_changes()
+
+    def value(self, name):
+        return self.registers.entities[name].value
+
+    def tact(self):
+        self.vacuumator.tact()
+        self.tacts += 1
+        if self.clock is not None:
+            self.clock.advance_us(self.tact_us)
+
+    def step(self):
+        """One scheduler step as in Vacuumator3000.run()."""
+        if self.vacuumator.scheduler.step():
+            self.tacts += 1
+            if self.clock is not None:
+                self.clock.advance_us(self.task_us)
+
+    def close(self):
+        machine.use_clock(None)
+
+
+def run(seconds=60.0, tables_at=10.0, tact_us=1000, virtual=True, seed=1, scheduled=True, task_us=250):
+    sim = Simulation(virtual, tact_us, seed, task_us=task_us)
+    sim.vacuumator.scheduler.start()
+    plant = sim.plant
+    start_us = machine.ticks_us()
+    end_us = start_us + int(seconds * 1000000)
+    tables_us = start_us + int(tables_at * 1000000)
+    tables_on = False
+    receiver_vacuum_s = None
+    tables_vacuum_s = [None] * 3
+    first_stop_s = None
+    sensor_lag = 0.0
+    wall = time.perf_counter()
+    try:
+        while True:
+            now = machine.ticks_us()
+            if now >= end_us:
+                break
+            if not tables_on and now >= tables_us:
+                for num in (1, 2, 3):
+                    sim.write(f"table_{num}_work", 1)
+                tables_on = True
+            if scheduled:
+                sim.step()
+            else:
+                sim.tact()
+            plant.update()
+            elapsed = (machine.ticks_us() - start_us) / 1000000
+            pressures = plant.pressures
+            if receiver_vacuum_s is None and pressures[0] <= sim.value("stop_pump_press"):
+                receiver_vacuum_s = elapsed
+            if first_stop_s is None and sim.switches["pump"] >= 2:
+                first_stop_s = elapsed
+            if tables_on:
+                for idx in range(3):
+                    if tables_vacuum_s[idx] is None and pressures[idx + 1] <= sim.value("start_vac_table"):
+                        tables_vacuum_s[idx] = elapsed - tables_at
+            lag = abs(sim.registers.entities["receiver_pressure"].value - pressures[0])
+            if elapsed > 1.0 and lag > sensor_lag:
+                sensor_lag = lag
+    finally:
+        wall = time.perf_counter() - wall
+        sim.close()
+    simulated = (machine.ticks_us() - start_us) / 1000000 if not virtual else seconds
+    return {
+        "config": {"seconds": seconds, "tables_at": tables_at, "scheduler": scheduled,
+                   "tact_us": tact_us, "task_us": task_us, "virtual_clock": virtual, "seed": seed},
+        "receiver_time_to_vacuum_s": round(receiver_vacuum_s, 3) if receiver_vacuum_s is not None else None,
+        "pump_first_stop_s": round(first_stop_s, 3) if first_stop_s is not None else None,
+        "tables_time_to_vacuum_s": [round(value, 3) if value is not None else None for value in tables_vacuum_s],
+        "final_pressures_hpa": [round(value, 1) for value in plant.pressures],
+        "pump_work_percent": sim.value("pump_work_percent"),
+        "valve_switches": sim.switches,
+        "sensor_errors": [sim.value(name) for name in ("receiver_sensor_error", "table1_sensor_error",
+                                                       "table2_sensor_error", "table3_sensor_error")],
+        "max_receiver_sensor_lag_hpa": round(sensor_lag, 2),
+        "table_impulse_ms": [round(min(sim.impulses), 3), round(max(sim.impulses), 3)] if sim.impulses else None,
+        "tacts": sim.tacts,
+        "control_load_percent": sim.vacuumator.scheduler.load_percent if scheduled else None,
+        "tasks": {task.name: {"runs": task.runs, "max_late_us": task.max_late_us, "overruns": task.overruns}
+                  for task in sim.vacuumator.scheduler.tasks} if scheduled else None,
+        "acquisition_cycles": sim.vacuumator.acquisition.cycles,
+        "i2c_transactions": sim.i2c.transactions,
+        "sensor_conversions": [sensor.conversions for sensor in sim.sensors],
+        "wall_s": round(wall, 3),
+        "speedup": round(simulated / wall, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=60.0, help="simulated time")
+    parser.add_argument("--tables-at", type=float, default=10.0, help="switch the tables on at, s")
+    parser.add_argument("--tight-loop", action="store_true", help="tact() back to back, no scheduler")
+    parser.add_argument("--tact-us", type=int, default=1000, help="CPU time of one tact on the board")
+    parser.add_argument("--task-us", type=int, default=250, help="CPU time of one scheduled task")
+    parser.add_argument("--real-time", action="store_true", help="host clock instead of the virtual one")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--profile", action="store_true", help="cProfile the run, top functions to stderr")
+    parser.add_argument("--output", help="JSON file for the results")
+    args = parser.parse_args()
+    arguments = (args.seconds, args.tables_at, args.tact_us, not args.real_time, args.seed,
+                 not args.tight_loop, args.task_us)
+    if args.profile:
+        profile = cProfile.Profile()
+        result = profile.runcall(run, *arguments)
+        stream = io.StringIO()
+        pstats.Stats(profile, stream=stream).sort_stats("tottime").print_stats(25)
+        sys.stderr.write(stream.getvalue())
+    else:
+        result = run(*arguments)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Two-thread stress test of the register store seqlock (CPython).
+
+A writer thread keeps updating float values spread over two registers while
+a reader thread reads them through the same paths the firmware uses: a
+RegisterView (entities), ModbusSlaveContext.getValues and FC3 requests with
+the response cache. Every written value has both halves derived from one
+counter, so a torn read is detected exactly. Exits with status 1 on a torn
+read, e.g.
+
+    python host/store_stress.py --seconds 5
+    python host/store_stress.py --unsafe    # raw reads without the seqlock show torn values
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modbus_data_block import ArrayDataBlock
+from modbus_frames import ReadHoldingRegistersFrame
+from modbus_context import ModbusSlaveContext
+from modbus_static_functions import crc16
+
+REGISTER = 22
+PAIRS = 4
+
+
+def expected(counter):
+    """Float value with the counter in both registers, see check()."""
+    return struct.unpack(">f", struct.pack(">HH", 0x4000 | (counter & 0xFF), counter & 0xFFFF))[0]
+
+
+def check(words):
+    """True if the two registers of every pair were written by the same update."""
+    for pair in range(0, len(words), 2):
+        high, low = words[pair], words[pair + 1]
+        if high != 0x4000 | (low & 0xFF):
+            return False
+    return True
+
+
+def run(seconds=2.0, unsafe=False, switch_interval=1e-6):
+    context = ModbusSlaveContext(hr=ArrayDataBlock({0: [0] * (REGISTER + 2 * PAIRS)}))
+    block = context.get_block(3)
+    views = [context.get_view(3, REGISTER + 2 * pair, "f", word_order="big") for pair in range(PAIRS)]
+    frame = ReadHoldingRegistersFrame(context=context)
+    request = bytearray([1, 3, 0, REGISTER, 0, 2 * PAIRS, 0, 0])
+    crc = crc16(request, 0, 6)
+    request[6], request[7] = crc & 0xFF, crc >> 8
+    tx = memoryview(bytearray(256))
+    for view in views:
+        view.set(expected(0))
+    stats = {"writes": 0, "reads": 0, "torn": 0, "view_torn": 0, "fc3_torn": 0}
+    stop = threading.Event()
+
+    def writer():
+        counter = 0
+        while not stop.is_set():
+            counter += 1
+            if counter & 1:
+                # one register at a time, a switch between them tears an unprotected read
+                for pair in range(PAIRS):
+                    context.setValues(3, REGISTER + 2 * pair, [0x4000 | (counter & 0xFF), counter & 0xFFFF])
+            else:
+                for view in views:
+                    view.set(expected(counter))
+            stats["writes"] += 1
+
+    def reader():
+        while not stop.is_set():
+            if unsafe:
+                # element by element, no sequence check
+                words = [block.values[REGISTER + idx] for idx in range(2 * PAIRS)]
+            else:
+                words = list(context.getValues(3, REGISTER, 2 * PAIRS))
+            if not check(words):
+                stats["torn"] += 1
+            for view in views:
+                raw = view.get() if not unsafe else view._read()
+                if not check(struct.unpack(">HH", struct.pack(">f", raw))):
+                    stats["view_torn"] += 1
+            response = frame.execute(request, tx)
+            if not check(struct.unpack(">%dH" % (2 * PAIRS), bytes(response[3:3 + 4 * PAIRS]))):
+                stats["fc3_torn"] += 1
+            stats["reads"] += 1
+
+    old_interval = sys.getswitchinterval()
+    sys.setswitchinterval(switch_interval)
+    threads = [threading.Thread(target=writer), threading.Thread(target=reader)]
+    try:
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        sys.setswitchinterval(old_interval)
+    stats["unsafe"] = unsafe
+    stats["seconds"] = seconds
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument("--unsafe", action="store_true", help="raw and view reads without the seqlock (FC3 still uses it)")
+    args = parser.parse_args()
+    stats = run(args.seconds, args.unsafe)
+    print(json.dumps(stats))
+    torn = stats["torn"] + stats["view_torn"] + stats["fc3_torn"]
+    sys.exit(1 if torn and not args.unsafe else 0)
+
+
+if __name__ == "__main__":
+    main()
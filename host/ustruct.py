@@ -0,0 +1,2 @@
+"""Host stand-in for the MicroPython `ustruct` module."""
+from struct import *
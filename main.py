@@ -1,47 +1,78 @@
 import sys
-import time
 import _thread
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
 
 from machine import Pin, I2C, UART
-from modbus_data_block import DataBlock
+from modbus_data_block import ArrayDataBlock
 from modbus_rtu_slave_rs485 import ModbusRtuSlaveRS485
-from parameters import I2C_FREQ, I2C_NUM, I2C_SCL, I2C_SDA
+from parameters import (
+    I2C_FREQ, I2C_NUM, I2C_SCL, I2C_SDA, UART_BAUDRATE, BAUDRATES, PARITIES)
+from register_map import RegisterMap
 from vacuumator import Vacuumator3000
 
-uart0 = UART(0, baudrate=115200, tx=Pin(0), rx=Pin(1), bits=8, parity=None, stop=1)
-modbus_slave = ModbusRtuSlaveRS485(uart0, 1, False, dir_pin=4, hr=DataBlock({0: [0]*31}))
+uart0 = UART(0, baudrate=UART_BAUDRATE, tx=Pin(0), rx=Pin(1), bits=8, parity=None, stop=1)
+registers = RegisterMap()
+modbus_slave = ModbusRtuSlaveRS485(
+    uart0, 1, False, dir_pin=4, baudrate=UART_BAUDRATE, hr=ArrayDataBlock({0: [0]*registers.count}))
 value_store = modbus_slave.get_context()
 
 i2c = I2C(I2C_NUM, sda=Pin(I2C_SDA), scl=Pin(I2C_SCL), freq=I2C_FREQ)
-vacuumator = Vacuumator3000(i2c, value_store)
+vacuumator = Vacuumator3000(i2c, value_store, registers)
+
+baudrate_code = registers.entities["baudrate_code"]
+parity_code = registers.entities["parity_code"]
+
 
-second_continue = True
-sync = _thread.allocate_lock()
+def apply_line_settings():
+    # Вызывается после отправки ответа на запись, поэтому ответ уходит на старой скорости
+    baudrate_code.get_value()
+    parity_code.get_value()
+    if baudrate_code.value >= len(BAUDRATES) or parity_code.value >= len(PARITIES):
+        # недопустимое значение - возвращаем текущие настройки
+        baudrate_code.set_value(BAUDRATES.index(modbus_slave.baudrate))
+        parity_code.set_value(PARITIES.index(modbus_slave.parity))
+        return
+    modbus_slave.set_line(BAUDRATES[baudrate_code.value], PARITIES[parity_code.value])
 
+# оба регистра идут подряд, одна подписка на запись любого из них
+value_store.subscribe(3, registers.address("baudrate_code"), 2, apply_line_settings)
 
-def second_thread(second_continue, vacuumator):
+
+def second_thread(vacuumator):
     try:
         print("Second thread started")
-        while second_continue:
-            vacuumator.tact()
+        vacuumator.run()
     except BaseException as err:
         sys.print_exception(err)
     finally:
         print("Second thread stoped")
 
-bufferSTDINthread = _thread.start_new_thread(
-    second_thread, (second_continue, vacuumator))
 
-try:
+async def apply_changes():
+    # Применяем записанные мастером значения после отправки ответа
     while True:
-        modbus_slave.receive()
-        if value_store.changed:
-            vacuumator.update_store_values()
-            value_store.changed = False
-        time.sleep(.0001)
+        await modbus_slave.changed_event.wait()
+        modbus_slave.changed_event.clear()
+        vacuumator.update_store_values()
+
+
+async def main():
+    asyncio.create_task(apply_changes())
+    await modbus_slave.serve(asyncio.StreamReader(uart0))
+
+vacuumator.start()
+bufferSTDINthread = _thread.start_new_thread(second_thread, (vacuumator,))
+
+try:
+    asyncio.run(main())
 except KeyboardInterrupt:
     print("Keyboard EXIT")
 finally:
-    second_continue = False
-    time.sleep(.1)
-    print("System STOPED")
\ No newline at end of file
+    modbus_slave.stop()
+    if not vacuumator.stop():
+        print("Second thread is not stoped")
+    asyncio.new_event_loop()
+    print("System STOPED")
@@ -1,11 +1,11 @@
-from modbus_data_block import DataBlock
+from modbus_data_block import ArrayDataBlock, RegisterView
 from modbus_static_functions import encode_float, decode_to_float, get_values_from_bytes, get_bytes_from_values
 
 class ModbusSlaveContext():
     """This creates a modbus data model with each data access stored in a block."""
 
     __fx_mapper = {2: "d", 4: "i"}
-    __fx_mapper.update([(i, "h") for i in (3, 6, 16)]) #22, 23
+    __fx_mapper.update([(i, "h") for i in (3, 6, 16, 23)]) #22
     __fx_mapper.update([(i, "c") for i in (1, 5, 15)])
     @classmethod
     def create(cls, **kwargs):
@@ -26,12 +26,19 @@ class ModbusSlaveContext():
         """
 
         self.store = {}
-        self.store["d"] = kwargs.get("di", DataBlock.create_empty())
-        self.store["c"] = kwargs.get("co", DataBlock.create_empty())
-        self.store["i"] = kwargs.get("ir", DataBlock.create_empty())
-        self.store["h"] = kwargs.get("hr", DataBlock.create_empty())
+        self.store["d"] = kwargs.get("di", ArrayDataBlock.create_empty())
+        self.store["c"] = kwargs.get("co", ArrayDataBlock.create_empty())
+        self.store["i"] = kwargs.get("ir", ArrayDataBlock.create_empty())
+        self.store["h"] = kwargs.get("hr", ArrayDataBlock.create_empty())
         self.zero_mode = kwargs.get("zero_mode", True)
         self.changed = False
+        # per block: dirty bitmap and {address: [subscription, ...]}
+        self._dirty = {}
+        self._subscribers = {}
+        self._dirty_ranges = []
+        self._pending = []
+        # per block: bitmap of the registers a master may only read
+        self._read_only = {}
         #for key,val in self.store.items():
         #    print(f"{key}: {val}")
 
@@ -50,6 +57,24 @@ class ModbusSlaveContext():
         """
         return self.__fx_mapper.get(fx, None)
 
+    def get_block(self, fc_as_hex):
+        """Return the datastore used by the function code or None."""
+        return self.store.get(self.decode(fc_as_hex))
+
+    def get_view(self, fc_as_hex, address, fmt="H", word_order="big", byte_order="big"):
+        """Return a RegisterView of a typed value or None if the datastore is not array backed.
+
+        :param fc_as_hex: The function we are working with
+        :param address: The starting address
+        :param fmt: struct format of the value, see RegisterView
+        """
+        if not self.zero_mode:
+            address = address + 1
+        block = self.get_block(fc_as_hex)
+        if not isinstance(block, ArrayDataBlock):
+            return None
+        return RegisterView(block, address, fmt, word_order, byte_order)
+
     def reset(self):
         """Reset all the datastores to their default values."""
         for datastore in iter(self.store.values()):
@@ -106,6 +131,105 @@ class ModbusSlaveContext():
         #_logger.debug(txt)
         self.store[self.decode(fc_as_hex)].setValues(address, values)
 
+    def subscribe(self, fc_as_hex, address, count, callback):
+        """Call `callback()` from apply_changes when a master wrote into the range.
+
+        :param fc_as_hex: The function we are working with
+        :param address: The starting address
+        :param count: The number of registers to watch
+        """
+        if not self.zero_mode:
+            address = address + 1
+        block = self.get_block(fc_as_hex)
+        subscribers = self._subscribers.setdefault(block, {})
+        # [callback, pending]
+        subscription = [callback, False]
+        for idx in range(address, address + count):
+            subscribers.setdefault(idx, []).append(subscription)
+
+    def protect(self, fc_as_hex, address, count=1):
+        """Make the range read only for a master, its writes are answered with exception 2.
+
+        :param fc_as_hex: The function we are working with
+        :param address: The starting address
+        :param count: The number of registers to protect
+        """
+        if not self.zero_mode:
+            address = address + 1
+        block = self.get_block(fc_as_hex)
+        read_only = self._read_only.get(block)
+        if read_only is None:
+            read_only = bytearray((len(block) + 7) // 8)
+            self._read_only[block] = read_only
+        for idx in range(address - block.address, address - block.address + count):
+            read_only[idx >> 3] |= 1 << (idx & 7)
+
+    def writable(self, block, address, count=1):
+        """Return False if a master may not write the range (see protect), used by the write frames."""
+        read_only = self._read_only.get(block)
+        if read_only is None:
+            return True
+        for idx in range(address - block.address, address - block.address + count):
+            if read_only[idx >> 3] & (1 << (idx & 7)):
+                return False
+        return True
+
+    def mark_changed(self, block, address, count=1):
+        """Mark registers written by a master as dirty, used by the write frames.
+
+        :param block: The datastore written to
+        :param address: The starting address in the block
+        :param count: The number of written registers
+        """
+        self.changed = True
+        dirty = self._dirty.get(block)
+        if dirty is None:
+            dirty = bytearray((len(block) + 7) // 8)
+            self._dirty[block] = dirty
+        subscribers = self._subscribers.get(block)
+        fresh = False
+        for idx in range(address - block.address, address - block.address + count):
+            mask = 1 << (idx & 7)
+            if dirty[idx >> 3] & mask:
+                continue
+            dirty[idx >> 3] |= mask
+            fresh = True
+            if subscribers is None:
+                continue
+            for subscription in subscribers.get(idx + block.address, ()):
+                if not subscription[1]:
+                    subscription[1] = True
+                    self._pending.append(subscription)
+        # only ranges that set a new bit, so the list stays shorter than the
+        # block between two apply_changes() calls
+        if fresh:
+            self._dirty_ranges.append((block, address, count))
+
+    def is_dirty(self, fc_as_hex, address):
+        """Return True if a master wrote the register since the last apply_changes."""
+        if not self.zero_mode:
+            address = address + 1
+        block = self.get_block(fc_as_hex)
+        dirty = self._dirty.get(block)
+        if dirty is None or not block.validate(address):
+            return False
+        idx = address - block.address
+        return bool(dirty[idx >> 3] & (1 << (idx & 7)))
+
+    def apply_changes(self):
+        """Notify subscribers of all the registers written since the previous call, once each."""
+        pending = self._pending
+        self._pending = []
+        for block, address, count in self._dirty_ranges:
+            dirty = self._dirty[block]
+            for idx in range(address - block.address, address - block.address + count):
+                dirty[idx >> 3] &= ~(1 << (idx & 7))
+        self._dirty_ranges = []
+        self.changed = False
+        for subscription in pending:
+            subscription[1] = False
+            subscription[0]()
+
     def register(self, function_code, fc_as_hex, datablock=None):
         """Register a datablock with the slave context.
 
@@ -113,5 +237,5 @@ class ModbusSlaveContext():
         :param fc_as_hex: string representation of function code (e.g "cf" )
         :param datablock: datablock to associate with this function code
         """
-        self.store[fc_as_hex] = datablock or DataBlock.create()
+        self.store[fc_as_hex] = datablock or ArrayDataBlock.create()
         self.__fx_mapper[function_code] = fc_as_hex
\ No newline at end of file
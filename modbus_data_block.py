@@ -1,8 +1,27 @@
+import struct
+import sys
+from array import array
 from modbus_exceptions import ParameterException
+try:
+    from _thread import allocate_lock
+except ImportError:
+    allocate_lock = None
+
+class _NoLock:
+    """Stand-in for builds without _thread, there is only one writer then."""
+
+    def acquire(self):
+        return True
+
+    def release(self):
+        pass
 
 class DataBlock:
     def __init__(self, values=None, mutable=True, empty=False):
         self.empty = empty
+        # grows by 2 on every change of the values, always even: an odd
+        # generation means a write in progress to the readers (see ArrayDataBlock)
+        self.generation = 0
         self.values = {}
         self._process_values(values)
         self.mutable = mutable
@@ -17,6 +36,9 @@ class DataBlock:
     def create_empty(cls):
         return cls({-1: 0}, empty=True)
 
+    def __len__(self):
+        return max(self.values.keys()) - self.address + 1
+
     def __iter__(self):
         if isinstance(self.values, dict):
             return iter(self.values.items())
@@ -29,9 +51,11 @@ class DataBlock:
         self.default_value = value
         self.values = [self.default_value] * count
         self.address = 0x00
+        self.generation += 2
 
     def reset(self):
         self.values = self.default_value.copy()
+        self.generation += 2
 
     def validate(self, address, count=1):
         if not count:
@@ -43,6 +67,7 @@ class DataBlock:
         return [self.values[i] for i in range(address, address + count)]
 
     def setValues(self, address, values, use_as_default=False):
+        self.generation += 2
         if isinstance(values, dict):
             new_offsets = list(set(values.keys()) - set(self.values.keys()))
             if new_offsets and not self.mutable:
@@ -81,4 +106,232 @@ class DataBlock:
             values = {}
         else:
             raise ParameterException("Values for datastore must be a list or dictionary")
-        _process_as_dict(values)
\ No newline at end of file
+        _process_as_dict(values)
+
+class ArrayDataBlock:
+    """DataBlock with registers stored in one contiguous array("H").
+
+    Accepts the same values as DataBlock (list or dict of values/lists),
+    the addresses of a dict must be contiguous. The block has a fixed size,
+    `address` is the address of the first register.
+
+    The block is a seqlock shared by the two cores: `generation` is odd while
+    a write is in progress and grows by 2 with every write. Writers are
+    serialised by a lock, readers never take it, they repeat the read if the
+    generation changed meanwhile (see read_begin).
+    """
+
+    def __init__(self, values=None, mutable=True, empty=False):
+        self.empty = empty
+        self.mutable = mutable
+        # seqlock sequence: odd - write in progress, changes on every write
+        self.generation = 0
+        self._write_lock = allocate_lock() if allocate_lock is not None else _NoLock()
+        self.address = 0
+        self.values = array("H")
+        self._process_values(values)
+        self.default_value = array("H", self.values)
+
+    @classmethod
+    def create(cls):
+        return cls(array("H", bytes(2 * 65536)))
+
+    @classmethod
+    def create_empty(cls):
+        return cls({-1: 0}, empty=True)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return enumerate(self.values, self.address)
+
+    def __str__(self):
+        return str(self.values)
+
+    def default(self, count, value=False):
+        self.write_begin()
+        try:
+            self.values = array("H", [int(value)] * count)
+            self.default_value = array("H", self.values)
+            self.address = 0x00
+        finally:
+            self.write_end()
+
+    def reset(self):
+        self.write_begin()
+        try:
+            self.values[:] = self.default_value
+        finally:
+            self.write_end()
+
+    def write_begin(self):
+        self._write_lock.acquire()
+        self.generation += 1
+
+    def write_end(self):
+        self.generation += 1
+        self._write_lock.release()
+
+    def read_begin(self):
+        """Return the sequence to check the read against, waits while a write is in progress."""
+        sequence = self.generation
+        while sequence & 1:
+            sequence = self.generation
+        return sequence
+
+    def read_retry(self, sequence):
+        """True if the values read since read_begin() may be torn."""
+        return self.generation != sequence
+
+    def validate(self, address, count=1):
+        if count <= 0:
+            return False
+        return self.address <= address and address + count <= self.address + len(self.values)
+
+    def getValues(self, address, count=1):
+        idx = address - self.address
+        while True:
+            sequence = self.read_begin()
+            values = self.values[idx:idx + count]
+            if not self.read_retry(sequence):
+                return values
+
+    def setValues(self, address, values, use_as_default=False):
+        self.write_begin()
+        try:
+            self._set_values(address, values)
+            if use_as_default:
+                self.default_value[:] = self.values
+        finally:
+            self.write_end()
+
+    def _set_values(self, address, values):
+        if isinstance(values, dict):
+            for idx, val in iter(values.items()):
+                self._set_values(idx, val)
+        elif isinstance(values, array):
+            if not self.validate(address, len(values)):
+                raise ParameterException(f"Offsets {address}:{address + len(values)} not in range")
+            idx = address - self.address
+            self.values[idx:idx + len(values)] = values
+        else:
+            if not isinstance(values, (list, tuple)):
+                values = [values]
+            if not self.validate(address, len(values)):
+                raise ParameterException(f"Offsets {address}:{address + len(values)} not in range")
+            idx = address - self.address
+            for val in values:
+                self.values[idx] = int(val) & 0xFFFF
+                idx += 1
+
+    def _process_values(self, values):
+        if isinstance(values, array):
+            self.values = array("H", values)
+            return
+        if isinstance(values, list):
+            values = {0: values}
+        elif values is None:
+            return
+        elif not isinstance(values, dict):
+            raise ParameterException("Values for datastore must be a list or dictionary")
+        items = []
+        for idx, val in iter(values.items()):
+            if not isinstance(val, (list, tuple)):
+                val = [val]
+            items.append((idx, val))
+        items.sort(key=lambda item: item[0])
+        self.address = items[0][0] if items else 0
+        end = self.address
+        for idx, val in items:
+            if idx != end:
+                raise ParameterException(f"Offset {end} is missing, addresses must be contiguous")
+            end += len(val)
+            for v_item in val:
+                self.values.append(int(v_item) & 0xFFFF)
+
+
+
+class RegisterView:
+    """Typed value kept in consecutive registers of an ArrayDataBlock.
+
+    Reads and writes go straight to the block storage with struct, no lists.
+
+    :param fmt: struct format of one value: "f" float32, "i"/"I" int32, "h"/"H" int16
+    :param word_order: order of the 16-bit words on the wire, "big" - high word first
+    :param byte_order: order of the bytes inside a register on the wire, "big" by the spec
+    """
+
+    def __init__(self, block, address, fmt="H", word_order="big", byte_order="big"):
+        size = struct.calcsize(fmt)
+        count = size // 2
+        if not block.validate(address, count):
+            raise ParameterException(f"Offsets {address}:{address + count} not in range")
+        self.block = block
+        self.index = address - block.address
+        self.count = count
+        # value bytes (big endian numbering) held by high and low byte of every register
+        self.high = []
+        self.low = []
+        for reg in range(count):
+            word = reg if word_order == "big" else count - 1 - reg
+            if byte_order == "big":
+                self.high.append(2 * word)
+                self.low.append(2 * word + 1)
+            else:
+                self.high.append(2 * word + 1)
+                self.low.append(2 * word)
+        # registers are native endian in the array, the layout may match a plain format
+        storage = []
+        for reg in range(count):
+            if sys.byteorder == "little":
+                storage += [self.low[reg], self.high[reg]]
+            else:
+                storage += [self.high[reg], self.low[reg]]
+        if storage == list(range(size)):
+            self.direct = ">" + fmt
+        elif storage == list(range(size - 1, -1, -1)):
+            self.direct = "<" + fmt
+        else:
+            self.direct = None
+        self.fmt = ">" + fmt
+        self.offset = 2 * self.index
+        # separate buffers, get and set may run on different cores
+        self.scratch = bytearray(size)
+        self.read_scratch = bytearray(size)
+
+    def get(self):
+        block = self.block
+        while True:
+            sequence = block.read_begin()
+            value = self._read()
+            if not block.read_retry(sequence):
+                return value
+
+    def _read(self):
+        if self.direct is not None:
+            return struct.unpack_from(self.direct, self.block.values, self.offset)[0]
+        values = self.block.values
+        scratch = self.read_scratch
+        for reg in range(self.count):
+            value = values[self.index + reg]
+            scratch[self.high[reg]] = value >> 8
+            scratch[self.low[reg]] = value & 0xFF
+        return struct.unpack_from(self.fmt, scratch, 0)[0]
+
+    def set(self, value):
+        block = self.block
+        if self.direct is None:
+            # pack outside of the write section, scratch belongs to this view
+            scratch = self.scratch
+            struct.pack_into(self.fmt, scratch, 0, value)
+        block.write_begin()
+        try:
+            if self.direct is not None:
+                struct.pack_into(self.direct, block.values, self.offset, value)
+            else:
+                values = block.values
+                for reg in range(self.count):
+                    values[self.index + reg] = (scratch[self.high[reg]] << 8) | scratch[self.low[reg]]
+        finally:
+            block.write_end()
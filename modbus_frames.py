@@ -1,222 +1,296 @@
-from modbus_static_functions import check_crc, crc16, pack_bitstring, unpack_bitstring, get_values_from_bytes, get_bytes_from_values
+from modbus_static_functions import crc16, unpack_bitstring, get_values_from_bytes, put_values, put_bits, append_crc
 from modbus_constants import ModbusErrorCodes
 
-functions = [0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x0F, 0x10]
-allowed_functions = [0x03, 0x06, 0x10]
+def get_error_response(device_addr, func_code, error_code):
+    """Encode an exception response once, it is returned as is afterwards."""
+    response = bytearray([device_addr, func_code | (1 << 7), error_code, 0, 0])
+    crc = crc16(response, 0, 3)
+    response[3] = crc & 0xFF
+    response[4] = crc >> 8
+    return bytes(response)
 
 class ModbusFrameBase:
-    def __init__(self, device_addr=1, func_code=0):
-        self.device_addr = device_addr
-        self.func_code = func_code
+    """Handler of one function code.
 
-    def execute(self, context):
-        """Override in derived Class"""
+    One instance per function code is created by ModbusFrameDispatcher
+    and reused for every request, the data block is bound once.
+    """
+    func_code = 0
+
+    def __init__(self, device_addr=1, context=None, func_code=None):
+        self.device_addr = device_addr
+        if func_code is not None:
+            self.func_code = func_code
+        self.context = None
+        self.block = None
+        self.offset = 0
+        self.address_error = get_error_response(device_addr, self.func_code, ModbusErrorCodes.AddressIsNotAvailabe)
+        if context is not None:
+            self.bind(context)
+
+    def bind(self, context):
+        """Bind to the data block of the context, call again after context.register."""
+        self.context = context
+        self.block = context.get_block(self.func_code)
+        self.offset = 0 if context.zero_mode else 1
+
+    def execute(self, frame, tx):
+        """Override in derived Class
+
+        :param frame: The request
+        :param tx: memoryview of the TX buffer to encode the response into
+        :returns: buffer with the response
+        """
         pass
 
-    def get_frame(self):
+    def get_frame(self, tx):
         """Override in derived Class"""
         pass
 
-    def get_error_frame(self, error_code):
-        return ModbusErrorFrame(device_addr=self.device_addr, func_code=self.func_code, error_code=error_code).get_frame()
-
-    @staticmethod
-    def parse_frame(frame, context):
-        device_addr = frame[0]
-        func_code = frame[1]
-        register = (frame[2]<<8) + frame[3]
-        count_or_data = (frame[4]<<8) + frame[5]
-        data = None
-        bc = None
-        if func_code in [0x0F, 0x10]:
-            bc = frame[6]
-            data = frame[7:7+bc]
-        if context.is_block_empty(func_code):
-            return ModbusErrorFrame(device_addr=device_addr, func_code=func_code, error_code=ModbusErrorCodes.AddressIsNotAvailabe)
-        if func_code == 1:
-            return ReadCoilsFrame(device_addr=device_addr, register=register, count=count_or_data)
-        elif func_code == 2:
-            return ReadDiscreteInputsFrame(device_addr=device_addr, register=register, count=count_or_data)
-        elif func_code == 3:
-            return ReadHoldingRegistersFrame(device_addr=device_addr, register=register, count=count_or_data)
-        elif func_code == 4:
-            return ReadInputRegistersFrame(device_addr=device_addr, register=register, count=count_or_data)
-        elif func_code == 5:
-            return WriteSingleCoilFrame(device_addr=device_addr, register=register, data=count_or_data)
-        elif func_code == 6:
-            return WriteSingleRegisterFrame(device_addr=device_addr, register=register, data=count_or_data)
-        elif func_code == 15:
-            return WriteMultipleCoilsFrame(device_addr=device_addr, register=register, count=count_or_data, byte_count=bc, data=data)
-        elif func_code == 16:
-            return WriteMultipleRegistersFrame(device_addr=device_addr, register=register, count=count_or_data, byte_count=bc, data=data)
-        else:
-            return ModbusErrorFrame(device_addr=device_addr, func_code=func_code, error_code=ModbusErrorCodes.FuncCodeCanNotBeHandle)
-
 class ModbusErrorFrame(ModbusFrameBase):
-    def __init__(self, device_addr=0, func_code=0, error_code=None):
-        func_code |= (1 << 7)
-        super().__init__(device_addr, func_code)
+    """Answers every request with the same precomputed exception response."""
+
+    def __init__(self, device_addr=1, func_code=0, error_code=None):
+        super().__init__(device_addr=device_addr, func_code=func_code)
         self.error_code = error_code
+        self.response = get_error_response(device_addr, func_code, error_code)
 
-    def get_frame(self):
-        response = bytearray([self.device_addr])
-        response += bytearray([self.func_code])
-        response += bytearray([self.error_code])
-        crc = crc16(response)
-        response += bytearray([crc&0xFF, crc>>8])
-        return response
+    def get_frame(self, tx):
+        return self.response
 
-    def execute(self, context):
-        return self.get_frame()
+    def execute(self, frame, tx):
+        return self.response
 
 """READ FRAMES"""
 
 class ModbusReadFrame(ModbusFrameBase):
-    def __init__(self, device_addr=1, func_code=0, register=0, count=1):
-        super().__init__(device_addr=device_addr, func_code=func_code)
-        self.register = register
-        self.count = count
-
-    def get_frame(self, values):
-        response = bytearray([self.device_addr])
-        response += bytearray([self.func_code])
-        response += bytearray([len(values)])
-        response += bytearray(values)
-        crc = crc16(response)
-        response += bytearray([crc&0xFF, crc>>8])
+    # max quantity of one request by the spec
+    max_count = 0x7D
+    # number of encoded responses kept for repeated polls, 0 - no cache
+    cache_size = 0
+
+    def __init__(self, device_addr=1, context=None, func_code=None):
+        super().__init__(device_addr=device_addr, context=context, func_code=func_code)
+        self.value_error = get_error_response(device_addr, self.func_code, ModbusErrorCodes.DataValueIsNotAvailable)
+        # key -> [block generation, response], keys in insertion order for eviction
+        self.cache = {}
+        self.cache_keys = []
+
+    def bind(self, context):
+        super().bind(context)
+        self.cache = {}
+        self.cache_keys = []
+
+    def execute(self, frame, tx):
+        register = ((frame[2] << 8) | frame[3]) + self.offset
+        count = (frame[4] << 8) | frame[5]
+        if not 0 < count <= self.max_count:
+            return self.value_error
+        if self.block is None or not self.block.validate(register, count):
+            return self.address_error
+        if not self.cache_size:
+            return self.get_frame(tx, self.encode(tx, self.block.getValues(register, count)))
+        key = register * (self.max_count + 1) + count
+        # taken before the read: a write from the other core makes the entry stale, not wrong
+        generation = self.block.generation
+        entry = self.cache.get(key)
+        if entry is not None and entry[0] == generation:
+            return entry[1]
+        response = self.get_frame(tx, self.encode(tx, self.block.getValues(register, count)))
+        if not generation & 1:
+            self.store(key, response, generation)
         return response
 
+    def store(self, key, response, generation):
+        """Keep a copy of the response valid while the block generation is unchanged."""
+        entry = self.cache.get(key)
+        if entry is not None:
+            # the length depends only on the key, reuse the buffer
+            entry[0] = generation
+            entry[1][:] = response
+            return
+        if len(self.cache_keys) >= self.cache_size:
+            del self.cache[self.cache_keys.pop(0)]
+        self.cache[key] = [generation, bytearray(response)]
+        self.cache_keys.append(key)
+
+    def encode(self, tx, values):
+        """Write values to tx from offset 3, return the end offset."""
+        return put_values(tx, 3, values)
+
+    def get_frame(self, tx, end):
+        """Complete the response whose data is already written to tx[3:end]."""
+        tx[0] = self.device_addr
+        tx[1] = self.func_code
+        tx[2] = end - 3
+        return tx[0:append_crc(tx, end)]
+
 class ReadCoilsFrame(ModbusReadFrame):
-    def __init__(self, device_addr=1, register=0, count=1):
-        func_code = 1
-        super().__init__(device_addr=device_addr, func_code=func_code, register=register, count=count)
+    func_code = 1
+    max_count = 0x7D0
 
-    def execute(self, context):
-        if not context.validate(self.func_code, self.register, self.count):
-            return self.get_error_frame(ModbusErrorCodes.AddressIsNotAvailabe)
-        values = context.getValues(self.func_code, self.register, self.count)
-        return self.get_frame(pack_bitstring(values))
+    def encode(self, tx, values):
+        return put_bits(tx, 3, values)
 
 class ReadDiscreteInputsFrame(ModbusReadFrame):
-    def __init__(self, device_addr=1, register=0, count=1):
-        func_code = 2
-        super().__init__(device_addr=device_addr, func_code=func_code, register=register, count=count)
+    func_code = 2
+    max_count = 0x7D0
 
-    def execute(self, context):
-        if not context.validate(self.func_code, self.register, self.count):
-            return self.get_error_frame(ModbusErrorCodes.AddressIsNotAvailabe)
-        values = context.getValues(self.func_code, self.register, self.count)
-        return self.get_frame(pack_bitstring(values))
+    def encode(self, tx, values):
+        return put_bits(tx, 3, values)
 
 class ReadHoldingRegistersFrame(ModbusReadFrame):
-    def __init__(self, device_addr=1, register=0, count=1):
-        func_code = 3
-        super().__init__(device_addr=device_addr, func_code=func_code, register=register, count=count)
-
-    def execute(self, context):
-        if not context.validate(self.func_code, self.register, self.count):
-            return self.get_error_frame(ModbusErrorCodes.AddressIsNotAvailabe)
-        values = context.getValues(self.func_code, self.register, self.count)
-        return self.get_frame(get_bytes_from_values(values))
+    func_code = 3
+    cache_size = 4
 
 class ReadInputRegistersFrame(ModbusReadFrame):
-    def __init__(self, device_addr=1, register=0, count=1):
-        func_code = 4
-        super().__init__(device_addr=device_addr, func_code=func_code, register=register, count=count)
-
-    def execute(self, context):
-        if not context.validate(self.func_code, self.register, self.count):
-            return self.get_error_frame(ModbusErrorCodes.AddressIsNotAvailabe)
-        values = context.getValues(self.func_code, self.register, self.count)
-        return self.get_frame(get_bytes_from_values(values))
+    func_code = 4
 
 """WRITE FRAMES"""
 
 class ModbusWriteFrame(ModbusFrameBase):
-    def __init__(self, device_addr=1, func_code=0, register=0, data=None):
-        super().__init__(device_addr=device_addr, func_code=func_code)
-        self.register = register
-        self.data = data
+    pass
 
 class ModbusWriteSingleFrame(ModbusWriteFrame):
-    def __init__(self, device_addr=1, func_code=0, register=0, data=None):
-        super().__init__(device_addr=device_addr, func_code=func_code, register=register, data=data)
-
-    def get_frame(self, values):
-        response = bytearray([self.device_addr])
-        response += bytearray([self.func_code])
-        response += bytearray([self.register>>8, self.register&0xFF])
-        response += bytearray(values)
-        crc = crc16(response)
-        response += bytearray([crc&0xFF, crc>>8])
-        return response
+    def get_frame(self, frame):
+        """Successful single write answer is the echo of the request."""
+        return frame[0:8]
 
 class ModbusWriteMultipleFrame(ModbusWriteFrame):
-    def __init__(self, device_addr=1, func_code=0, register=0, count=1, byte_count=1, data=None):
-        super().__init__(device_addr=device_addr, func_code=func_code, register=register, data=data)
-        self.count = count
-        self.byte_count = byte_count
-
-    def get_frame(self):
-        response = bytearray([self.device_addr])
-        response += bytearray([self.func_code])
-        response += bytearray([self.register>>8, self.register&0xFF])
-        response += bytearray([self.count>>8, self.count&0xFF])
-        crc = crc16(response)
-        #print(f"{response} : {crc} : {hex(crc&0xFF)}, {hex(crc>>8)}")
-        response += bytearray([crc&0xFF, crc>>8])
-        return response
+    # max quantity of one request by the spec
+    max_count = 0x7B
+
+    def __init__(self, device_addr=1, context=None, func_code=None):
+        super().__init__(device_addr=device_addr, context=context, func_code=func_code)
+        self.value_error = get_error_response(device_addr, self.func_code, ModbusErrorCodes.DataValueIsNotAvailable)
+
+    def byte_count(self, count):
+        """Number of data bytes the request must carry for count values."""
+        return 2 * count
+
+    def get_frame(self, frame, tx):
+        """Answer with the first 6 bytes of the request (address and count)."""
+        for idx in range(6):
+            tx[idx] = frame[idx]
+        return tx[0:append_crc(tx, 6)]
 
 class WriteSingleCoilFrame(ModbusWriteSingleFrame):
-    def __init__(self, device_addr=1, register=0, data=None):
-        func_code = 5
-        super().__init__(device_addr=device_addr, func_code=func_code, register=register, data=data)
+    func_code = 5
 
-    def execute(self, context):
-        if not context.validate(self.func_code, self.register, 1):
-            return self.get_error_frame(ModbusErrorCodes.AddressIsNotAvailabe)
+    def execute(self, frame, tx):
+        register = ((frame[2] << 8) | frame[3]) + self.offset
+        if self.block is None or not self.block.validate(register, 1) \
+                or not self.context.writable(self.block, register, 1):
+            return self.address_error
         #context.setValues(self.func_code, self.register, unpack_bitstring(self.data))
-        context.setValues(self.func_code, self.register, self.data > 0)
-        values = context.getValues(self.func_code, self.register, 1)
-        return self.get_frame(pack_bitstring(values))
+        self.block.setValues(register, frame[4] > 0)
+        self.context.mark_changed(self.block, register)
+        return self.get_frame(frame)
 
 class WriteSingleRegisterFrame(ModbusWriteSingleFrame):
-    def __init__(self, device_addr=1, register=0, data=None):
-        func_code = 6
-        super().__init__(device_addr=device_addr, func_code=func_code, register=register, data=data)
-
-    def execute(self, context):
-        if not context.validate(self.func_code, self.register, 1):
-            return self.get_error_frame(ModbusErrorCodes.AddressIsNotAvailabe)
-        #context.setValues(self.func_code, self.register, get_values_from_bytes(self.data))
-        context.setValues(self.func_code, self.register, self.data)
-        values = context.getValues(self.func_code, self.register, 1)
-        context.changed = True
-        return self.get_frame(get_bytes_from_values(values))
+    func_code = 6
+
+    def execute(self, frame, tx):
+        register = ((frame[2] << 8) | frame[3]) + self.offset
+        if self.block is None or not self.block.validate(register, 1) \
+                or not self.context.writable(self.block, register, 1):
+            return self.address_error
+        self.block.setValues(register, (frame[4] << 8) | frame[5])
+        self.context.mark_changed(self.block, register)
+        return self.get_frame(frame)
 
 class WriteMultipleCoilsFrame(ModbusWriteMultipleFrame):
-    def __init__(self, device_addr=1, register=0, count=1, byte_count=1, data=None):
-        func_code = 15
-        super().__init__(device_addr=device_addr, func_code=func_code, register=register, count=count, byte_count=byte_count, data=data)
-        self.count = count
-        self.byte_count = byte_count
-
-    def execute(self, context):
-        if not context.validate(self.func_code, self.register, self.count):
-            return self.get_error_frame(ModbusErrorCodes.AddressIsNotAvailabe)
-        context.setValues(self.func_code, self.register, unpack_bitstring(self.data))
-        #values = context.getValues(self.func_code, self.register, self.count)
-        return self.get_frame()
+    func_code = 15
+    max_count = 0x7B0
+
+    def byte_count(self, count):
+        return (count + 7) // 8
+
+    def execute(self, frame, tx):
+        register = ((frame[2] << 8) | frame[3]) + self.offset
+        count = (frame[4] << 8) | frame[5]
+        if not 0 < count <= self.max_count or frame[6] != self.byte_count(count):
+            return self.value_error
+        if self.block is None or not self.block.validate(register, count) \
+                or not self.context.writable(self.block, register, count):
+            return self.address_error
+        self.block.setValues(register, unpack_bitstring(frame[7:7 + frame[6]])[0:count])
+        self.context.mark_changed(self.block, register, count)
+        return self.get_frame(frame, tx)
 
 class WriteMultipleRegistersFrame(ModbusWriteMultipleFrame):
-    def __init__(self, device_addr=1, register=0, count=1, byte_count=1, data=None):
-        func_code = 16
-        super().__init__(device_addr=device_addr, func_code=func_code, register=register, count=count, byte_count=byte_count, data=data)
-
-    def execute(self, context):
-        if not context.validate(self.func_code, self.register, self.count):
-            return self.get_error_frame(ModbusErrorCodes.AddressIsNotAvailabe)
-        context.setValues(self.func_code, self.register, get_values_from_bytes(self.data))
-        #values = context.getValues(self.func_code, self.register, self.count)
-        context.changed = True
-        return self.get_frame()
\ No newline at end of file
+    func_code = 16
+
+    def execute(self, frame, tx):
+        register = ((frame[2] << 8) | frame[3]) + self.offset
+        count = (frame[4] << 8) | frame[5]
+        if not 0 < count <= self.max_count or frame[6] != self.byte_count(count):
+            return self.value_error
+        if self.block is None or not self.block.validate(register, count) \
+                or not self.context.writable(self.block, register, count):
+            return self.address_error
+        self.block.setValues(register, get_values_from_bytes(frame[7:7 + frame[6]]))
+        self.context.mark_changed(self.block, register, count)
+        return self.get_frame(frame, tx)
+
+"""READ/WRITE FRAMES"""
+
+class ReadWriteMultipleRegistersFrame(ModbusReadFrame):
+    """FC23: write registers, then read registers in the same transaction."""
+    func_code = 23
+
+    def execute(self, frame, tx):
+        read_register = ((frame[2] << 8) | frame[3]) + self.offset
+        read_count = (frame[4] << 8) | frame[5]
+        write_register = ((frame[6] << 8) | frame[7]) + self.offset
+        write_count = (frame[8] << 8) | frame[9]
+        byte_count = frame[10]
+        if not 0 < read_count <= 0x7D or not 0 < write_count <= 0x79 or byte_count != 2 * write_count:
+            return self.value_error
+        if self.block is None or not self.block.validate(read_register, read_count) \
+                or not self.block.validate(write_register, write_count) \
+                or not self.context.writable(self.block, write_register, write_count):
+            return self.address_error
+        self.block.setValues(write_register, get_values_from_bytes(frame[11:11 + byte_count]))
+        self.context.mark_changed(self.block, write_register, write_count)
+        values = self.block.getValues(read_register, read_count)
+        return self.get_frame(tx, self.encode(tx, values))
+
+default_frames = [
+    ReadCoilsFrame, ReadDiscreteInputsFrame, ReadHoldingRegistersFrame, ReadInputRegistersFrame,
+    WriteSingleCoilFrame, WriteSingleRegisterFrame, WriteMultipleCoilsFrame, WriteMultipleRegistersFrame,
+    ReadWriteMultipleRegistersFrame
+]
+
+class ModbusFrameDispatcher:
+    """Function code -> handler table, one reused handler per function code."""
+
+    def __init__(self, context, device_addr=1):
+        self.context = context
+        self.device_addr = device_addr
+        self.handlers = {}
+        for frame_type in default_frames:
+            self.register(frame_type)
+
+    def register(self, frame_type, func_code=None):
+        """Register a handler class (derived from ModbusFrameBase) for a function code.
+
+        :param func_code: Function code, defaults to frame_type.func_code
+        """
+        handler = frame_type(device_addr=self.device_addr, context=self.context, func_code=func_code)
+        self.handlers[handler.func_code] = handler
+        return handler
+
+    def bind(self):
+        """Rebind all handlers to the current data blocks of the context."""
+        for handler in self.handlers.values():
+            if handler.context is not None:
+                handler.bind(self.context)
+
+    def dispatch(self, frame, tx):
+        handler = self.handlers.get(frame[1])
+        if handler is None:
+            # unsupported code, the exception response is encoded once and kept
+            handler = ModbusErrorFrame(self.device_addr, frame[1], ModbusErrorCodes.FuncCodeCanNotBeHandle)
+            self.handlers[frame[1]] = handler
+        return handler.execute(frame, tx)
@@ -1,28 +1,104 @@
 import time
-from modbus_frames import ModbusFrameBase, ModbusErrorFrame
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+from modbus_frames import ModbusFrameDispatcher, get_error_response
+from modbus_constants import ModbusErrorCodes
 from modbus_context import ModbusSlaveContext
-from modbus_static_functions import check_crc
+from modbus_static_functions import Crc16, get_request_length
+
+# Longest RTU frame is 256 bytes
+RX_BUFFER_SIZE = 256
+TX_BUFFER_SIZE = 256
+
+def wait_for_ms(awaitable, timeout_ms):
+    if hasattr(asyncio, "wait_for_ms"):
+        return asyncio.wait_for_ms(awaitable, timeout_ms)
+    return asyncio.wait_for(awaitable, timeout_ms / 1000)
 
 class ModbusRtuMessageHandler:
     def __init__(self, device_addr=1, debug=True, **kwargs):
         self.device_addr = device_addr
         self.context = ModbusSlaveContext.create(**kwargs)
         self.debug = debug
+        self.tx_buffer = bytearray(TX_BUFFER_SIZE)
+        self.tx_view = memoryview(self.tx_buffer)
+        self.dispatcher = ModbusFrameDispatcher(self.context, device_addr)
+        self.handler_errors = 0
+
+    def register(self, function_code, frame_type, fc_as_hex=None, datablock=None):
+        """Register a custom function code handler.
+
+        :param function_code: function code (int)
+        :param frame_type: handler class derived from ModbusFrameBase
+        :param fc_as_hex: datastore key for the function code, see ModbusSlaveContext.register
+        :param datablock: datablock to associate with this function code
+        """
+        if fc_as_hex is not None:
+            self.context.register(function_code, fc_as_hex, datablock)
+            self.dispatcher.bind()
+        self.dispatcher.register(frame_type, function_code)
 
     def handle_message(self, frame):
-        received_message = ModbusFrameBase.parse_frame(frame, self.context)
-        result = received_message.execute(self.context)
-        return result
+        """Return the response buffer, valid until the next message.
+
+        A failing handler is answered with exception 4 instead of stopping the slave.
+        """
+        try:
+            return self.dispatcher.dispatch(frame, self.tx_view)
+        except Exception as er:
+            if self.debug: print(f"Modbus: Handler error {er!r} on {bytes(frame)}")
+            self.handler_errors += 1
+            return get_error_response(self.device_addr, frame[1], ModbusErrorCodes.ErrorDuringExevution)
 
 class ModbusRtuSlave:
     def __init__(self, uart, device_addr, debug, **kwargs):
         self.device_addr = device_addr
         self.uart = uart
-        self.handler = ModbusRtuMessageHandler(device_addr=device_addr, **kwargs)
+        self.handler = ModbusRtuMessageHandler(device_addr=device_addr, debug=debug, **kwargs)
         self.debug = debug
         self.stopped = False
-        self.frame = []
+        self.rx_buffer = bytearray(RX_BUFFER_SIZE)
+        self.rx_view = memoryview(self.rx_buffer)
+        self.rx_start = 0
+        self.rx_length = 0
+        self.last_rx_time = 0
+        self.crc_errors = 0
+        self.discarded_bytes = 0
+        self.foreign_frames = 0
+        self.crc = Crc16()
         self.error = 0
+        self.baudrate = kwargs.get("baudrate", 115200)
+        self.parity = kwargs.get("parity", None)
+        self.set_line(self.baudrate, self.parity)
+        # set after a master wrote registers, see serve()
+        self.changed_event = asyncio.Event()
+
+    def set_line(self, baudrate, parity=None):
+        """Apply baudrate and parity (None, 0 - even, 1 - odd) to the UART, call between frames."""
+        self.uart.init(baudrate=baudrate, bits=8, parity=parity, stop=1)
+        self.baudrate = baudrate
+        self.parity = parity
+        self.set_timing(baudrate, parity)
+        if self.debug: print(f"Modbus: baudrate {baudrate}, parity {parity}, t3.5 {self.inter_frame_timeout} us")
+
+    def set_timing(self, baudrate, parity=None):
+        """Calculate character time and the inter-frame (t3.5) timeout in us.
+
+        Frames are told apart by t3.5 only, the received bytes carry no arrival
+        times to check the inter-character (t1.5) gap against.
+        """
+        # start bit, 8 data bits, parity bit, 1 stop bit
+        bits = 10 if parity is None else 11
+        self.char_time = (bits * 1000000 + baudrate - 1) // baudrate
+        if baudrate > 19200:
+            # fixed value recommended by the spec for high baudrates
+            self.inter_frame_timeout = 1750
+        else:
+            self.inter_frame_timeout = 7 * self.char_time // 2
+        # for serve(), asyncio waits in whole ms
+        self.inter_frame_timeout_ms = (self.inter_frame_timeout + 999) // 1000
 
     def stop(self):
         self.stopped = True
@@ -35,49 +111,139 @@ class ModbusRtuSlave:
             if self.debug: print("Modbus: ModbusRtuSlaveCustom started")
             self.uart.read() #clear buffer
             while not self.stopped:
-                receive()
+                self.receive()
                 time.sleep(0.001)
         except BaseException as er:
             self.error = 1
 
     def receive(self):
-        if self.uart.any():
-            r_byte = self.uart.readline()
-            self.frame += r_byte
-            if self.check_received():
-                if self.debug: print(f"Modbus: Frame received: {self.frame}")
-                responce = self.handler.handle_message(self.frame)
-                self.frame = []
-                if responce is not None:
-                    self.send_answer(responce)
+        available = self.uart.any()
+        if not available:
+            # silent interval ends the frame, an incomplete one is garbage
+            if self.rx_length and time.ticks_diff(time.ticks_us(), self.last_rx_time) >= self.inter_frame_timeout:
+                self.drop_incomplete()
+            return
+        free = self.prepare_rx()
+        count = self.uart.readinto(self.rx_view[self.rx_length:], min(available, free))
+        if count:
+            self.process_rx(count)
+
+    async def serve(self, stream):
+        """Event driven receive loop, runs until stop().
+
+        :param stream: asyncio stream of the UART (asyncio.StreamReader(uart) on the board),
+            anything with `async readinto(buf)` works
+        """
+        self.stopped = False
+        if self.debug: print("Modbus: ModbusRtuSlave serving")
+        while not self.stopped:
+            self.prepare_rx()
+            buffer = self.rx_view[self.rx_length:]
+            if self.rx_length:
+                # incomplete frame: the rest must arrive before the silent interval
+                try:
+                    count = await wait_for_ms(stream.readinto(buffer), self.inter_frame_timeout_ms)
+                except asyncio.TimeoutError:
+                    self.drop_incomplete()
+                    continue
+            else:
+                count = await stream.readinto(buffer)
+            if count:
+                self.process_rx(count)
+                if self.handler.context.changed:
+                    self.changed_event.set()
+
+    def prepare_rx(self):
+        """Make room for new bytes, return free buffer size."""
+        if self.rx_start:
+            self.compact()
+        if self.rx_length == RX_BUFFER_SIZE:
+            if self.debug: print("Modbus: Receive buffer overflow! Clear frame")
+            self.discarded_bytes += self.rx_length
+            self.clear_frame()
+        return RX_BUFFER_SIZE - self.rx_length
+
+    def drop_incomplete(self):
+        if self.debug: print(f"Modbus: Silent interval, drop: {bytes(self.rx_view[self.rx_start:self.rx_length])}")
+        self.discarded_bytes += self.rx_length - self.rx_start
+        self.clear_frame()
+
+    def process_rx(self, count):
+        """Account `count` bytes just read into the buffer and answer complete frames."""
+        self.rx_length += count
+        self.last_rx_time = time.ticks_us()
+        # several pipelined requests may have arrived at once
+        frame_length = self.check_received()
+        while frame_length:
+            frame = self.rx_view[self.rx_start:self.rx_start + frame_length]
+            if self.debug: print(f"Modbus: Frame received: {bytes(frame)}")
+            # consumed first: the view stays valid until the next read
+            self.next_frame(frame_length)
+            responce = self.handler.handle_message(frame)
+            if responce is not None:
+                self.send_answer(responce)
+            frame_length = self.check_received()
+
+    def clear_frame(self):
+        self.rx_start = 0
+        self.rx_length = 0
+        self.crc.reset()
+
+    def next_frame(self, skip):
+        """Drop `skip` bytes from the buffer start, keeping the rest for the next parse."""
+        self.rx_start += skip
+        self.crc.reset()
+        if self.rx_start >= self.rx_length:
+            self.rx_start = 0
+            self.rx_length = 0
+
+    def compact(self):
+        """Move unparsed bytes to the buffer start."""
+        buffer = self.rx_buffer
+        start = self.rx_start
+        for idx in range(self.rx_length - start):
+            buffer[idx] = buffer[start + idx]
+        self.rx_length -= start
+        self.rx_start = 0
 
     def send_answer(self, responce):
-        if self.debug: print(f"Modbus: Answer: {responce}")
+        if self.debug: print(f"Modbus: Answer: {bytes(responce)}")
         self.uart.write(responce)
 
     def check_received(self):
-        length = len(self.frame)
-        if length == 0:
-            if self.debug: print(f"Modbus: Frame is empty!")
-            return False
-        if self.frame[0] != self.device_addr:
-            if self.debug: print(f"Modbus: Wrong address: {self.frame}! Clear frame")
-            self.frame = []
-            return False
-        if length < 8:
-            if self.debug: print(f"Modbus: Part of message received: {self.frame}! Wait another")
-            return False
-        if self.frame[1] in [15, 16]:
-            data_count = self.frame[6]
-            full_count = 9 + data_count
-            if length < full_count:
-                if self.debug: print(f"Modbus: Part of message received: {self.frame}! Wait another")
-                return False
-            frame = self.frame[0:full_count]
-        else:
-            frame = self.frame[0:9]
-        if not check_crc(frame):
-            if self.debug: print(f"Modbus: Bad crc: {frame}! Clear frame")
-            self.frame = []
-            return False
-        return True
\ No newline at end of file
+        """Return the length of a complete frame at rx_start or 0.
+
+        Leading bytes that can't start a valid frame are skipped one by one,
+        well-formed frames for other slaves are skipped as a whole.
+        """
+        frame = self.rx_buffer
+        while self.rx_start < self.rx_length:
+            start = self.rx_start
+            length = self.rx_length - start
+            full_count = get_request_length(frame, start, length)
+            if full_count > RX_BUFFER_SIZE:
+                self.discard_byte()
+                continue
+            # CRC is fed only with the bytes received since the previous check
+            end = start + min(length, full_count if full_count else length)
+            self.crc.update(frame, start + self.crc.length, end)
+            if not full_count or length < full_count:
+                if self.debug: print(f"Modbus: Part of message received: {bytes(frame[start:self.rx_length])}! Wait another")
+                return 0
+            if not self.crc.valid:
+                if frame[start] == self.device_addr:
+                    if self.debug: print(f"Modbus: Bad crc: {bytes(frame[start:start + full_count])}! Resync")
+                    self.crc_errors += 1
+                self.discard_byte()
+                continue
+            if frame[start] != self.device_addr:
+                if self.debug: print(f"Modbus: Wrong address: {bytes(frame[start:start + full_count])}! Skip frame")
+                self.foreign_frames += 1
+                self.next_frame(full_count)
+                continue
+            return full_count
+        return 0
+
+    def discard_byte(self):
+        self.discarded_bytes += 1
+        self.next_frame(1)
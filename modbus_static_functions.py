@@ -1,26 +1,91 @@
 import struct
+from array import array
 
-def check_crc(frame):
-    frame_length = len(frame)
-    if frame_length < 8:
-        return False
-    return crc16(frame[0:(frame_length-2)]) == (frame[frame_length-1]<<8)+frame[frame_length-2]
-
-def crc16(data):
-    offset = 0
-    length = len(data)
-    if data is None or offset < 0 or offset > len(data) - 1 and offset+length > len(data):
-        return 0
-    crc = 0xFFFF
-    for i in range(0, length):
-        crc ^= data[offset + i]
-        for j in range(0, 8):
-            if (crc & 1) > 0:
+def _create_crc16_table():
+    table = array("H", [0] * 256)
+    for idx in range(256):
+        crc = idx
+        for _ in range(8):
+            if crc & 1:
                 crc = (crc >> 1) ^ 0xA001
             else:
                 crc = crc >> 1
+        table[idx] = crc
+    return table
+
+_CRC16_TABLE = _create_crc16_table()
+
+def check_crc(frame, length=None):
+    """Check the trailing CRC of a frame (bytes, bytearray, memoryview or list).
+
+    :param length: Number of frame bytes to check (CRC included), defaults to len(frame)
+    """
+    if length is None:
+        length = len(frame)
+    if length < 8:
+        return False
+    return crc16(frame, 0, length - 2) == (frame[length - 1] << 8) + frame[length - 2]
+
+def crc16(data, start=0, end=None, crc=0xFFFF):
+    """Table driven Modbus CRC16 of data[start:end] without copying the slice.
+
+    :param crc: Initial value, pass a previous result to continue a calculation
+    """
+    if data is None:
+        return 0
+    if end is None:
+        end = len(data)
+    table = _CRC16_TABLE
+    for idx in range(start, end):
+        crc = (crc >> 8) ^ table[(crc ^ data[idx]) & 0xFF]
     return crc
 
+class Crc16:
+    """Incremental CRC16, fed with the bytes of a frame as they arrive.
+
+    The CRC of a whole frame including its own (little endian) CRC is zero,
+    so a frame is valid when `valid` is True after the last byte was fed.
+    """
+
+    def __init__(self):
+        self.crc = 0xFFFF
+        self.length = 0
+
+    def reset(self):
+        self.crc = 0xFFFF
+        self.length = 0
+
+    def update(self, data, start=0, end=None):
+        if end is None:
+            end = len(data)
+        self.crc = crc16(data, start, end, self.crc)
+        self.length += end - start
+        return self.crc
+
+    @property
+    def valid(self):
+        return self.length > 2 and self.crc == 0
+
+def get_request_length(frame, start=0, length=None):
+    """Expected length of the request starting at frame[start] by its function code.
+
+    :param length: Number of bytes available from start, defaults to the rest of frame
+    :returns: Full request length with CRC or 0 if more bytes are needed to tell
+    """
+    if length is None:
+        length = len(frame) - start
+    if length < 2:
+        return 0
+    if frame[start + 1] in (15, 16):
+        if length < 7:
+            return 0
+        return 9 + frame[start + 6]
+    if frame[start + 1] == 23:
+        if length < 11:
+            return 0
+        return 13 + frame[start + 10]
+    return 8
+
 def get_values_from_bytes(barray):
     values = []
     for idx in range(0, len(barray), 2):
@@ -28,11 +93,52 @@ def get_values_from_bytes(barray):
     return values
 
 def get_bytes_from_values(values):
-    barray = bytearray([])
-    for value in values:
-        barray += bytearray([value>>8, value&0xFF])
+    barray = bytearray(2 * len(values))
+    put_values(barray, 0, values)
     return barray
 
+def put_values(buffer, offset, values):
+    """Write 16-bit values big endian into buffer starting at offset.
+
+    :returns: Offset after the last written byte
+    """
+    for value in values:
+        buffer[offset] = value >> 8
+        buffer[offset + 1] = value & 0xFF
+        offset += 2
+    return offset
+
+def put_bits(buffer, offset, bits):
+    """Pack bits into buffer starting at offset, same layout as pack_bitstring.
+
+    :returns: Offset after the last written byte
+    """
+    packed = 0
+    mask = 1
+    for bit in bits:
+        if bit:
+            packed |= mask
+        mask <<= 1
+        if mask == 0x100:
+            buffer[offset] = packed
+            offset += 1
+            packed = 0
+            mask = 1
+    if mask != 1:
+        buffer[offset] = packed
+        offset += 1
+    return offset
+
+def append_crc(buffer, length):
+    """Write the CRC of buffer[0:length] right after it.
+
+    :returns: Frame length with CRC
+    """
+    crc = crc16(buffer, 0, length)
+    buffer[length] = crc & 0xFF
+    buffer[length + 1] = crc >> 8
+    return length + 2
+
 def pack_bitstring(bits):
     ret = b""
     i = packed = 0
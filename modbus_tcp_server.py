@@ -0,0 +1,245 @@
+import asyncio
+import time
+from modbus_data_block import ArrayDataBlock
+from modbus_rtu_slave import ModbusRtuMessageHandler
+from modbus_static_functions import append_crc, check_crc, crc16, get_request_length
+
+MBAP_HEADER_SIZE = 7
+# MBAP length: unit id and function code at least, the PDU is at most 253 bytes
+MBAP_MIN_LENGTH = 2
+MBAP_MAX_LENGTH = 254
+
+class ModbusTcpServer:
+    """Serves one ModbusRtuMessageHandler to many clients over the network (CPython asyncio).
+
+    framing "tcp" is Modbus TCP (MBAP header, no CRC), "rtu" is RTU frames over TCP.
+    Requests of all connections are executed one by one in arrival order by a
+    single worker, so the context is never accessed concurrently. Every connection
+    may have up to `pipeline_depth` requests in flight, answers keep request order.
+    A full request queue stops reading from the sockets (backpressure).
+    Writes are applied (context.apply_changes) right after their answer is encoded.
+    """
+
+    def __init__(self, handler, host="0.0.0.0", port=502, framing="tcp", queue_size=64, pipeline_depth=8, debug=False):
+        if framing not in ("tcp", "rtu"):
+            raise ValueError(f"Unknown framing {framing}")
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.framing = framing
+        self.pipeline_depth = pipeline_depth
+        self.debug = debug
+        self.requests = asyncio.Queue(queue_size)
+        self.server = None
+        self.worker = None
+        self.clients = set()
+        self.handled = 0
+
+    async def start(self):
+        self.worker = asyncio.create_task(self._work())
+        self.server = await asyncio.start_server(self._serve_client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        if self.debug: print(f"Modbus: {self.framing} server on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        # connections are served by their own tasks, the server doesn't stop them
+        clients = list(self.clients)
+        for task in clients:
+            task.cancel()
+        for task in clients:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def _work(self):
+        while True:
+            frame, future = await self.requests.get()
+            try:
+                response = self.handler.handle_message(memoryview(frame))
+            except Exception as er:
+                if self.debug: print(f"Modbus: Handle error: {er}")
+                response = None
+            self.handled += 1
+            if not future.cancelled():
+                # the handler reuses its TX buffer, keep a copy
+                future.set_result(bytes(response) if response is not None else None)
+            if self.handler.context.changed:
+                self.handler.context.apply_changes()
+
+    async def _serve_client(self, reader, writer):
+        task = asyncio.current_task()
+        self.clients.add(task)
+        responses = asyncio.Queue(self.pipeline_depth)
+        sender = asyncio.create_task(self._send(writer, responses))
+        cancelled = False
+        try:
+            while True:
+                if self.framing == "tcp":
+                    header, frame = await self._read_tcp(reader)
+                    if frame is None:
+                        # not Modbus TCP, close the connection
+                        break
+                else:
+                    header, frame = None, await self._read_rtu(reader)
+                    if frame is None:
+                        continue
+                future = asyncio.get_running_loop().create_future()
+                await responses.put((header, future))
+                await self.requests.put((frame, future))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            # stop(): the answers in flight are dropped. Not raised again, asyncio
+            # streams (3.11) log the connection task ending cancelled as an error
+            cancelled = True
+            sender.cancel()
+        finally:
+            if not cancelled:
+                await responses.put(None)
+            try:
+                await sender
+            except asyncio.CancelledError:
+                pass
+            writer.close()
+            self.clients.discard(task)
+
+    async def _read_tcp(self, reader):
+        """Read one request, return (header, RTU frame) or (header, None) for a bad MBAP header."""
+        header = await reader.readexactly(MBAP_HEADER_SIZE)
+        length = (header[4] << 8) | header[5]
+        if header[2] or header[3] or not MBAP_MIN_LENGTH <= length <= MBAP_MAX_LENGTH:
+            if self.debug: print(f"Modbus: Bad MBAP header: {bytes(header)}")
+            return header, None
+        pdu = await reader.readexactly(length - 1)
+        # handlers work with RTU frames: unit id, PDU, CRC
+        frame = bytearray(length + 2)
+        frame[0] = header[6]
+        frame[1:length] = pdu
+        append_crc(frame, length)
+        return header, frame
+
+    async def _read_rtu(self, reader):
+        frame = bytearray(await reader.readexactly(7))
+        length = get_request_length(frame)
+        if not length:
+            frame += await reader.readexactly(4)
+            length = get_request_length(frame)
+        frame += await reader.readexactly(length - len(frame))
+        if frame[0] != self.handler.device_addr or not check_crc(frame):
+            if self.debug: print(f"Modbus: Drop frame: {bytes(frame)}")
+            return None
+        return frame
+
+    async def _send(self, writer, responses):
+        while True:
+            item = await responses.get()
+            if item is None:
+                return
+            header, future = item
+            response = await future
+            if response is None:
+                continue
+            if header is not None:
+                # MBAP: transaction id, protocol id, length, request unit id, PDU without CRC
+                length = len(response) - 2
+                writer.write(header[0:4] + bytes([length >> 8, length & 0xFF, header[6]]) + response[1:length])
+            else:
+                writer.write(response)
+            try:
+                await writer.drain()
+            except ConnectionError:
+                return
+
+
+async def load_test(clients=100, requests=100, framing="tcp", pipeline=1):
+    """Run a server and `clients` concurrent clients with mixed FC3/FC6/FC16 traffic."""
+    handler = ModbusRtuMessageHandler(device_addr=1, debug=False, hr=ArrayDataBlock({0: [0] * 31}))
+    server = ModbusTcpServer(handler, host="127.0.0.1", port=0, framing=framing)
+    await server.start()
+    pdus = [
+        bytes([3, 0, 0, 0, 31]),
+        bytes([6, 0, 4, 1, 0xF4]),
+        bytes([16, 0, 0, 0, 4, 8, 0, 1, 0, 0, 0, 1, 0, 0]),
+        bytes([3, 0, 22, 0, 8]),
+    ]
+    latencies = []
+
+    def encode(idx, pdu):
+        if framing == "tcp":
+            return bytes([idx >> 8 & 0xFF, idx & 0xFF, 0, 0, 0, len(pdu) + 1, 1]) + pdu
+        frame = bytearray([1]) + pdu
+        crc = crc16(frame)
+        return bytes(frame + bytes([crc & 0xFF, crc >> 8]))
+
+    async def read_response(reader):
+        if framing == "tcp":
+            header = await reader.readexactly(MBAP_HEADER_SIZE)
+            await reader.readexactly(((header[4] << 8) | header[5]) - 1)
+            return
+        head = await reader.readexactly(3)
+        if head[1] & 0x80:
+            await reader.readexactly(2)
+        elif head[1] in (5, 6, 16):
+            await reader.readexactly(5)
+        else:
+            await reader.readexactly(head[2] + 2)
+
+    async def client(num):
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        for start in range(0, requests, pipeline):
+            batch = range(start, min(start + pipeline, requests))
+            sent = time.perf_counter()
+            for idx in batch:
+                writer.write(encode(idx, pdus[(num + idx) % len(pdus)]))
+            await writer.drain()
+            for _ in batch:
+                await read_response(reader)
+                latencies.append(time.perf_counter() - sent)
+        writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*[client(num) for num in range(clients)])
+    elapsed = time.perf_counter() - started
+    await server.stop()
+    latencies.sort()
+    count = len(latencies)
+    return {
+        "framing": framing,
+        "clients": clients,
+        "requests": count,
+        "requests_per_sec": round(count / elapsed, 1),
+        "p50_ms": round(latencies[count // 2] * 1000, 3),
+        "p99_ms": round(latencies[min(count - 1, count * 99 // 100)] * 1000, 3),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Modbus TCP / RTU over TCP server for the register model")
+    parser.add_argument("--framing", choices=("tcp", "rtu"), default="tcp")
+    parser.add_argument("--port", type=int, default=5020)
+    parser.add_argument("--load-test", action="store_true", help="run the load test instead of serving")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=100, help="requests per client")
+    parser.add_argument("--pipeline", type=int, default=1, help="requests in flight per client")
+    args = parser.parse_args()
+    if args.load_test:
+        print(asyncio.run(load_test(args.clients, args.requests, args.framing, args.pipeline)))
+    else:
+        message_handler = ModbusRtuMessageHandler(device_addr=1, debug=True, hr=ArrayDataBlock({0: [0] * 31}))
+        asyncio.run(ModbusTcpServer(message_handler, port=args.port, framing=args.framing, debug=True).serve_forever())
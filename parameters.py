@@ -8,7 +8,8 @@ class VP:
     normal_press = 1000
     pump_work_time = 20000
     impulse_time = 50
-    samples = 1
+    samples = 1  # окно фильтра давления по умолчанию
+    filter_type = 1  # PressureFilters.Median
     pressure_update_critical_time = 10000
     min_valve_cycle_period = 8000
 
@@ -21,40 +22,7 @@ class VP:
     outer2_valve_pin = 13
     outer3_valve_pin = 14
 
-    """store nums"""
-    vac_receiver_store_num = 0
-    vac_table1_store_num = 1
-    vac_table2_store_num = 2
-    vac_table3_store_num = 3
-
-    start_pump_press_store_num = 4
-    stop_pump_press_store_num = 5
-    start_vac_table_store_num = 6
-    normal_press_store_num = 7
-    pump_work_time_store_num = 8
-    impulse_time_store_num = 9
-    pump_work_percent_store_num = 10
-
-    # минимально допустимый период срабатывания клапана стола
-    min_valve_cycle_period_store_num = 30
-
-    receiver_valve_state_store_num = 11
-    table1_valve_state_store_num = 12
-    table2_valve_state_store_num = 13
-    table3_valve_state_store_num = 14
-    outer1_valve_state_store_num = 15
-    outer2_valve_state_store_num = 16
-    outer3_valve_state_store_num = 17
-
-    res_sensor_error_store_num = 18
-    table1_sensor_error_store_num = 19
-    table2_sensor_error_store_num = 20
-    table3_sensor_error_store_num = 21
-
-    receiver_pressure_store_num = 22
-    table1_pressure_store_num = 24
-    table2_pressure_store_num = 26
-    table3_pressure_store_num = 28
+    # номера регистров Modbus - в register_map.py
 
 
 class VacuumErrors:
@@ -65,16 +33,55 @@ class VacuumErrors:
     FilmError = 4  # Плёнка плохо прилегает или отсутствует
 
 
+class PressureFilters:
+    Off = 0
+    Median = 1
+    Average = 2  # скользящее среднее
+    Ema = 3  # экспоненциальное сглаживание, alpha = 2 / (окно + 1)
+
+
 # I2C константы
 I2C_NUM = 1
 I2C_SDA = 2
 I2C_SCL = 3
 I2C_FREQ = 400 * 1000
 
+# UART константы
+UART_BAUDRATE = 115200
+BAUDRATES = (9600, 19200, 38400, 57600, 115200)
+# нет, even, odd (значения parity для machine.UART)
+PARITIES = (None, 0, 1)
+# Тайминги Modbus RTU (ModbusRtuSlave.set_timing): конец кадра - тишина t3.5,
+# 3.5 символа до 19200 бод и 1750 мкс выше. Межсимвольный интервал t1.5 не
+# проверяется: байты приходят из UART (asyncio.StreamReader) без меток времени
+# прихода, поэтому разрыв внутри кадра не измерить. Кадр с разрывом больше t1.5,
+# но меньше t3.5 принимается, если совпала CRC; разрыв от t3.5 сбрасывает кадр.
+
 # Константы
 PRESSURE_RELEASE_TIME_MS = 200
 I2C_RETRIES = 10
 VALVE_OPENED_TOO_FAST_MAX_COUNT = 10
+# Наибольшее окно фильтра давления
+FILTER_MAX_WINDOW = 16
+# Размер очереди команд от ядра Modbus к ядру управления (степень двойки)
+COMMAND_QUEUE_SIZE = 16
+
+# Расчёт давления BMP280: 0 - 64 бит (эталон), 1 - 32 бит (без больших int), 2 - float
+BMP280_COMPENSATION = 1
+# t_fine BMP280 пересчитывается, если сырая температура ушла больше чем на порог
+# или прошло больше интервала, мс. 1 LSB ~ 0.0003 C и ~0.05 Па давления при
+# 1013 гПа (~0.02 Па при 500 гПа, меньше в вакууме), порог 32 - до ~1.6 Па.
+# Наибольшая ошибка против полного расчёта (host/bmp280_trace.py, синтетическая
+# откачка): 1.6 Па для 64 бит и float, 6 Па для 32 бит - округления 32 битного
+# расчёта усиливают сдвиг t_fine (те же 6 Па при пороге 16, 0 при пороге до 8:
+# 16 битная температура меняется шагами по 16 LSB)
+BMP280_T_FINE_THRESHOLD = 32
+BMP280_T_FINE_INTERVAL_MS = 1000
 
-# Значение давления при отсутствии готовых данных на BMP280
-BMP280_NO_DATA_AVAILABLE = 628.0041
+# Периоды задач ядра управления, мкс (scheduler.py): столы, команды мастера,
+# опрос датчиков, ресивер, статистика. Импульс клапана стола точен до периода стола
+TABLE_PERIOD_US = 2000
+COMMANDS_PERIOD_US = 10000
+ACQUISITION_PERIOD_US = 1000
+RECEIVER_PERIOD_US = 10000
+STATS_PERIOD_US = 1000000
@@ -0,0 +1,78 @@
+from array import array
+from parameters import PressureFilters, FILTER_MAX_WINDOW
+
+
+class PressureFilter:
+    """Фильтр давления на кольцевом буфере фиксированного размера.
+
+    Значения - целые Па. Скользящее среднее и экспоненциальный фильтр
+    обновляются за O(1) (текущая сумма / накопитель), медиана держит
+    отсортированную копию окна и сдвигает в ней не больше window элементов.
+    Память выделяется только в конструкторе.
+    """
+    def __init__(self, kind=PressureFilters.Off, window=1, max_window=FILTER_MAX_WINDOW):
+        self.max_window = max_window
+        self.ring = array("l", [0] * max_window)
+        self.sorted = array("l", [0] * max_window)
+        self.configure(kind, window)
+
+    def configure(self, kind, window):
+        self.kind = kind
+        self.window = max(1, min(window, self.max_window))
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.pos = 0
+        self.total = 0
+        # накопитель экспоненциального фильтра, Па * 256
+        self.ema = 0
+
+    def add(self, value):
+        """Добавить значение, вернуть отфильтрованное."""
+        window = self.window
+        full = self.count == window
+        old = self.ring[self.pos]
+        self.ring[self.pos] = value
+        self.pos += 1
+        if self.pos == window:
+            self.pos = 0
+        if not full:
+            self.count += 1
+        kind = self.kind
+        if kind == PressureFilters.Average:
+            self.total += value - old if full else value
+            return (self.total + self.count // 2) // self.count
+        if kind == PressureFilters.Ema:
+            if self.count == 1 and not full:
+                self.ema = value << 8
+            else:
+                # alpha = 2 / (window + 1)
+                self.ema += ((value << 8) - self.ema) * 2 // (window + 1)
+            return (self.ema + 128) >> 8
+        if kind == PressureFilters.Median:
+            return self.__median(value, old if full else None)
+        return value
+
+    def __median(self, value, old):
+        ordered = self.sorted
+        count = self.count
+        if old is None:
+            idx = count - 1
+        else:
+            # убираем вытесненное значение
+            idx = 0
+            while ordered[idx] != old:
+                idx += 1
+            while idx < count - 1:
+                ordered[idx] = ordered[idx + 1]
+                idx += 1
+        # вставка нового значения с сохранением порядка
+        while idx > 0 and ordered[idx - 1] > value:
+            ordered[idx] = ordered[idx - 1]
+            idx -= 1
+        ordered[idx] = value
+        middle = count >> 1
+        if count & 1:
+            return ordered[middle]
+        return (ordered[middle - 1] + ordered[middle] + 1) >> 1
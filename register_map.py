@@ -0,0 +1,240 @@
+from entity import IntEntity, FloatEntity
+from modbus_exceptions import RegisterAddressException, ValueTypeException
+from parameters import VP, BAUDRATES, PARITIES, UART_BAUDRATE, FILTER_MAX_WINDOW, PressureFilters
+
+INT = "int"
+FLOAT = "float"
+# только чтение мастером / запись мастером
+R = "r"
+RW = "rw"
+
+_TYPES = {
+    # класс сущности, число регистров, тип в экспорте, порядок слов и байт
+    INT: (IntEntity, 1, "uint16", "big", "big"),
+    FLOAT: (FloatEntity, 2, "float32", "little", "little"),
+}
+
+# Таблица регистров хранения (функции 3/6/16):
+# имя, адрес, тип, доступ, значение по умолчанию, минимум, максимум
+REGISTER_MAP = (
+    ("receiver_work", 0, INT, RW, 0, 0, 1),
+    ("table_1_work", 1, INT, RW, 0, 0, 1),
+    ("table_2_work", 2, INT, RW, 0, 0, 1),
+    ("table_3_work", 3, INT, RW, 0, 0, 1),
+
+    ("start_pump_press", 4, INT, RW, VP.start_pump_press, 0, 1100),
+    ("stop_pump_press", 5, INT, RW, VP.stop_pump_press, 0, 1100),
+    ("start_vac_table", 6, INT, RW, VP.start_vac_table, 0, 1100),
+    ("normal_press", 7, INT, RW, VP.normal_press, 0, 1100),
+    ("pump_work_time", 8, INT, RW, VP.pump_work_time, 0, 0xFFFF),
+    ("impulse_time", 9, INT, RW, VP.impulse_time, 0, 0xFFFF),
+    ("pump_work_percent", 10, INT, R, 0, 0, 100),
+
+    ("receiver_valve_state", 11, INT, R, 0, 0, 1),
+    ("table1_valve_state", 12, INT, R, 0, 0, 1),
+    ("table2_valve_state", 13, INT, R, 0, 0, 1),
+    ("table3_valve_state", 14, INT, R, 0, 0, 1),
+    ("outer1_valve_state", 15, INT, R, 0, 0, 1),
+    ("outer2_valve_state", 16, INT, R, 0, 0, 1),
+    ("outer3_valve_state", 17, INT, R, 0, 0, 1),
+
+    ("receiver_sensor_error", 18, INT, R, 0, 0, 0xFFFF),
+    ("table1_sensor_error", 19, INT, R, 0, 0, 0xFFFF),
+    ("table2_sensor_error", 20, INT, R, 0, 0, 0xFFFF),
+    ("table3_sensor_error", 21, INT, R, 0, 0, 0xFFFF),
+
+    ("receiver_pressure", 22, FLOAT, R, 0.0, 0.0, 1200.0),
+    ("table1_pressure", 24, FLOAT, R, 0.0, 0.0, 1200.0),
+    ("table2_pressure", 26, FLOAT, R, 0.0, 0.0, 1200.0),
+    ("table3_pressure", 28, FLOAT, R, 0.0, 0.0, 1200.0),
+
+    # минимально допустимый период срабатывания клапана стола
+    ("min_valve_cycle_period", 30, INT, RW, VP.min_valve_cycle_period, 0, 0xFFFF),
+
+    # настройки RS-485: индекс скорости в BAUDRATES и чётность (индекс в PARITIES)
+    ("baudrate_code", 31, INT, RW, BAUDRATES.index(UART_BAUDRATE), 0, len(BAUDRATES) - 1),
+    ("parity_code", 32, INT, RW, 0, 0, len(PARITIES) - 1),
+
+    # очередь команд ядру управления: наибольшее число команд за такт,
+    # отброшено при переполнении, задержка последних применённых команд (мс)
+    ("command_queue_depth", 33, INT, R, 0, 0, 0xFFFF),
+    ("command_overflows", 34, INT, R, 0, 0, 0xFFFF),
+    ("command_latency_ms", 35, INT, R, 0, 0, 0xFFFF),
+
+    # фильтр давления каждого датчика: тип (PressureFilters) и окно в измерениях
+    ("receiver_filter_type", 36, INT, RW, VP.filter_type, 0, PressureFilters.Ema),
+    ("receiver_filter_window", 37, INT, RW, VP.samples, 1, FILTER_MAX_WINDOW),
+    ("table1_filter_type", 38, INT, RW, VP.filter_type, 0, PressureFilters.Ema),
+    ("table1_filter_window", 39, INT, RW, VP.samples, 1, FILTER_MAX_WINDOW),
+    ("table2_filter_type", 40, INT, RW, VP.filter_type, 0, PressureFilters.Ema),
+    ("table2_filter_window", 41, INT, RW, VP.samples, 1, FILTER_MAX_WINDOW),
+    ("table3_filter_type", 42, INT, RW, VP.filter_type, 0, PressureFilters.Ema),
+    ("table3_filter_window", 43, INT, RW, VP.samples, 1, FILTER_MAX_WINDOW),
+
+    # загрузка ядра управления задачами планировщика за последнюю секунду, %
+    ("control_load", 44, INT, R, 0, 0, 100),
+)
+
+
+def registers_count(table=REGISTER_MAP):
+    """Число регистров, нужное для размещения таблицы (с адреса 0)."""
+    return max(entry[1] + _TYPES[entry[2]][1] for entry in table)
+
+
+class RegisterMap:
+    """Карта регистров: проверяется один раз целиком, по ней создаются все сущности.
+
+    owners - индекс адрес -> номер записи таблицы, entities - имя -> сущность.
+    Регистры записей с доступом R защищаются от записи мастером.
+    """
+    def __init__(self, table=REGISTER_MAP, code=3):
+        self.table = table
+        self.code = code
+        self.count = registers_count(table)
+        self.index = {}
+        self.owners = [None] * self.count
+        self.entities = {}
+        # номера записей, записи в которые идут командами ядру управления
+        self.commands = set()
+        for num, entry in enumerate(table):
+            self.__check_entry(num, entry)
+
+    def __check_entry(self, num, entry):
+        name, address, value_type, access, default, minimum, maximum = entry
+        if value_type not in _TYPES:
+            raise ValueTypeException(f"Unknown type [ name : {name} | type : {value_type} ]")
+        if access not in (R, RW):
+            raise ValueTypeException(f"Unknown access [ name : {name} | access : {access} ]")
+        if name in self.index:
+            raise ValueTypeException(f"Duplicate name [ name : {name} ]")
+        expected = float if value_type == FLOAT else int
+        if not isinstance(default, expected) or not minimum <= default <= maximum:
+            raise ValueTypeException(f"Wrong default [ name : {name} | value : {default} | range : {minimum}..{maximum} ]")
+        if address < 0:
+            raise RegisterAddressException(f"[ name : {name} | register : {address} ]")
+        for idx in range(address, address + _TYPES[value_type][1]):
+            if self.owners[idx] is not None:
+                other = self.table[self.owners[idx]][0]
+                raise RegisterAddressException(f"Overlap [ name : {name} | register : {idx} | owner : {other} ]")
+            self.owners[idx] = num
+        self.index[name] = num
+
+    def address(self, name):
+        return self.table[self.index[name]][1]
+
+    def create_entities(self, store):
+        """Создать сущности всех записей со значениями по умолчанию, вернуть словарь имя -> сущность.
+
+        Запись мастера в регистры только для чтения (R) отклоняется с исключением 2.
+        """
+        # одна проверка блока на всю карту вместо проверки в каждой сущности
+        if not store.validate(self.code, 0, self.count):
+            raise RegisterAddressException(f"[ code : {self.code} | registers : 0..{self.count - 1} ]")
+        for name, address, value_type, access, default, minimum, maximum in self.table:
+            entity_type = _TYPES[value_type][0]
+            entity = entity_type(address, default, store, self.code, validate=False)
+            self.entities[name] = entity
+        # соседние регистры R защищаются одним вызовом
+        start = None
+        for idx in range(self.count + 1):
+            read_only = idx < self.count and self.owners[idx] is not None \
+                and self.table[self.owners[idx]][3] == R
+            if read_only and start is None:
+                start = idx
+            elif not read_only and start is not None:
+                store.protect(self.code, start, idx - start)
+                start = None
+        return self.entities
+
+    def subscribe(self):
+        """Обновлять записываемые мастером значения при записи в их регистры.
+
+        Значение вне диапазона из таблицы заменяется предыдущим.
+        Регистры команд (subscribe_commands) пропускаются.
+        """
+        for num, (name, address, value_type, access, default, minimum, maximum) in enumerate(self.table):
+            if access == RW and num not in self.commands:
+                entity = self.entities[name]
+                entity.subscribe(self.__make_checker(entity, minimum, maximum))
+
+    def subscribe_commands(self, queue, names):
+        """Запись мастера в регистры names ставит команду (номер записи, значение) в queue."""
+        for name in names:
+            num = self.index[name]
+            if self.table[num][2] != INT or self.table[num][3] != RW:
+                raise ValueTypeException(f"Command register must be int rw [ name : {name} ]")
+            self.commands.add(num)
+            entity = self.entities[name]
+            entity.subscribe(self.__make_pusher(queue, num, entity))
+
+    def __make_pusher(self, queue, num, entity):
+        view = entity.view
+        def push():
+            if view is not None:
+                value = view.get()
+            else:
+                value = entity.get_from_store()[0]
+            queue.push(num, value)
+        return push
+
+    def apply_command(self, num, value):
+        """Применить команду на ядре управления, False если значение вне диапазона."""
+        name, address, value_type, access, default, minimum, maximum = self.table[num]
+        entity = self.entities[name]
+        if minimum <= value <= maximum:
+            entity.value = value
+            return True
+        # возвращаем в регистр действующее значение
+        old_value = entity.value
+        entity.value = None
+        entity.set_value(old_value)
+        return False
+
+    def resync_commands(self):
+        """Перечитать все регистры команд из хранилища (после переполнения очереди)."""
+        for num in self.commands:
+            entity = self.entities[self.table[num][0]]
+            if entity.view is not None:
+                value = entity.view.get()
+            else:
+                value = entity.get_from_store()[0]
+            if value != entity.value:
+                self.apply_command(num, value)
+
+    def __make_checker(self, entity, minimum, maximum):
+        def check():
+            old_value = entity.value
+            entity.get_value()
+            if not minimum <= entity.value <= maximum:
+                entity.value = None
+                entity.set_value(old_value)
+        return check
+
+    def export(self):
+        """Описание карты для мастеров (список словарей, пригоден для json)."""
+        result = []
+        for name, address, value_type, access, default, minimum, maximum in self.table:
+            _, length, type_name, word_order, byte_order = _TYPES[value_type]
+            result.append({
+                "name": name,
+                "function": self.code,
+                "address": address,
+                "registers": length,
+                "type": type_name,
+                "word_order": word_order,
+                "byte_order": byte_order,
+                "access": access,
+                "default": default,
+                "min": minimum,
+                "max": maximum,
+            })
+        return result
+
+    def to_json(self):
+        import json
+        return json.dumps(self.export())
+
+
+if __name__ == "__main__":
+    # python register_map.py > register_map.json
+    print(RegisterMap().to_json())
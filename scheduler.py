@@ -0,0 +1,103 @@
+import time
+
+
+class Task:
+    """Периодическая задача планировщика: func вызывается раз в period_us."""
+    def __init__(self, name, func, period_us, priority):
+        self.name = name
+        self.func = func
+        self.period_us = period_us
+        self.priority = priority
+        self.deadline = 0
+        self.runs = 0
+        # наибольшее опоздание запуска и число пропущенных периодов
+        self.max_late_us = 0
+        self.overruns = 0
+
+
+class Scheduler:
+    """Кооперативный планировщик с фиксированным периодом задач (ядро управления).
+
+    Задачи запускаются по сроку (ticks_us): из готовых выбирается задача
+    с меньшим числом priority, при равном приоритете - опоздавшая больше.
+    Задача, опоздавшая на целый период, идёт вне очереди, поэтому при
+    перегрузке задачи с низким приоритетом замедляются, но не останавливаются.
+    Следующий срок отсчитывается от предыдущего, а не от момента запуска,
+    поэтому период не зависит от длительности такта. Если задача пропустила
+    целый период, пропущенные запуски не догоняются. До ближайшего срока
+    ядро спит (time.sleep_ms / sleep_us), а не крутит пустой цикл.
+    """
+    def __init__(self, max_idle_us=1000, window_us=1000000):
+        self.tasks = []
+        # сон не дольше max_idle_us, чтобы stop() не ждал долго
+        self.max_idle_us = max_idle_us
+        # загрузка (%) считается по окнам window_us: так счётчики остаются малыми int
+        self.window_us = window_us
+        self.window_start = time.ticks_us()
+        self.window_idle_us = 0
+        self.load_percent = 0
+
+    def add(self, name, func, period_us, priority=0):
+        task = Task(name, func, period_us, priority)
+        task.deadline = time.ticks_us()
+        self.tasks.append(task)
+        self.tasks.sort(key=lambda item: item.priority)
+        return task
+
+    def start(self):
+        """Все задачи готовы к запуску сейчас, статистика сбрасывается."""
+        now = time.ticks_us()
+        for task in self.tasks:
+            task.deadline = now
+            task.runs = 0
+            task.max_late_us = 0
+            task.overruns = 0
+        self.window_start = now
+        self.window_idle_us = 0
+
+    def step(self):
+        """Запустить одну готовую задачу или уснуть до ближайшего срока. True если задача выполнялась."""
+        now = time.ticks_us()
+        elapsed = time.ticks_diff(now, self.window_start)
+        if elapsed >= self.window_us:
+            self.load_percent = 100 - self.window_idle_us * 100 // elapsed
+            self.window_start = now
+            self.window_idle_us = 0
+        best = None
+        best_late = 0
+        best_urgent = False
+        wait = self.max_idle_us
+        for task in self.tasks:
+            late = time.ticks_diff(now, task.deadline)
+            if late >= 0:
+                urgent = late >= task.period_us
+                # задачи отсортированы по приоритету
+                if best is None or (urgent and not best_urgent) or (
+                        urgent == best_urgent and (urgent or task.priority == best.priority) and late > best_late):
+                    best = task
+                    best_late = late
+                    best_urgent = urgent
+            elif -late < wait:
+                wait = -late
+        if best is None:
+            self.idle(wait)
+            return False
+        if best_late > best.max_late_us:
+            best.max_late_us = best_late
+        best.func()
+        best.runs += 1
+        deadline = time.ticks_add(best.deadline, best.period_us)
+        now = time.ticks_us()
+        if time.ticks_diff(now, deadline) >= 0:
+            best.overruns += 1
+            deadline = time.ticks_add(now, best.period_us)
+        best.deadline = deadline
+        return True
+
+    def idle(self, wait_us):
+        start = time.ticks_us()
+        if wait_us >= 1000:
+            time.sleep_ms(wait_us // 1000)
+        else:
+            time.sleep_us(wait_us)
+        self.window_idle_us += time.ticks_diff(time.ticks_us(), start)
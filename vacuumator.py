@@ -3,10 +3,14 @@ import time
 import bmp280
 from parameters import (
     VP, PRESSURE_RELEASE_TIME_MS, VALVE_OPENED_TOO_FAST_MAX_COUNT,
-    VacuumErrors)
+    COMMAND_QUEUE_SIZE, BMP280_COMPENSATION, BMP280_T_FINE_THRESHOLD,
+    BMP280_T_FINE_INTERVAL_MS, COMMANDS_PERIOD_US, ACQUISITION_PERIOD_US,
+    TABLE_PERIOD_US, RECEIVER_PERIOD_US, STATS_PERIOD_US, VacuumErrors)
+from command_queue import CommandQueue
+from scheduler import Scheduler
 from valve import Valve, ReceiverValve
-from entity import IntEntity
-from bus_sensor import Bus, BusSensor
+from register_map import RegisterMap
+from bus_sensor import Bus, BusSensor, BusAcquisition
 
 
 class Receiver:
@@ -23,7 +27,6 @@ class Receiver:
         self.pause_start = 0
 
     def tact(self):
-        self.bus_sensor.update_pressure()
         self.valve.calc_percent()
         if self.pause_start > 0:
             # Если пауза - держим насос выключенным
@@ -86,7 +89,6 @@ class Table:
         self.last_time_opened = time.ticks_ms()
 
     def tact(self):
-        self.bus_sensor.update_pressure()
         if self.bus_sensor.error.value != 0:
             self.table_valve.close()
             return
@@ -119,41 +121,67 @@ class Table:
                     self.outer_valve.close()
 
 
+# Регистры, запись в которые мастером передаётся ядру управления командами
+COMMAND_REGISTERS = (
+    "receiver_work", "table_1_work", "table_2_work", "table_3_work",
+    "start_pump_press", "stop_pump_press", "start_vac_table", "normal_press",
+    "pump_work_time", "impulse_time", "min_valve_cycle_period",
+    "receiver_filter_type", "receiver_filter_window", "table1_filter_type", "table1_filter_window",
+    "table2_filter_type", "table2_filter_window", "table3_filter_type", "table3_filter_window",
+)
+
+
 class Vacuumator3000:
-    def __init__(self, i2c, store):
+    def __init__(self, i2c, store, registers=None):
         bus = Bus(i2c)
         sensor = bmp280.BMP280(i2c_bus=i2c, addr=VP.sensor_address,
-                               use_case=bmp280.BMP280_CASE_HANDHELD_DYN)
-
-        self.receiver_work = IntEntity(VP.vac_receiver_store_num, 0, store)
-        self.table_1_work = IntEntity(VP.vac_table1_store_num, 0, store)
-        self.table_2_work = IntEntity(VP.vac_table2_store_num, 0, store)
-        self.table_3_work = IntEntity(VP.vac_table3_store_num, 0, store)
-
-        self.start_pump_press = IntEntity(
-            VP.start_pump_press_store_num, VP.start_pump_press, store)
-        self.stop_pump_press = IntEntity(
-            VP.stop_pump_press_store_num, VP.stop_pump_press, store)
-        self.start_vac_table = IntEntity(
-            VP.start_vac_table_store_num, VP.start_vac_table, store)
-        self.normal_press = IntEntity(
-            VP.normal_press_store_num, VP.normal_press, store)
-        self.pump_work_time = IntEntity(
-            VP.pump_work_time_store_num, VP.pump_work_time, store)
-        self.impulse_time = IntEntity(
-            VP.impulse_time_store_num, VP.impulse_time, store)
-        self.min_valve_cycle_period = IntEntity(
-            VP.min_valve_cycle_period_store_num, VP.min_valve_cycle_period, store)
+                               use_case=bmp280.BMP280_CASE_HANDHELD_DYN,
+                               compensation=BMP280_COMPENSATION,
+                               t_fine_threshold=BMP280_T_FINE_THRESHOLD,
+                               t_fine_interval_ms=BMP280_T_FINE_INTERVAL_MS)
+
+        # Все сущности создаются за один проход по карте регистров
+        self.store = store
+        self.registers = registers or RegisterMap()
+        entities = self.registers.create_entities(store)
+        self.entities = entities
+
+        self.receiver_work = entities["receiver_work"]
+        self.table_1_work = entities["table_1_work"]
+        self.table_2_work = entities["table_2_work"]
+        self.table_3_work = entities["table_3_work"]
+        self.start_pump_press = entities["start_pump_press"]
+        self.stop_pump_press = entities["stop_pump_press"]
+        self.start_vac_table = entities["start_vac_table"]
+        self.normal_press = entities["normal_press"]
+        self.pump_work_time = entities["pump_work_time"]
+        self.impulse_time = entities["impulse_time"]
+        self.min_valve_cycle_period = entities["min_valve_cycle_period"]
+
+        # Запись мастера в управляющие регистры становится командой, ядро управления
+        # применяет команды в начале такта. Остальные записываемые регистры
+        # обновляются на ядре Modbus при записи в них
+        self.commands = CommandQueue(COMMAND_QUEUE_SIZE)
+        self.registers.subscribe_commands(self.commands, COMMAND_REGISTERS)
+        self.registers.subscribe()
+        self.command_queue_depth = entities["command_queue_depth"]
+        self.command_overflows = entities["command_overflows"]
+        self.command_latency_ms = entities["command_latency_ms"]
+        self.command_latency_us = 0
+        # связанный метод создаётся один раз, а не в каждом такте
+        self._apply_command = self.__apply_command
 
         receiver_sensor = BusSensor(
-            bus, 0, sensor, store, samples=VP.samples,
-            error_store_num=VP.res_sensor_error_store_num,
-            pressure_store_num=VP.receiver_pressure_store_num
+            bus, 0, sensor,
+            error=entities["receiver_sensor_error"],
+            pressure=entities["receiver_pressure"],
+            filter_type=entities["receiver_filter_type"],
+            filter_window=entities["receiver_filter_window"]
         )
         receiver_valve = ReceiverValve(
-            VP.receiver_valve_pin, store,
-            state_store_num=VP.receiver_valve_state_store_num,
-            pump_work_percent_store_num=VP.pump_work_percent_store_num
+            VP.receiver_valve_pin,
+            is_open=entities["receiver_valve_state"],
+            percent=entities["pump_work_percent"]
         )
         self.receiver = Receiver(
             receiver_sensor, receiver_valve,
@@ -163,87 +191,104 @@ class Vacuumator3000:
             pump_work_time=self.pump_work_time
         )
 
-        t1_sensor = BusSensor(
-            bus, 1, sensor, store, samples=VP.samples,
-            error_store_num=VP.table1_sensor_error_store_num,
-            pressure_store_num=VP.table1_pressure_store_num
-        )
-        self.table_1 = self.__create_table(
-            store, t1_sensor, VP.table1_valve_pin,
-            table_state_store_num=VP.table1_valve_state_store_num,
-            outer_pin=VP.outer1_valve_pin,
-            outer_state_store_num=VP.outer1_valve_state_store_num,
-            working=self.table_1_work,
-            start_vac_table=self.start_vac_table,
-            impulse_time=self.impulse_time,
-            normal_press=self.normal_press,
-            start_pump_press=self.start_pump_press,
-            min_valve_cycle_period=self.min_valve_cycle_period
-        )
+        self.table_1 = self.__create_table(bus, sensor, 1, VP.table1_valve_pin, VP.outer1_valve_pin, self.table_1_work)
+        self.table_2 = self.__create_table(bus, sensor, 2, VP.table2_valve_pin, VP.outer2_valve_pin, self.table_2_work)
+        self.table_3 = self.__create_table(bus, sensor, 3, VP.table3_valve_pin, VP.outer3_valve_pin, self.table_3_work)
+        # Давление всех датчиков измеряется одновременно, Receiver и Table берут опубликованные значения
+        self.acquisition = BusAcquisition(
+            [receiver_sensor, self.table_1.bus_sensor, self.table_2.bus_sensor, self.table_3.bus_sensor], sensor)
+        self.receiver.working.set_value(1) # Включаем ресивер при старте
 
-        t2_sensor = BusSensor(
-            bus, 2, sensor, store, samples=VP.samples,
-            error_store_num=VP.table2_sensor_error_store_num,
-            pressure_store_num=VP.table2_pressure_store_num
-        )
-        self.table_2 = self.__create_table(
-            store, t2_sensor, VP.table2_valve_pin,
-            table_state_store_num=VP.table2_valve_state_store_num,
-            outer_pin=VP.outer2_valve_pin,
-            outer_state_store_num=VP.outer2_valve_state_store_num,
-            working=self.table_2_work,
-            start_vac_table=self.start_vac_table,
-            impulse_time=self.impulse_time,
-            normal_press=self.normal_press,
-            start_pump_press=self.start_pump_press,
-            min_valve_cycle_period=self.min_valve_cycle_period
-        )
+        # Задачи ядра управления со своим периодом: время импульсов клапанов
+        # не зависит от длительности чтения датчиков. Меньше priority - важнее,
+        # столы первыми: их импульсы самые короткие
+        self.control_load = entities["control_load"]
+        self.scheduler = Scheduler()
+        self.scheduler.add("table_1", self.table_1.tact, TABLE_PERIOD_US, 0)
+        self.scheduler.add("table_2", self.table_2.tact, TABLE_PERIOD_US, 0)
+        self.scheduler.add("table_3", self.table_3.tact, TABLE_PERIOD_US, 0)
+        self.scheduler.add("commands", self.apply_commands, COMMANDS_PERIOD_US, 1)
+        self.scheduler.add("acquisition", self.acquisition.poll, ACQUISITION_PERIOD_US, 2)
+        self.scheduler.add("receiver", self.receiver.tact, RECEIVER_PERIOD_US, 3)
+        self.scheduler.add("stats", self.update_stats, STATS_PERIOD_US, 4)
+        self.running = False
+        self.finished = True
 
-        t3_sensor = BusSensor(
-            bus, 3, sensor, store, samples=VP.samples,
-            error_store_num=VP.table3_sensor_error_store_num,
-            pressure_store_num=VP.table3_pressure_store_num
-        )
-        self.table_3 = self.__create_table(
-            store, t3_sensor, VP.table3_valve_pin,
-            table_state_store_num=VP.table3_valve_state_store_num,
-            outer_pin=VP.outer3_valve_pin,
-            outer_state_store_num=VP.outer3_valve_state_store_num,
-            working=self.table_3_work,
-            start_vac_table=self.start_vac_table,
-            impulse_time=self.impulse_time,
-            normal_press=self.normal_press,
-            start_pump_press=self.start_pump_press,
-            min_valve_cycle_period=self.min_valve_cycle_period
+    def __create_table(self, bus, sensor, num, table_pin, outer_pin, working):
+        entities = self.entities
+        bus_sensor = BusSensor(
+            bus, num, sensor,
+            error=entities[f"table{num}_sensor_error"],
+            pressure=entities[f"table{num}_pressure"],
+            filter_type=entities[f"table{num}_filter_type"],
+            filter_window=entities[f"table{num}_filter_window"]
         )
-        self.receiver.working.set_value(1) # Включаем ресивер при старте
-
-    def __create_table(
-            self, store, bus_sensor, table_pin, table_state_store_num,
-            outer_pin, outer_state_store_num, working, start_vac_table,
-            impulse_time, normal_press, start_pump_press, min_valve_cycle_period
-        ):
-        table_valve = Valve(table_pin, store, state_store_num=table_state_store_num)
-        outer_valve = Valve(outer_pin, store, state_store_num=outer_state_store_num)
+        table_valve = Valve(table_pin, entities[f"table{num}_valve_state"])
+        outer_valve = Valve(outer_pin, entities[f"outer{num}_valve_state"])
         return Table(
             bus_sensor, table_valve, outer_valve, working,
-            start_vac_table, impulse_time, normal_press, start_pump_press,
-            min_valve_cycle_period
+            self.start_vac_table, self.impulse_time, self.normal_press,
+            self.start_pump_press, self.min_valve_cycle_period
         )
 
     def update_store_values(self):
-        self.receiver_work.get_value()
-        self.table_1_work.get_value()
-        self.table_2_work.get_value()
-        self.table_3_work.get_value()
-        self.start_pump_press.get_value()
-        self.stop_pump_press.get_value()
-        self.start_vac_table.get_value()
-        self.normal_press.get_value()
-        self.pump_work_time.get_value()
-        self.impulse_time.get_value()
+        self.store.apply_changes()
+
+    def start(self):
+        """Подготовить запуск run(), вызывается до старта потока второго ядра.
+
+        Флаги выставляются здесь, а не в run(): stop(), вызванный до того, как
+        поток дошёл до run(), иначе вернулся бы сразу, а цикл затем не остановился бы.
+        """
+        self.running = True
+        self.finished = False
+
+    def run(self):
+        """Цикл управления (второе ядро): задачи планировщика до вызова stop(), см. start()."""
+        scheduler = self.scheduler
+        scheduler.start()
+        try:
+            while self.running:
+                scheduler.step()
+        finally:
+            self.running = False
+            self.finished = True
+
+    def stop(self, timeout_ms=1000):
+        """Остановить цикл управления и дождаться его завершения."""
+        self.running = False
+        start = time.ticks_ms()
+        while not self.finished and time.ticks_diff(time.ticks_ms(), start) < timeout_ms:
+            time.sleep_ms(1)
+        return self.finished
+
+    def apply_commands(self):
+        """Применить команды, поставленные ядром Modbus с прошлого такта."""
+        commands = self.commands
+        self.command_latency_us = 0
+        depth = commands.drain(self._apply_command)
+        if commands.resync:
+            # очередь переполнялась - берём актуальные значения из регистров
+            commands.resync = False
+            self.registers.resync_commands()
+        if depth > self.command_queue_depth.value:
+            self.command_queue_depth.set_value(depth)
+        self.command_overflows.set_value(commands.overflows & 0xFFFF)
+        if depth:
+            self.command_latency_ms.set_value(min((self.command_latency_us + 999) // 1000, 0xFFFF))
+
+    def __apply_command(self, code, value, latency_us):
+        self.registers.apply_command(code, value)
+        if latency_us > self.command_latency_us:
+            self.command_latency_us = latency_us
+
+    def update_stats(self):
+        self.control_load.set_value(self.scheduler.load_percent)
 
     def tact(self):
+        """Все задачи подряд один раз, без планировщика."""
+        self.apply_commands()
+        self.acquisition.poll()
         self.receiver.tact()
         self.table_1.tact()
         self.table_2.tact()
@@ -1,5 +1,4 @@
 from machine import Pin
-from entity import IntEntity
 import time
 
 '''
@@ -7,10 +6,10 @@ import time
 Запоминает состояние и время его последнего изменения
 '''
 class Valve:
-    def __init__(self, pin_num, store, state_store_num=0):
+    def __init__(self, pin_num, is_open):
         self.pin =  Pin(pin_num, Pin.OUT)
         self.pin.low()
-        self.is_open = IntEntity(state_store_num, 0, store)
+        self.is_open = is_open
         self.last_time_change = 0
 
     def open(self):
@@ -40,12 +39,12 @@ class Valve:
 в основном такте ресивера
 '''
 class ReceiverValve(Valve):
-    def __init__(self, pin_num, store, state_store_num=0, pump_work_percent_store_num=0):
-        super().__init__(pin_num, store, state_store_num=state_store_num)
+    def __init__(self, pin_num, is_open, percent):
+        super().__init__(pin_num, is_open)
         self.start_time = 0
         self.stop_time = 0
         self.full_work_time = 0
-        self.percent = IntEntity(pump_work_percent_store_num, 0, store)
+        self.percent = percent
 
     def open(self):
         if self.is_open.value == 1: